@@ -14,7 +14,11 @@ from .activity_fit_plugin_base import ActivityFitPluginBase
 from .monitoring_fit_plugin_base import MonitoringFitPluginBase
 from .activity_fit_file_processor import ActivityFitFileProcessor
 from .fit_data import FitData
+from .file_ledger import FileLedger
 from .fit_file_processor import FitFileProcessor
+from .import_transaction import ImportTransaction
+from .import_profiler import ImportProfiler
+from .import_registry import ImportRegistry
 from .garmin_connect_config_manager import GarminConnectConfigManager
 from .statistics import Statistics
 from .tcx import Tcx
@@ -28,6 +32,11 @@ from .checkup import Checkup
 
 from .copy import Copy
 from .download import Download
+from .rate_limiter import RateLimiter
+from .download_replay import ReplayAdapter, ReplayData, ReplayServer
+from .download_benchmark import DownloadBenchmark
+from .supabase_sync import SupabaseSync
+from .supabase_mock import MockPostgrest
 from .analyze import Analyze
 from .plugin_manager import PluginManager
 from .version import format_version, log_version, python_version_check
@@ -36,4 +45,9 @@ from .import_monitoring import GarminMonitoringFitData, GarminSleepFitData, Garm
     GarminSleepData, GarminRhrData, GarminSettingsFitData, GarminHydrationData
 from .activities_fit_data import GarminActivitiesFitData
 from .garmin_tcx_data import GarminTcxData
+from .json_archive import JsonArchive
+from .garmin_json_file_processor import GarminJsonFileProcessor
 from .garmin_json_data import GarminJsonSummaryData, GarminJsonDetailsData
+from .fit_import import FitImport
+from .import_pipeline import ImportPipeline, ImportRoute
+from .db_sync import DbSync, SyncTable
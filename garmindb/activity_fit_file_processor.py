@@ -10,7 +10,7 @@ import sys
 import fitfile
 
 from .garmindb import File, ActivitiesDb, Activities, ActivityRecords, ActivityLaps, ActivitySplits, ActivitiesDevices, StepsActivities, \
-    CycleActivities, ClimbingActivities, PaddleActivities
+    CycleActivities, ClimbingActivities, PaddleActivities, s_insert_or_ignore
 from .fit_file_processor import FitFileProcessor
 
 
@@ -22,18 +22,48 @@ root_logger = logging.getLogger()
 class ActivityFitFileProcessor(FitFileProcessor):
     """Class that takes a parsed activity FIT file object and imports it into a database."""
 
+    # Records are written a chunk at a time when streaming, the activity they reference has to be written first.
+    stream_priority_message_types = FitFileProcessor.priority_message_types + [fitfile.MessageType.session]
+
+    def __init__(self, db_params, plugin_manager=None, debug=0, commit_files=1, commit_rows=None):
+        """Return a new ActivityFitFileProcessor instance."""
+        super().__init__(db_params, plugin_manager, debug, commit_files, commit_rows)
+        self.garmin_act_db = None
+        self.garmin_act_db_plugins = set()
+
+    def __open_activities_db(self, plugin_names):
+        if self.transaction is not None:
+            # The new db instance gets its own session, commit first so the sessions don't contend for the database.
+            self.transaction.commit()
+        self.garmin_act_db = ActivitiesDb(self.db_params, self.debug - 1)
+        self.garmin_act_db_plugins.update(plugin_names)
+
     def write_file(self, fit_file):
         """Given a Fit File object, write all of its messages to the DB."""
-        self.activity_fit_file_plugins = [plugin for plugin in self.plugin_manager.get_file_processors('ActivityFit', fit_file).values()]
+        plugins = self.plugin_manager.get_file_processors('ActivityFit', fit_file)
+        self.activity_fit_file_plugins = list(plugins.values())
+        self._set_plugins(plugins)
         if len(self.activity_fit_file_plugins):
             root_logger.info("Loaded %d activity plugins %r for file %s", len(self.activity_fit_file_plugins), self.activity_fit_file_plugins, fit_file)
-        # Create the db after setting up the plugins so that plugin tables are handled properly
-        self.garmin_act_db = ActivitiesDb(self.db_params, self.debug - 1)
-        with self.garmin_db.managed_session() as self.garmin_db_session, self.garmin_act_db.managed_session() as self.garmin_act_db_session:
-            self._write_message_types(fit_file, fit_file.message_types)
-
-    def _plugin_dispatch(self, handler_name, *args, **kwargs):
-        return super()._plugin_dispatch(self.activity_fit_file_plugins, handler_name, *args, **kwargs)
+        # Create the db after setting up the plugins so that plugin tables are handled properly. Only plugins that are new to the db require a new one.
+        if self.garmin_act_db is None or not self.garmin_act_db_plugins.issuperset(plugins):
+            self.__open_activities_db(plugins)
+        self.activity_records = []
+        super().write_file(fit_file)
+
+    def _session_dbs(self):
+        """Return the session attribute names and databases that data from FIT files is written to."""
+        return dict(super()._session_dbs(), garmin_act_db_session=self.garmin_act_db)
+
+    def _write_buffered(self, fit_file):
+        """Write the rows that were buffered while processing messages to the database."""
+        super()._write_buffered(fit_file)
+        with self._profile_stage('records'):
+            self._write_activity_records(fit_file)
+
+    def ledger_db(self):
+        """Return the database that the processor writes the data from FIT files to."""
+        return ActivitiesDb(self.db_params, self.debug - 1)
 
     def _write_device_info_entry(self, fit_file, message_fields):
         device_serial_number = super()._write_device_info_entry(fit_file, message_fields)
@@ -46,42 +76,53 @@ class ActivityFitFileProcessor(FitFileProcessor):
 
     def _write_lap(self, fit_file, message_type, messages):
         """Write all lap messages to the database."""
-        for lap_num, message in enumerate(messages):
+        for lap_num, message in enumerate(messages, self._message_offset(message_type)):
             self._write_lap_entry(fit_file, message.fields, lap_num)
 
     def _write_split(self, fit_file, message_type, messages):
         """Write all split messages to the database."""
-        for split_num, message in enumerate(messages):
+        for split_num, message in enumerate(messages, self._message_offset(message_type)):
             self._write_split_entry(fit_file, message.fields, split_num)
 
     def _write_record(self, fit_file, message_type, messages):
-        """Write all record messages to the database."""
-        for record_num, message in enumerate(messages):
-            self._write_record_entry(fit_file, message.fields, record_num)
-
-    def _write_record_entry(self, fit_file, message_fields, record_num):
+        """Collect all record messages so they can be written to the database in bulk."""
+        activity_id = File.id_from_path(fit_file.filename)
+        record_offset = self._message_offset(message_type)
+        if record_offset == 0:
+            self.existing_records = ActivityRecords.s_get_record_numbers(self.garmin_act_db_session, activity_id)
+        for record_num, message in enumerate(messages, record_offset):
+            record = self._write_record_entry(fit_file, activity_id, message.fields, record_num)
+            if record_num not in self.existing_records:
+                self.activity_records.append(record)
+
+    def _write_record_entry(self, fit_file, activity_id, message_fields, record_num):
         # We don't get record data from multiple sources so we don't need to coellesce data in the DB.
         # It's fastest to just write the new data out if it doesn't currently exist.
-        activity_id = File.id_from_path(fit_file.filename)
         plugin_record = self._plugin_dispatch('write_record_entry', self.garmin_act_db_session, fit_file, activity_id, message_fields, record_num)
-        if not ActivityRecords.s_exists(self.garmin_act_db_session, {'activity_id' : activity_id, 'record' : record_num}):
-            record = {
-                'activity_id'                       : activity_id,
-                'record'                            : record_num,
-                'timestamp'                         : fit_file.utc_datetime_to_local(message_fields.timestamp),
-                'position_lat'                      : message_fields.get('position_lat'),
-                'position_long'                     : message_fields.get('position_long'),
-                'distance'                          : message_fields.get('distance'),
-                'cadence'                           : message_fields.get('cadence'),
-                'hr'                                : message_fields.get('heart_rate'),
-                'rr'                                : message_fields.get('respiration_rate'),
-                'altitude'                          : message_fields.get('altitude'),
-                'speed'                             : message_fields.get('speed'),
-                'temperature'                       : message_fields.get('temperature'),
-            }
-            record.update(plugin_record)
-            root_logger.debug("_write_record_entry activity_id %s, record %s doesn't exist", activity_id, record_num)
-            self.garmin_act_db_session.add(ActivityRecords(**record))
+        record = {
+            'activity_id'                       : activity_id,
+            'record'                            : record_num,
+            'timestamp'                         : fit_file.utc_datetime_to_local(message_fields.timestamp),
+            'position_lat'                      : message_fields.get('position_lat'),
+            'position_long'                     : message_fields.get('position_long'),
+            'distance'                          : message_fields.get('distance'),
+            'cadence'                           : message_fields.get('cadence'),
+            'hr'                                : message_fields.get('heart_rate'),
+            'rr'                                : message_fields.get('respiration_rate'),
+            'altitude'                          : message_fields.get('altitude'),
+            'speed'                             : message_fields.get('speed'),
+            'temperature'                       : message_fields.get('temperature'),
+        }
+        record.update(plugin_record)
+        return record
+
+    def _write_activity_records(self, fit_file):
+        """Write the collected record messages to the database with a single insert."""
+        # Flush pending ORM objects first so the activity row exists before its records are inserted.
+        self.garmin_act_db_session.flush()
+        count = s_insert_or_ignore(self.garmin_act_db_session, ActivityRecords, self.activity_records)
+        root_logger.debug("Wrote %d new records for %s", count, fit_file.filename)
+        self.activity_records = []
 
     def _write_lap_entry(self, fit_file, message_fields, lap_num):
         # we don't get laps data from multiple sources so we don't need to coellesce data in the DB.
@@ -8,7 +8,13 @@ import sys
 import logging
 import datetime
 import calendar
+import itertools
+import bisect
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
 
 import fitfile
 
@@ -16,19 +22,65 @@ from garmindb import summarydb
 from .garmindb import GarminDb, Attributes, Weight, Stress, RestingHeartRate, IntensityHR, Sleep
 from .garmindb import MonitoringDb, Monitoring, MonitoringHeartRate, MonitoringIntensity, MonitoringClimb
 from .garmindb import ActivitiesDb, Activities, StepsActivities
-from .garmindb import GarminSummaryDb, DaysSummary, DailySummary, WeeksSummary, MonthsSummary, YearsSummary
+from .garmindb import GarminSummaryDb, DaysSummary, DailySummary, WeeksSummary, MonthsSummary, YearsSummary, DirtyDays, BulkUpsert
+from .garmindb import DaysSummaryWeights, DaysRollup, UpsertBatch
 
 
 logger = logging.getLogger(__file__)
 logger.addHandler(logging.StreamHandler(stream=sys.stdout))
 
 
+@contextlib.contextmanager
+def _read_only_session(db):
+    # Summaries only read the databases they are calculated from, so their sessions refuse writes where the database supports it and are
+    # rolled back instead of committed. The session is bound to one connection so that the setting is undone on that connection, it stays with
+    # the connection when it goes back to the pool.
+    connection = db.engine.connect()
+    session = sessionmaker(bind=connection)()
+    dialect = connection.dialect.name
+    try:
+        if dialect == 'sqlite':
+            session.execute(text('PRAGMA query_only = ON'))
+        elif dialect == 'postgresql':
+            session.execute(text('SET TRANSACTION READ ONLY'))
+        yield session
+    finally:
+        session.close()
+        connection.rollback()
+        if dialect == 'sqlite':
+            connection.execute(text('PRAGMA query_only = OFF'))
+        connection.close()
+
+
+_worker_analyze = None
+
+
+def _init_worker(gc_config, debug, rollup):
+    global _worker_analyze
+    _worker_analyze = Analyze(gc_config, debug, rollup)
+
+
+def _calculate_year_rows(year, dirty_days):
+    return _worker_analyze._calculate_year_rows(year, dirty_days)
+
+
 class Analyze():
     """Object for analyzing health data from Garmin devices."""
 
-    def __init__(self, gc_config, debug):
-        """Return an instance of the Analyze class."""
+    def __init__(self, gc_config, debug, rollup=False, workers=1):
+        """
+        Return an instance of the Analyze class.
+
+        Parameters:
+        gc_config (GarminConnectConfigManager): the configuration the databases are found with
+        debug (int): the debug level of the databases
+        rollup (Boolean): if True, weeks, months, and years are rolled up from the days summaries instead of calculated from the raw data
+        workers (int): number of processes that calculate the summaries of years, the summary databases are always written from the calling process
+        """
         self.gc_config = gc_config
+        self.debug = debug
+        self.rollup = rollup
+        self.workers = workers
         self.garmin_db = GarminDb(self.gc_config.get_db_params(), debug)
         self.garmin_mon_db = MonitoringDb(self.gc_config.get_db_params(), debug)
         self.garmin_sum_db = GarminSummaryDb(self.gc_config.get_db_params(), debug)
@@ -37,60 +89,118 @@ class Analyze():
         self.measurement_system = Attributes.measurements_type(self.garmin_db)
         self.unit_strings = fitfile.units.unit_strings[self.measurement_system]
 
-    def __populate_hr_intensity(self, day_date, garmin_mon_session, garmin_sum_session, overwrite=False):
-        if IntensityHR.s_row_count_for_day(garmin_sum_session, day_date) == 0 or overwrite:
-            monitoring_rows = Monitoring._get_for_day(garmin_mon_session, day_date, not_none_col=Monitoring.intensity)
-            previous_ts = None
-            for monitoring in monitoring_rows:
-                # Heart rate value is for one minute, reported at the end of the minute. Only take HR values where the
-                # measurement period falls within the activity period.
-                if previous_ts is not None and (monitoring.timestamp - previous_ts).total_seconds() > 60:
-                    hr_rows = MonitoringHeartRate.s_get_for_period(garmin_mon_session, previous_ts, previous_ts + datetime.timedelta(seconds=60), not_none_col=monitoring.timestamp)
-                    for hr in hr_rows:
-                        entry = {
-                            'timestamp'     : hr.timestamp,
-                            'intensity'     : monitoring.intensity,
-                            'heart_rate'    : hr.heart_rate
-                        }
-                        IntensityHR.s_insert_or_update(garmin_sum_session, entry, ignore_none=True)
-                previous_ts = monitoring.timestamp
-
-    def __calculate_day_stats(self, day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        stats = DailySummary.get_daily_stats(garmin_session, day_date)
-        # prefer getting stats from the daily summary.
-        if stats.get('rhr_avg') is None:
-            stats.update(RestingHeartRate.get_daily_stats(garmin_session, day_date))
-        if stats.get('stress_avg') is None:
-            stats.update(Stress.get_daily_stats(garmin_session, day_date))
-        if stats.get('intensity_time') is None:
-            stats.update(MonitoringIntensity.get_daily_stats(garmin_mon_session, day_date))
-        if stats.get('floors') is None:
-            stats.update(MonitoringClimb.get_daily_stats(garmin_mon_session, day_date, self.measurement_system))
-        if stats.get('steps') is None:
-            stats.update(Monitoring.get_daily_stats(garmin_mon_session, day_date))
-        stats.update(MonitoringHeartRate.get_daily_stats(garmin_mon_session, day_date))
-        stats.update(IntensityHR.get_daily_stats(garmin_sum_session, day_date))
-        stats.update(Weight.get_daily_stats(garmin_session, day_date))
-        stats.update(Sleep.get_daily_stats(garmin_session, day_date))
-        # save it to the db
-        DaysSummary.s_insert_or_update(garmin_sum_session, stats)
-        summarydb.DaysSummary.s_insert_or_update(sum_session, stats)
-
-    def __calculate_days(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        days = Monitoring.s_get_days(garmin_mon_session, year)
-        if days:
-            for day in tqdm(days, unit='days'):
-                day_date = datetime.date(year, 1, 1) + datetime.timedelta(day - 1)
-                self.__populate_hr_intensity(day_date, garmin_mon_session, garmin_sum_session)
-                self.__calculate_day_stats(day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-        days = Activities.s_get_days(garmin_act_session, year)
+    @classmethod
+    def __consecutive_days(cls, day_dates):
+        runs = []
+        for day_date in day_dates:
+            if runs and day_date - runs[-1][-1] == datetime.timedelta(1):
+                runs[-1].append(day_date)
+            else:
+                runs.append([day_date])
+        return runs
+
+    def __populate_hr_intensity(self, day_dates, garmin_mon_session, garmin_sum_session, overwrite=False):
+        """Populate the heart rates measured during intensity periods with an as-of join of the sorted intensity and heart rate series of the days."""
+        if not overwrite:
+            populated_days = set(IntensityHR.s_get_days(garmin_sum_session, day_dates[0].year))
+            day_dates = [day_date for day_date in day_dates if day_date.timetuple().tm_yday not in populated_days]
+        hr_period = datetime.timedelta(seconds=60)
+        for run_day_dates in self.__consecutive_days(day_dates):
+            start_ts = datetime.datetime.combine(run_day_dates[0], datetime.time.min)
+            end_ts = datetime.datetime.combine(run_day_dates[-1], datetime.time.min) + datetime.timedelta(1)
+            monitoring_rows = (
+                garmin_mon_session.query(Monitoring.timestamp, Monitoring.intensity).filter(Monitoring.during(start_ts, end_ts))
+                .filter(Monitoring.intensity != None).order_by(Monitoring.timestamp, Monitoring.activity_type).all()  # noqa
+            )
+            # the heart rate period of the last intensity period of a day can end in the next day
+            hr_rows = (
+                garmin_mon_session.query(MonitoringHeartRate.timestamp, MonitoringHeartRate.heart_rate).filter(MonitoringHeartRate.during(start_ts, end_ts + hr_period))
+                .order_by(MonitoringHeartRate.timestamp).all()
+            )
+            hr_timestamps = [hr.timestamp for hr in hr_rows]
+            intensity_hr = BulkUpsert(garmin_sum_session, IntensityHR)
+            for _, day_monitoring_rows in itertools.groupby(monitoring_rows, key=lambda monitoring: monitoring.timestamp.date()):
+                previous_ts = None
+                for monitoring in day_monitoring_rows:
+                    # Heart rate value is for one minute, reported at the end of the minute. Only take HR values where the
+                    # measurement period falls within the activity period.
+                    if previous_ts is not None and (monitoring.timestamp - previous_ts).total_seconds() > 60:
+                        first_hr = bisect.bisect_left(hr_timestamps, previous_ts)
+                        last_hr = bisect.bisect_left(hr_timestamps, previous_ts + hr_period, first_hr)
+                        for hr in hr_rows[first_hr:last_hr]:
+                            intensity_hr.add({'timestamp': hr.timestamp, 'intensity': monitoring.intensity, 'heart_rate': hr.heart_rate})
+                    previous_ts = monitoring.timestamp
+            intensity_hr.flush()
+
+    def __calculate_days_stats(self, day_dates, garmin_session, garmin_mon_session, garmin_sum_session, batch):
+        """Calculate the stats of days with one query per table for the time period the days span."""
+        start_ts = day_dates[0]
+        end_ts = day_dates[-1] + datetime.timedelta(1)
+        daily_summary_stats = DailySummary.s_get_stats_by_day(garmin_session, start_ts, end_ts)
+        rhr_stats = RestingHeartRate.s_get_stats_by_day(garmin_session, start_ts, end_ts)
+        stress_stats = Stress.s_get_stats_by_day(garmin_session, start_ts, end_ts, samples=True)
+        intensity_stats = MonitoringIntensity.s_get_stats_by_day(garmin_mon_session, start_ts, end_ts)
+        climb_stats = MonitoringClimb.s_get_stats_by_day(garmin_mon_session, start_ts, end_ts, self.measurement_system)
+        monitoring_stats = Monitoring.s_get_stats_by_day(garmin_mon_session, start_ts, end_ts)
+        hr_stats = MonitoringHeartRate.s_get_stats_by_day(garmin_mon_session, start_ts, end_ts, samples=True)
+        intensity_hr_stats = IntensityHR.s_get_stats_by_day(garmin_sum_session, start_ts, end_ts, samples=True)
+        weight_stats = Weight.s_get_stats_by_day(garmin_session, start_ts, end_ts)
+        sleep_stats = Sleep.s_get_stats_by_day(garmin_session, start_ts, end_ts)
+        for day_date in day_dates:
+            stats = daily_summary_stats[day_date]
+            weights = DaysSummaryWeights.from_daily_summary_stats(day_date, stats)
+            # prefer getting stats from the daily summary.
+            if stats.get('rhr_avg') is None:
+                stats.update(rhr_stats[day_date])
+            if stats.get('stress_avg') is None:
+                stats.update(stress_stats[day_date])
+            if stats.get('intensity_time') is None:
+                stats.update(intensity_stats[day_date])
+            if stats.get('floors') is None:
+                stats.update(climb_stats[day_date])
+            if stats.get('steps') is None:
+                stats.update(monitoring_stats[day_date])
+            stats.update(hr_stats[day_date])
+            stats.update(intensity_hr_stats[day_date])
+            stats.update(weight_stats[day_date])
+            stats.update(sleep_stats[day_date])
+            for col_name in DaysSummaryWeights.samples_cols:
+                weights[col_name] = stats.pop(col_name, None)
+            stats['day'] = day_date
+            batch.add(DaysSummary, stats)
+            batch.add(summarydb.DaysSummary, stats)
+            # the weights are recalculated with the day, so they are written as they are
+            batch.add(DaysSummaryWeights, weights, ignore_none=False)
+
+    @classmethod
+    def __filter_dirty(cls, indexes, dirty_indexes):
+        return indexes if dirty_indexes is None else [index for index in indexes if index in dirty_indexes]
+
+    def __monitoring_day_dates(self, year, garmin_mon_session, dirty_days=None):
+        days = self.__filter_dirty(Monitoring.s_get_days(garmin_mon_session, year), dirty_days)
+        return [datetime.date(year, 1, 1) + datetime.timedelta(day - 1) for day in sorted(days)]
+
+    def __populate_year_hr_intensity(self, year, dirty_days=None):
+        with self.garmin_mon_db.managed_session() as garmin_mon_session, self.garmin_sum_db.managed_session() as garmin_sum_session:
+            day_dates = self.__monitoring_day_dates(year, garmin_mon_session, dirty_days)
+            if day_dates:
+                # the monitoring data of a changed day may have been partially imported before
+                self.__populate_hr_intensity(day_dates, garmin_mon_session, garmin_sum_session, overwrite=(dirty_days is not None))
+
+    def __calculate_days(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, batch, dirty_days=None):
+        day_dates = self.__monitoring_day_dates(year, garmin_mon_session, dirty_days)
+        if day_dates:
+            self.__calculate_days_stats(day_dates, garmin_session, garmin_mon_session, garmin_sum_session, batch)
+        days = self.__filter_dirty(Activities.s_get_days(garmin_act_session, year), dirty_days)
         if len(days):
-            for day in tqdm(days, unit='days'):
-                stats = Activities.get_daily_stats(garmin_act_session, datetime.date(year, 1, 1) + datetime.timedelta(day - 1))
-                DaysSummary.s_insert_or_update(garmin_sum_session, stats)
-                summarydb.DaysSummary.s_insert_or_update(sum_session, stats)
+            day_dates = [datetime.date(year, 1, 1) + datetime.timedelta(day - 1) for day in sorted(days)]
+            activities_stats = Activities.s_get_stats_by_day(garmin_act_session, day_dates[0], day_dates[-1] + datetime.timedelta(1))
+            for day_date in day_dates:
+                stats = dict(activities_stats[day_date], day=day_date)
+                batch.add(DaysSummary, stats)
+                batch.add(summarydb.DaysSummary, stats)
 
-    def __calculate_week_stats(self, day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
+    def __calculate_week_stats(self, day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, batch):
         stats = DailySummary.get_weekly_stats(garmin_session, day_date)
         # prefer getting stats from the daily summary.
         if stats.get('rhr_avg') is None:
@@ -108,17 +218,27 @@ class Analyze():
         stats.update(Weight.get_weekly_stats(garmin_session, day_date))
         stats.update(Sleep.get_weekly_stats(garmin_session, day_date))
         stats.update(Activities.get_weekly_stats(garmin_act_session, day_date))
-        # save it to the db
-        WeeksSummary.s_insert_or_update(garmin_sum_session, stats)
-        summarydb.WeeksSummary.s_insert_or_update(sum_session, stats)
+        batch.add(WeeksSummary, stats)
+        batch.add(summarydb.WeeksSummary, stats)
+
+    @classmethod
+    def __week_first_days(cls, year, dirty_days=None):
+        week_starting_days = range(1, 365, 7)
+        if dirty_days is not None:
+            week_starting_days = [day for day in week_starting_days if any(day <= dirty_day < day + 7 for dirty_day in dirty_days)]
+        day_dates = [datetime.date(year, 1, 1) + datetime.timedelta(week_starting_day - 1) for week_starting_day in week_starting_days]
+        return [day_date for day_date in day_dates if day_date < datetime.datetime.now().date()]
 
-    def __calculate_weeks(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        for week_starting_day in tqdm(range(1, 365, 7), unit='weeks'):
-            day_date = datetime.date(year, 1, 1) + datetime.timedelta(week_starting_day - 1)
-            if day_date < datetime.datetime.now().date():
-                self.__calculate_week_stats(day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
+    @classmethod
+    def __dirty_months(cls, year, dirty_days):
+        if dirty_days is not None:
+            return {(datetime.date(year, 1, 1) + datetime.timedelta(day - 1)).month for day in dirty_days}
 
-    def __calculate_monitoring_month_stats(self, start_day_date, end_day_date, garmin_session, garmin_mon_session, garmin_sum_session, sum_session):
+    def __calculate_weeks(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, batch, dirty_days=None):
+        for day_date in tqdm(self.__week_first_days(year, dirty_days), unit='weeks'):
+            self.__calculate_week_stats(day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, batch)
+
+    def __calculate_monitoring_month_stats(self, start_day_date, end_day_date, garmin_session, garmin_mon_session, garmin_sum_session, batch):
         stats = DailySummary.get_monthly_stats(garmin_session, start_day_date, end_day_date)
         # prefer getting stats from the daily summary.
         if 'rhr_avg' in stats:
@@ -135,25 +255,25 @@ class Analyze():
         stats.update(IntensityHR.get_monthly_stats(garmin_sum_session, start_day_date, end_day_date))
         stats.update(Weight.get_monthly_stats(garmin_session, start_day_date, end_day_date))
         stats.update(Sleep.get_monthly_stats(garmin_session, start_day_date, end_day_date))
-        # save it to the db
-        MonthsSummary.s_insert_or_update(garmin_sum_session, stats)
-        summarydb.MonthsSummary.s_insert_or_update(sum_session, stats)
+        batch.add(MonthsSummary, stats)
+        batch.add(summarydb.MonthsSummary, stats)
 
-    def __calculate_months(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        months = Monitoring.s_get_months(garmin_mon_session, year)
+    def __calculate_months(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, batch, dirty_days=None):
+        dirty_months = self.__dirty_months(year, dirty_days)
+        months = self.__filter_dirty(Monitoring.s_get_months(garmin_mon_session, year), dirty_months)
         if len(months):
             for month in tqdm(months, unit='months'):
                 start_day_date = datetime.date(year, month, 1)
                 end_day_date = datetime.date(year, month, calendar.monthrange(year, month)[1])
-                self.__calculate_monitoring_month_stats(start_day_date, end_day_date, garmin_session, garmin_mon_session, garmin_sum_session, sum_session)
-        months = Activities.s_get_months(garmin_act_session, year)
+                self.__calculate_monitoring_month_stats(start_day_date, end_day_date, garmin_session, garmin_mon_session, garmin_sum_session, batch)
+        months = self.__filter_dirty(Activities.s_get_months(garmin_act_session, year), dirty_months)
         if len(months):
             for month in tqdm(months, unit='months'):
                 stats = Activities.get_monthly_stats(garmin_act_session, datetime.date(year, month, 1), datetime.date(year, month, calendar.monthrange(year, month)[1]))
-                MonthsSummary.s_insert_or_update(garmin_sum_session, stats)
-                summarydb.MonthsSummary.s_insert_or_update(sum_session, stats)
+                batch.add(MonthsSummary, stats)
+                batch.add(summarydb.MonthsSummary, stats)
 
-    def __calculate_year_stats(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
+    def __calculate_year_stats(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, batch):
         stats = DailySummary.get_yearly_stats(garmin_session, year)
         # prefer getting stats from the daily summary.
         if 'rhr_avg' in stats:
@@ -171,27 +291,93 @@ class Analyze():
         stats.update(Weight.get_yearly_stats(garmin_session, year))
         stats.update(Sleep.get_yearly_stats(garmin_session, year))
         stats.update(Activities.get_yearly_stats(garmin_act_session, year))
-        # save it to the db
-        YearsSummary.s_insert_or_update(garmin_sum_session, stats)
-        summarydb.YearsSummary.s_insert_or_update(sum_session, stats)
-
-    def __calculate_year(self, year):
-        with self.garmin_db.managed_session() as garmin_session, self.garmin_mon_db.managed_session() as garmin_mon_session, \
-                self.garmin_act_db.managed_session() as garmin_act_session, self.garmin_sum_db.managed_session() as garmin_sum_session, \
-                self.sum_db.managed_session() as sum_session:
+        batch.add(YearsSummary, stats)
+        batch.add(summarydb.YearsSummary, stats)
+
+    def __rollup_year(self, year, garmin_sum_session, batch, dirty_days=None):
+        """Roll up the weeks, months, and the year itself from the days summaries with one query."""
+        first_day = datetime.date(year, 1, 1)
+        next_year_first_day = datetime.date(year + 1, 1, 1)
+        week_first_days = self.__week_first_days(year, dirty_days)
+        # the last week of the year ends in the next year
+        days_rollup = DaysRollup.s_get(garmin_sum_session, first_day, max([next_year_first_day] + [day + datetime.timedelta(7) for day in week_first_days]))
+        # the intensity time goals of months and years are the sum of their first four weekly goals
+        for (table, sum_table, periods) in [
+            (WeeksSummary, summarydb.WeeksSummary, [(day, day + datetime.timedelta(7), 1) for day in week_first_days]),
+            (MonthsSummary, summarydb.MonthsSummary, [
+                (datetime.date(year, month, 1), datetime.date(year, month, calendar.monthrange(year, month)[1]) + datetime.timedelta(1), 4)
+                for month in self.__filter_dirty(days_rollup.months(), self.__dirty_months(year, dirty_days))
+            ]),
+            (YearsSummary, summarydb.YearsSummary, [(first_day, next_year_first_day, 4)])
+        ]:
+            for (start_day, end_day, goal_weeks) in periods:
+                stats = days_rollup.get_stats(start_day, end_day, goal_weeks)
+                batch.add(table, stats)
+                batch.add(sum_table, stats)
+
+    def _calculate_year_rows(self, year, dirty_days=None):
+        """Return an UpsertBatch of the summary rows of a year, calculated without writing to any database."""
+        batch = UpsertBatch()
+        with _read_only_session(self.garmin_db) as garmin_session, _read_only_session(self.garmin_mon_db) as garmin_mon_session, \
+                _read_only_session(self.garmin_act_db) as garmin_act_session, _read_only_session(self.garmin_sum_db) as garmin_sum_session:
             # calculate part of the years
-            self.__calculate_days(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-            self.__calculate_weeks(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-            self.__calculate_months(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-            # now calculate the year itself
-            self.__calculate_year_stats(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-
-    def summary(self):
-        """Summarize Garmin health data. Daily, weekly, and monthly, tables will be generated."""
+            self.__calculate_days(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, batch, dirty_days)
+            # rollups are calculated from the days once they are written
+            if not self.rollup:
+                self.__calculate_weeks(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, batch, dirty_days)
+                self.__calculate_months(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, batch, dirty_days)
+                # now calculate the year itself
+                self.__calculate_year_stats(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, batch)
+        return batch
+
+    def __write_year(self, year, batch, dirty_days=None):
+        with self.garmin_sum_db.managed_session() as garmin_sum_session, self.sum_db.managed_session() as sum_session:
+            sessions = {GarminSummaryDb: garmin_sum_session, summarydb.SummaryDb: sum_session}
+            batch.write(sessions)
+            if self.rollup:
+                rollup_batch = UpsertBatch()
+                self.__rollup_year(year, garmin_sum_session, rollup_batch, dirty_days)
+                rollup_batch.write(sessions)
+
+    def __calculate_years(self, years_dirty_days):
+        # Heart rate intensity is calculated from the monitoring data into the summary database, so it is written before the summaries read it.
+        for year, dirty_days in years_dirty_days:
+            self.__populate_year_hr_intensity(year, dirty_days)
+        if self.workers > 1 and len(years_dirty_days) > 1:
+            # The years are calculated in parallel and written one at a time in year order, so the output is the same as a serial run.
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.gc_config, self.debug, self.rollup)) as executor:
+                futures = [executor.submit(_calculate_year_rows, year, dirty_days) for year, dirty_days in years_dirty_days]
+                for (year, dirty_days), future in zip(years_dirty_days, futures):
+                    logger.info("Writing table entries for %s", year)
+                    self.__write_year(year, future.result(), dirty_days)
+        else:
+            for year, dirty_days in years_dirty_days:
+                logger.info("Generating table entries for %s", year)
+                self.__write_year(year, self._calculate_year_rows(year, dirty_days), dirty_days)
+
+    def summary(self, full=False):
+        """
+        Summarize Garmin health data. Daily, weekly, and monthly, tables will be generated.
+
+        Only the days that changed since the last summary, and the weeks, months, and years they are in, are calculated unless full is True
+        or the days that changed have not been tracked since the summaries were last fully calculated.
+        """
         logger.info("Summary Tables Generation:")
-        for year in sorted(list(set(Monitoring.get_years(self.garmin_mon_db) + Activities.get_years(self.garmin_act_db)))):
-            logger.info("Generating table entries for %s", year)
-            self.__calculate_year(year)
+        dirty_days = DirtyDays.get_days(self.garmin_db)
+        if full or not DirtyDays.tracking(self.garmin_db):
+            self.__calculate_years([(year, None) for year in sorted(list(set(Monitoring.get_years(self.garmin_mon_db) + Activities.get_years(self.garmin_act_db))))])
+            with self.garmin_db.managed_session() as garmin_session:
+                DirtyDays.s_clear(garmin_session, dirty_days)
+                DirtyDays.s_set_tracking(garmin_session)
+            return
+        dirty_days_by_year = {}
+        for day in dirty_days:
+            dirty_days_by_year.setdefault(day.year, set()).add(day.timetuple().tm_yday)
+        logger.info("%d days changed since the last summary", len(dirty_days))
+        self.__calculate_years(sorted(dirty_days_by_year.items()))
+        # only unmark the days that were calculated, days imported meanwhile are calculated next time
+        with self.garmin_db.managed_session() as garmin_session:
+            DirtyDays.s_clear(garmin_session, dirty_days)
 
     def create_dynamic_views(self):
         """Create database views specific to the data in this database."""
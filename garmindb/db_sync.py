@@ -0,0 +1,221 @@
+"""Class that syncs new and changed rows from the local databases to Supabase."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import sys
+import json
+import hashlib
+import logging
+import datetime
+import functools
+
+from sqlalchemy import DateTime, or_
+
+import fitfile
+from fitfile.conversions import time_to_secs
+
+from .garmindb import GarminDb, Attributes, DailySummary, Sleep, Activities, SyncLedger
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+def _secs(time):
+    return time_to_secs(time) if time is not None else None
+
+
+def _mins(time):
+    return round(time_to_secs(time) / 60) if time is not None else None
+
+
+def _daily_stats_record(measurement_system, row):
+    if row.distance is None:
+        distance = None
+    elif measurement_system is fitfile.field_enums.DisplayMeasure.metric:
+        distance = fitfile.Distance.from_kilometers(row.distance).to_meters()
+    else:
+        distance = fitfile.Distance.from_miles(row.distance).to_meters()
+    return {
+        'calendar_date'                 : row.day,
+        'min_heart_rate'                : row.hr_min,
+        'max_heart_rate'                : row.hr_max,
+        'resting_heart_rate'            : row.rhr,
+        'average_stress_level'          : row.stress_avg,
+        'daily_step_goal'               : row.step_goal,
+        'total_steps'                   : row.steps,
+        'moderate_intensity_minutes'    : _mins(row.moderate_activity_time),
+        'vigorous_intensity_minutes'    : _mins(row.vigorous_activity_time),
+        'intensity_minutes_goal'        : _mins(row.intensity_time_goal),
+        'floors_ascended'               : row.floors_up,
+        'floors_descended'              : row.floors_down,
+        'user_floors_ascended_goal'     : row.floors_goal,
+        'total_distance_meters'         : distance,
+        'net_calorie_goal'              : row.calories_goal,
+        'total_kilocalories'            : row.calories_total,
+        'bmr_kilocalories'              : row.calories_bmr,
+        'active_kilocalories'           : row.calories_active,
+        'consumed_kilocalories'         : row.calories_consumed,
+        'average_spo2'                  : row.spo2_avg,
+        'lowest_spo2'                   : row.spo2_min,
+        'avg_waking_respiration_value'  : row.rr_waking_avg,
+        'highest_respiration_value'     : row.rr_max,
+        'lowest_respiration_value'      : row.rr_min,
+        'body_battery_charged_value'    : row.bb_charged,
+        'body_battery_highest_value'    : row.bb_max,
+        'body_battery_lowest_value'     : row.bb_min,
+        'wellness_description'          : row.description,
+    }
+
+
+def _sleep_summary_record(row):
+    return {
+        'calendar_date'         : row.day,
+        'sleep_seconds'         : _secs(row.total_sleep),
+        'deep_sleep_seconds'    : _secs(row.deep_sleep),
+        'light_sleep_seconds'   : _secs(row.light_sleep),
+        'rem_sleep_seconds'     : _secs(row.rem_sleep),
+        'awake_sleep_seconds'   : _secs(row.awake),
+        'average_spo2'          : row.avg_spo2,
+        'average_respiration'   : row.avg_rr,
+    }
+
+
+def _activity_record(row):
+    return {
+        'activity_id'           : int(row.activity_id) if row.activity_id.isdigit() else row.activity_id,
+        'activity_name'         : row.name,
+        'activity_type'         : row.sport,
+        'duration'              : _secs(row.elapsed_time),
+        'elapsed_duration'      : _secs(row.elapsed_time),
+        'moving_duration'       : _secs(row.moving_time),
+        'lap_count'             : row.laps,
+        'average_hr'            : row.avg_hr,
+        'max_hr'                : row.max_hr,
+        'calories'              : row.calories,
+        'start_time_local'      : row.start_time,
+        'end_time_local'        : row.stop_time,
+    }
+
+
+class SyncTable():
+    """A local table whose rows are synced to a remote table."""
+
+    def __init__(self, remote_table, table_class, time_col, remote_key, convert_func):
+        """
+        Return a new SyncTable instance.
+
+        Parameters:
+        remote_table (string): the name of the remote table
+        table_class (DbObject): the local table
+        time_col (Column): the column of the local table that the high-water mark is kept for, rows are rarely changed long after this time
+        remote_key (list): the names of the primary key columns of the remote table
+        convert_func (callable): returns the remote record, a dict, for a row of the local table
+        """
+        self.remote_table = remote_table
+        self.table_class = table_class
+        self.time_col = time_col
+        self.remote_key = remote_key
+        self.convert_func = convert_func
+
+    def key(self, record):
+        """Return the remote primary key of a record as a string."""
+        return '|'.join(str(record[col_name]) for col_name in self.remote_key)
+
+    def parse_time(self, time_str):
+        """Return a high-water mark string as a value of the time column."""
+        if isinstance(self.time_col.type, DateTime):
+            return datetime.datetime.fromisoformat(time_str)
+        return datetime.date.fromisoformat(time_str)
+
+
+class DbSync():
+    """Pushes the rows of the local databases that are new or changed since the last sync to Supabase."""
+
+    # Rows with times within this many days of the high-water mark are checked for changes.
+    days_overlap = 3
+
+    def __init__(self, db_params, supabase, sync_tables=None, debug=0):
+        """
+        Return a new DbSync instance.
+
+        Parameters:
+        db_params (dict): configuration data for accessing the databases
+        supabase (SupabaseSync): uploads the rows
+        sync_tables (list): the SyncTables to sync, the daily stats, sleep summary, and activities tables the Supabase upload uses if None
+        debug (int): the debug level
+        """
+        self.db_params = db_params
+        self.supabase = supabase
+        self.debug = debug
+        self.garmin_db = GarminDb(db_params, debug)
+        self.dbs = {GarminDb: self.garmin_db}
+        self.sync_tables = sync_tables if sync_tables is not None else self.default_tables(Attributes.measurements_type(self.garmin_db))
+
+    @classmethod
+    def default_tables(cls, measurement_system):
+        """Return the SyncTables for the tables that garmindb_cli.py uploads to Supabase."""
+        return [
+            SyncTable('daily_stats', DailySummary, DailySummary.day, ['calendar_date'], functools.partial(_daily_stats_record, measurement_system)),
+            SyncTable('sleep_summary', Sleep, Sleep.day, ['calendar_date'], _sleep_summary_record),
+            SyncTable('activities', Activities, Activities.start_time, ['activity_id'], _activity_record),
+        ]
+
+    def __db(self, table_class):
+        if table_class.db not in self.dbs:
+            self.dbs[table_class.db] = table_class.db(self.db_params, self.debug)
+        return self.dbs[table_class.db]
+
+    @classmethod
+    def __convert_to_json(cls, object):
+        if isinstance(object, (datetime.datetime, datetime.date, datetime.time)):
+            return object.isoformat()
+        return str(object)
+
+    def __row_hash(self, record):
+        return hashlib.sha256(json.dumps(record, sort_keys=True, default=self.__convert_to_json).encode()).hexdigest()
+
+    def __changes(self, sync_table, full):
+        """Return the records that changed since they were last synced, their hashes, and the high-water mark of a table."""
+        high_water_str = SyncLedger.high_water(self.garmin_db, sync_table.remote_table)
+        high_water = sync_table.parse_time(high_water_str) if high_water_str is not None else None
+        with self.garmin_db.managed_session() as session:
+            synced_hashes = SyncLedger.s_hashes(session, sync_table.remote_table)
+        with self.__db(sync_table.table_class).managed_session() as session:
+            query = session.query(sync_table.table_class)
+            if high_water is not None and not full:
+                query = query.filter(or_(sync_table.time_col >= high_water - datetime.timedelta(days=self.days_overlap), sync_table.time_col.is_(None)))
+            records = []
+            hashes = {}
+            for row in query:
+                time = getattr(row, sync_table.time_col.key)
+                if time is not None and (high_water is None or time > high_water):
+                    high_water = time
+                record = sync_table.convert_func(row)
+                key = sync_table.key(record)
+                row_hash = self.__row_hash(record)
+                if synced_hashes.get(key) != row_hash:
+                    records.append(record)
+                    hashes[key] = row_hash
+        return (records, hashes, high_water)
+
+    def sync(self, full=False):
+        """Upload the new and changed rows of each table and return a dict of the tables that were uploaded and their row counts. With full, check every row."""
+        changes = {sync_table.remote_table: self.__changes(sync_table, full) for sync_table in self.sync_tables}
+        uploaded = self.supabase.sync({remote_table: records for remote_table, (records, _, _) in changes.items() if records})
+        for remote_table, (records, hashes, high_water) in changes.items():
+            if not records:
+                root_logger.info("Synced %s: no new or changed rows", remote_table)
+                continue
+            # A table that failed to upload keeps its old state so that its rows are uploaded next time.
+            if remote_table in uploaded:
+                with self.garmin_db.managed_session() as session:
+                    SyncLedger.s_record(session, remote_table, hashes)
+                    # rows without a time, like activities without a start time, don't move the high-water mark
+                    if high_water is not None:
+                        SyncLedger.s_set_high_water(session, remote_table, high_water.isoformat())
+                root_logger.info("Synced %s: %d new or changed rows, high-water mark %s", remote_table, len(records), high_water)
+        return uploaded
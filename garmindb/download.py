@@ -6,18 +6,27 @@ __license__ = "GPL"
 
 import os
 import sys
-import re
 import logging
 import datetime
 import time
 import tempfile
 import zipfile
 import json
+import shutil
+import hashlib
+import concurrent.futures
 from garth import Client as GarthClient
 from garth.exc import GarthHTTPError, GarthException
 from tqdm import tqdm
 
 import fitfile.conversions as conversions
+from idbutils.conversions import epoch_ms_to_dt
+
+from .rate_limiter import RateLimiter
+from .download_replay import ReplayAdapter
+from .json_archive import JsonArchive
+from .statistics import Statistics
+from .garmindb import GarminDb, DownloadLedger
 
 
 logger = logging.getLogger(__file__)
@@ -47,13 +56,85 @@ class Download():
 
     download_days_overlap = 3  # Existing donloaded data will be redownloaded and overwritten if it is within this number of days of now.
 
+    retry_status_codes = [429, 500, 502, 503, 504]
+
+    # Downloaded zips are buffered in memory up to this size, larger ones are spooled to a temp file.
+    zip_spool_max_size = 16 * 1024 * 1024
+    zip_chunk_size = 64 * 1024
+
     def __init__(self, gc_config):
         """Create a new Download class instance."""
         logger.debug("__init__")
         self.gc_config = gc_config
         self.garth_session_file = self.gc_config.get_session_file()
+        self.workers = self.gc_config.download_workers()
+        self.retries = self.gc_config.download_retries()
+        self.backoff_seconds = self.gc_config.download_backoff_seconds()
+        self.range_days = self.gc_config.download_range_days()
+        self.activity_page_size = self.gc_config.download_activity_page_size()
+        self.json_archive = self.gc_config.download_json_archive()
+        self.garmin_db = GarminDb(self.gc_config.get_db_params())
+        self.file_listeners = []
+        self.rate_limiter = RateLimiter(self.gc_config.download_rate(), self.gc_config.download_burst())
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
         self.garth = GarthClient()
-        self.garth.configure(domain=self.gc_config.get_garmin_base_domain())
+        # Retry on HTTP errors here instead of in garth so that retries are rate limited too.
+        self.garth.configure(domain=self.gc_config.get_garmin_base_domain(), status_forcelist=(), pool_maxsize=max(self.workers, 10))
+        self.replay_url = self.gc_config.get_garmin_replay_url()
+        if self.replay_url:
+            self.replay(self.replay_url)
+
+    @classmethod
+    def __retry_after(cls, response):
+        try:
+            return float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+
+    def __request(self, function, *args, **kwargs):
+        """Make a rate limited request to Garmin Connect, retrying with backoff if the server is busy or fails."""
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                return function(*args, **kwargs)
+            except GarthHTTPError as e:
+                response = e.error.response
+                status_code = response.status_code if response is not None else None
+                if status_code not in self.retry_status_codes or attempt >= self.retries:
+                    raise
+                delay = self.__retry_after(response) or self.backoff_seconds * (2 ** attempt)
+                root_logger.warning("Request failed with %s, retry %d of %d in %.1f seconds", status_code, attempt + 1, self.retries, delay)
+                if status_code == 429:
+                    # The server wants all requests to slow down, not just this one.
+                    self.rate_limiter.backoff(delay)
+                else:
+                    time.sleep(delay)
+
+    def add_file_listener(self, listener):
+        """Call listener(stat, day, file_names) for every group of files that is downloaded. The listener may be called from several threads."""
+        self.file_listeners.append(listener)
+
+    def remove_file_listener(self, listener):
+        """Stop calling listener for downloaded files."""
+        self.file_listeners.remove(listener)
+
+    def __files_saved(self, stat, day, file_names):
+        if file_names:
+            for listener in self.file_listeners:
+                listener(stat, day, file_names)
+
+    def connectapi(self, url, params=None):
+        """Return the JSON data returned by a rate limited Garmin Connect API request."""
+        return self.__request(self.garth.connectapi, url, params=params)
+
+    def replay(self, replay_url):
+        """Send all requests to a replay server, like ReplayServer, instead of Garmin Connect."""
+        root_logger.info("Replaying Garmin Connect from %s", replay_url)
+        self.replay_url = replay_url
+        (oauth1_token, oauth2_token) = ReplayAdapter.tokens()
+        self.garth.configure(oauth1_token=oauth1_token, oauth2_token=oauth2_token)
+        # Mount the adapter after configuring garth, since configuring mounts garth's own adapter.
+        self.garth.sess.mount('https://', ReplayAdapter(replay_url, pool_maxsize=max(self.workers, 10)))
 
     def __resume_session(self):
         if os.path.isfile(self.garth_session_file):
@@ -83,69 +164,199 @@ class Download():
 
     def login(self):
         """Use garth to resume to Garmin Connect session if possible, otherwise login."""
-        if not self.__resume_session():
-            self.__login()
+        if not self.replay_url:
+            if not self.__resume_session():
+                self.__login()
 
-        try:
-            self.garth.username
-        except GarthException:
-            self.__login()
+            try:
+                self.garth.username
+            except GarthException:
+                self.__login()
 
         profile_dir = self.gc_config.get_fit_files_dir()
         self.save_json_to_file(f'{profile_dir}/social-profile', self.garth.profile)
-        self.save_json_to_file(f'{profile_dir}/user-settings', self.garth.connectapi(f'{self.garmin_connect_user_profile_url}/user-settings'), True)
-        self.save_json_to_file(f'{profile_dir}/personal-information', self.garth.connectapi(f'{self.garmin_connect_user_profile_url}/personal-information'), True)
+        self.save_json_to_file(f'{profile_dir}/user-settings', self.connectapi(f'{self.garmin_connect_user_profile_url}/user-settings'), True)
+        self.save_json_to_file(f'{profile_dir}/personal-information', self.connectapi(f'{self.garmin_connect_user_profile_url}/personal-information'), True)
 
         self.display_name = self.garth.profile['displayName']
         self.full_name = self.garth.profile['fullName']
         root_logger.info("login: %s (%s)", self.full_name, self.display_name)
         return True
 
-    def __unzip_files(self, outdir):
-        """Unzip and downloaded zipped files into the directory supplied."""
-        root_logger.info("unzip_files: from %s to %s", self.temp_dir, outdir)
-        for filename in os.listdir(self.temp_dir):
-            match = re.search(r'.*\.zip', filename)
-            if match:
-                full_pathname = f'{self.temp_dir}/{filename}'
-                with zipfile.ZipFile(full_pathname, 'r') as files_zip:
-                    try:
-                        files_zip.extractall(outdir)
-                    except Exception as e:
-                        logger.error('Failed to unzip %s to %s: %s', full_pathname, outdir, e)
+    @classmethod
+    def __extract_file(cls, files_zip, member, outdir):
+        """Extract a member of a zip file to outdir, writing it to a temp file and renaming it so that no partial files are left."""
+        full_pathname = os.path.realpath(os.path.join(outdir, member.filename))
+        if not full_pathname.startswith(os.path.realpath(outdir) + os.sep):
+            logger.error('Skipping zip member %s that is outside of %s', member.filename, outdir)
+            return None
+        os.makedirs(os.path.dirname(full_pathname), exist_ok=True)
+        with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(full_pathname), prefix='.', suffix='.tmp', delete=False) as temp_file:
+            try:
+                with files_zip.open(member) as member_file:
+                    shutil.copyfileobj(member_file, temp_file)
+            except Exception:
+                temp_file.close()
+                os.remove(temp_file.name)
+                raise
+        os.replace(temp_file.name, full_pathname)
+        return full_pathname
+
+    def save_zip_contents(self, outdir, url):
+        """
+        Download a zip file and extract its contents to outdir without saving the zip.
+
+        Return a hash of the zip and the extracted files. The hash is None if the zip could not be extracted completely.
+        """
+        response = self.__request(self.garth.get, "connectapi", url, api=True, stream=True)
+        sha = hashlib.sha256()
+        file_names = []
+        with tempfile.SpooledTemporaryFile(max_size=self.zip_spool_max_size) as zip_buffer:
+            for chunk in response.iter_content(chunk_size=self.zip_chunk_size):
+                sha.update(chunk)
+                zip_buffer.write(chunk)
+            root_logger.info("unzip: %s to %s", url, outdir)
+            try:
+                with zipfile.ZipFile(zip_buffer, 'r') as files_zip:
+                    for member in files_zip.infolist():
+                        if not member.is_dir():
+                            file_name = self.__extract_file(files_zip, member, outdir)
+                            if file_name is not None:
+                                file_names.append(file_name)
+            except Exception as e:
+                logger.error('Failed to unzip %s to %s: %s', url, outdir, e)
+                return (None, file_names)
+        return (sha.hexdigest(), file_names)
 
     @classmethod
     def __convert_to_json(cls, object):
         return object.__str__()
 
-    @classmethod
-    def save_json_to_file(cls, filename, json_data, overwite=False):
-        """Save JSON formatted data to a file."""
+    def save_json_to_file(self, filename, json_data, overwite=False):
+        """Save JSON formatted data to a file, or to the directory's JSON archive if archiving is enabled, and return a hash of the data."""
         full_filename = f'{filename}.json'
-        exists = os.path.isfile(full_filename)
+        exists = JsonArchive.isfile(full_filename)
+        json_str = json.dumps(json_data, default=self.__convert_to_json)
         if not exists or overwite:
             logger.debug("%s %s", 'Overwriting' if exists else 'Saving', full_filename)
-            with open(full_filename, 'w') as file:
-                file.write(json.dumps(json_data, default=cls.__convert_to_json))
+            if self.json_archive and JsonArchive.is_archived(full_filename):
+                JsonArchive.save_file(full_filename, json_str)
+            else:
+                with open(full_filename, 'w') as file:
+                    file.write(json_str)
+        return DownloadLedger.payload_hash(json_str.encode())
+
+    def __save_stat_json(self, stat, day, json_filename, json_data, overwite):
+        """Save a day of a stat to a JSON file and return the file and a hash of the data."""
+        payload_hash = self.save_json_to_file(json_filename, json_data, overwite)
+        full_filename = f'{json_filename}.json'
+        self.__files_saved(stat, day, [full_filename])
+        return (full_filename, payload_hash)
 
     def save_binary_file(self, filename, url, overwite=False):
-        """Save binary data to a file."""
+        """Save binary data to a file and return a hash of the data, None if the file was not downloaded."""
         exists = os.path.isfile(filename)
         if not exists or overwite:
             logger.debug("%s %s", 'Overwriting' if exists else 'Saving', filename)
-            response = self.garth.get("connectapi", url, api=True)
+            response = self.__request(self.garth.get, "connectapi", url, api=True)
+            sha = hashlib.sha256()
             with open(filename, 'wb') as file:
                 for chunk in response:
+                    sha.update(chunk)
                     file.write(chunk)
+            return sha.hexdigest()
+
+    def __days_to_download(self, stat, date, days, overwite):
+        """Return a dict of the days that have not been completely downloaded and whether their files should be overwritten."""
+        complete_days = set()
+        if not overwite:
+            with self.garmin_db.managed_session() as session:
+                complete_days = DownloadLedger.s_complete_days(session, stat, date, date + datetime.timedelta(days=days - 1), JsonArchive.isfile)
+        today = datetime.datetime.now().date()
+        days_to_download = {}
+        for day_offset in range(0, days):
+            day = date + datetime.timedelta(days=day_offset)
+            if day not in complete_days:
+                # always overwrite for yesterday and today since the last download may have been a partial result
+                days_to_download[day] = overwite or (today - day).days <= self.download_days_overlap
+        skipped = days - len(days_to_download)
+        if skipped > 0:
+            root_logger.info("%s: skipping %d of %d days that were already downloaded", stat, skipped, days)
+        return days_to_download
+
+    def __record_download(self, stat, day, saved):
+        """Record a downloaded day in the download ledger, saved is a tuple of the file and hash of the data or None if the download failed."""
+        if saved is None:
+            return
+        (path, payload_hash) = saved
+        # Days that are still within the overlap may get more data, so they will be downloaded again.
+        complete = (datetime.datetime.now().date() - day).days > self.download_days_overlap
+        try:
+            with self.garmin_db.managed_session() as session:
+                DownloadLedger.s_record(session, stat, day, path, payload_hash, complete)
+        except Exception as e:
+            root_logger.error("Failed to record %s %s in the download ledger: %s", stat, day, e)
+
+    def __get_stat(self, stat, stat_function, directory, date, days, overwite):
+        # Days are downloaded concurrently, the rate limiter keeps the overall request rate polite.
+        days_to_download = self.__days_to_download(stat, date, days, overwite)
+        futures = {self.executor.submit(stat_function, directory, day, overwite_day): day for day, overwite_day in days_to_download.items()}
+        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), unit='days'):
+            self.__record_download(stat, futures[future], future.result())
+
+    def __get_stat_ranges(self, stat, range_function, directory, date, days, overwite):
+        # Stats whose API takes a date range are requested range_days at a time and saved as a file per day.
+        ranges = {}
+        for day, overwite_day in self.__days_to_download(stat, date, days, overwite).items():
+            ranges.setdefault((day - date).days // self.range_days, {})[day] = overwite_day
+        futures = [self.executor.submit(range_function, directory, range_days) for range_days in ranges.values()]
+        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), unit='ranges'):
+            for day, saved in future.result().items():
+                self.__record_download(stat, day, saved)
 
-    def __get_stat(self, stat_function, directory, date, days, overwite):
-        for day in tqdm(range(0, days), unit='days'):
-            download_date = date + datetime.timedelta(days=day)
-            # always overwrite for yesterday and today since the last download may have been a partial result
-            delta = datetime.datetime.now().date() - download_date
-            stat_function(directory, download_date, overwite or delta.days <= self.download_days_overlap)
-            # pause for a second between every page access
-            time.sleep(1)
+    @classmethod
+    def __entries_by_day(cls, entries):
+        """Group entries from a range response by the day they belong to."""
+        entries_by_day = {}
+        for entry in entries or []:
+            day = entry.get('calendarDate')
+            if day is None and entry.get('date') is not None:
+                day = epoch_ms_to_dt(entry['date']).strftime('%Y-%m-%d')
+            entries_by_day.setdefault(day, []).append(entry)
+        return entries_by_day
+
+    def download_concurrently(self, downloads):
+        """
+        Run several downloads at the same time, sharing the workers and the rate limit.
+
+        Parameters:
+        ----------
+            downloads (list): a list of tuples of a download method, i.e. get_sleep, and its arguments
+
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(downloads) or 1) as executor:
+            futures = [executor.submit(function, *args) for (function, *args) in downloads]
+            for future in futures:
+                future.result()
+
+    def download_stats(self, date, days, activity_count, overwite=False):
+        """Download the enabled stats for the days starting at date and the latest activity_count activities concurrently."""
+        downloads = []
+        if self.gc_config.is_stat_enabled(Statistics.monitoring):
+            downloads += [
+                (self.get_daily_summaries, self.gc_config.get_monitoring_dir, date, days, overwite),
+                (self.get_hydration, self.gc_config.get_monitoring_dir, date, days, overwite),
+                (self.get_monitoring, self.gc_config.get_monitoring_dir, date, days),
+            ]
+        if self.gc_config.is_stat_enabled(Statistics.sleep):
+            downloads.append((self.get_sleep, self.gc_config.get_sleep_dir(), date, days, overwite))
+        if self.gc_config.is_stat_enabled(Statistics.weight):
+            downloads.append((self.get_weight, self.gc_config.get_weight_dir(), date, days, overwite))
+        if self.gc_config.is_stat_enabled(Statistics.rhr):
+            downloads.append((self.get_rhr, self.gc_config.get_rhr_dir(), date, days, overwite))
+        if self.gc_config.is_stat_enabled(Statistics.activities):
+            downloads.append((self.get_activities, self.gc_config.get_activities_dir(), activity_count, overwite))
+        self.download_concurrently(downloads)
 
     def __get_summary_day(self, directory_func, date, overwite=False):
         root_logger.info("get_summary_day: %s", date)
@@ -157,62 +368,73 @@ class Download():
         url = f'{self.garmin_connect_daily_summary_url}/{self.display_name}'
         json_filename = f'{directory_func(date.year)}/daily_summary_{date_str}'
         try:
-            self.save_json_to_file(json_filename, self.garth.connectapi(url, params=params), overwite)
+            return self.__save_stat_json('daily_summary', date, json_filename, self.connectapi(url, params=params), overwite)
         except GarthHTTPError as e:
             root_logger.error("Exception getting daily summary: %s", e)
 
     def get_daily_summaries(self, directory_func, date, days, overwite):
         """Download the daily summary data from Garmin Connect and save to a JSON file."""
         root_logger.info("Getting daily summaries: %s (%d)", date, days)
-        self.__get_stat(self.__get_summary_day, directory_func, date, days, overwite)
+        self.__get_stat('daily_summary', self.__get_summary_day, directory_func, date, days, overwite)
 
-    def __get_monitoring_day(self, date):
-        root_logger.info("get_monitoring_day: %s to %s", date, self.temp_dir)
-        zip_filename = f'{self.temp_dir}/{date}.zip'
+    def __get_monitoring_day(self, directory_func, date, overwite=False):
+        root_logger.info("get_monitoring_day: %s", date)
         url = f'{self.garmin_connect_download_service_url}/wellness/{date.strftime("%Y-%m-%d")}'
         try:
-            self.save_binary_file(zip_filename, url)
+            (payload_hash, file_names) = self.save_zip_contents(directory_func(date.year), url)
         except GarthHTTPError as e:
             root_logger.error("Exception getting daily summary: %s", e)
+            return None
+        self.__files_saved('monitoring', date, file_names)
+        if payload_hash is None:
+            # the zip was truncated or corrupt, leave the day out of the ledger so that it is downloaded again
+            return None
+        # The zip can hold several files, so no single file is recorded for the day.
+        return (None, payload_hash)
 
     def get_monitoring(self, directory_func, date, days):
         """Download the daily monitoring data from Garmin Connect, unzip and save the raw files."""
         root_logger.info("Getting monitoring: %s (%d)", date, days)
-        for day in tqdm(range(0, days), unit='days'):
-            day_date = date + datetime.timedelta(day)
-            self.temp_dir = tempfile.mkdtemp()
-            self.__get_monitoring_day(day_date)
-            self.__unzip_files(directory_func(day_date.year))
-            # pause for a second between every page access
-            time.sleep(1)
-
-    def __get_weight_day(self, directory, day, overwite=False):
-        root_logger.info("Checking weight: %s overwite %r", day, overwite)
-        date_str = day.strftime('%Y-%m-%d')
+        # The zip files are always downloaded and extracted, so overwrite doesn't apply.
+        self.__get_stat('monitoring', self.__get_monitoring_day, directory_func, date, days, False)
+
+    def __get_weight_range(self, directory, days):
+        (start, end) = (min(days), max(days))
+        root_logger.info("Checking weight: %s to %s", start, end)
         params = {
-            'startDate' : date_str,
-            'endDate'   : date_str,
-            '_'         : str(conversions.dt_to_epoch_ms(conversions.date_to_dt(day)))
+            'startDate' : start.strftime('%Y-%m-%d'),
+            'endDate'   : end.strftime('%Y-%m-%d'),
+            '_'         : str(conversions.dt_to_epoch_ms(conversions.date_to_dt(start)))
         }
-        json_filename = f'{directory}/weight_{date_str}'
         try:
-            self.save_json_to_file(json_filename, self.garth.connectapi(self.garmin_connect_weight_url, params=params), overwite)
+            json_data = self.connectapi(self.garmin_connect_weight_url, params=params) or {}
         except GarthHTTPError as e:
-            root_logger.error("Exception getting daily summary: %s", e)
+            root_logger.error("Exception getting weight: %s", e)
+            return {}
+        weights_by_day = self.__entries_by_day(json_data.get('dateWeightList'))
+        saved = {}
+        for day, overwite_day in days.items():
+            date_str = day.strftime('%Y-%m-%d')
+            json_filename = f'{directory}/weight_{date_str}'
+            # Save the day in the same format as a single day request. The range average doesn't apply to the day.
+            day_data = {key: value for key, value in json_data.items() if key != 'totalAverage'}
+            day_data.update(startDate=date_str, endDate=date_str, dateWeightList=weights_by_day.get(date_str, []))
+            saved[day] = self.__save_stat_json('weight', day, json_filename, day_data, overwite_day)
+        return saved
 
     def get_weight(self, directory, date, days, overwite):
         """Download the sleep data from Garmin Connect and save to a JSON file."""
         root_logger.info("Getting weight: %s (%d)", date, days)
-        self.__get_stat(self.__get_weight_day, directory, date, days, overwite)
+        self.__get_stat_ranges('weight', self.__get_weight_range, directory, date, days, overwite)
 
     def __get_activity_summaries(self, start, count):
-        root_logger.info("get_activity_summaries")
+        root_logger.info("get_activity_summaries: %d (%d)", start, count)
         params = {
             'start' : str(start),
             "limit" : str(count)
         }
         try:
-            return self.garth.connectapi(self.garmin_connect_activity_search_url, params=params)
+            return self.connectapi(self.garmin_connect_activity_search_url, params=params)
         except GarthHTTPError as e:
             root_logger.error("Exception getting activity summary: %s", e)
 
@@ -221,40 +443,74 @@ class Download():
         json_filename = f'{directory}/activity_details_{activity_id_str}'
         try:
             url = f'{self.garmin_connect_activity_service_url}/{activity_id_str}'
-            self.save_json_to_file(json_filename, self.garth.connectapi(url), overwite)
+            self.save_json_to_file(json_filename, self.connectapi(url), overwite)
+            return [f'{json_filename}.json']
         except GarthHTTPError as e:
             root_logger.error("Exception getting daily summary %s", e)
+        return []
 
-    def __save_activity_file(self, activity_id_str):
+    def __save_activity_file(self, directory, activity_id_str):
         root_logger.debug("save_activity_file: %s", activity_id_str)
-        zip_filename = f'{self.temp_dir}/activity_{activity_id_str}.zip'
         url = f'{self.garmin_connect_download_service_url}/activity/{activity_id_str}'
         try:
-            self.save_binary_file(zip_filename, url)
+            (_, file_names) = self.save_zip_contents(directory, url)
+            return file_names
         except GarthHTTPError as e:
             root_logger.error("Exception downloading activity file: %s", e)
+        return []
+
+    @classmethod
+    def __activity_day(cls, activity):
+        try:
+            return datetime.date.fromisoformat(activity['startTimeLocal'][:10])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def __get_activity_pages(self, count):
+        """Yield the activity list a page at a time, newest activities first."""
+        for start in range(0, count, self.activity_page_size):
+            limit = min(self.activity_page_size, count - start)
+            activities = self.__get_activity_summaries(start, limit)
+            if not activities:
+                return
+            yield activities
+            if len(activities) < limit:
+                return
+
+    def __save_activity(self, directory, activity, overwite):
+        activity_id_str = str(activity['activityId'])
+        activity_name_str = conversions.printable(activity.get('activityName'))
+        root_logger.info("get_activities: %s (%s)", activity_name_str, activity_id_str)
+        json_filename = f'{directory}/activity_{activity_id_str}'
+        root_logger.info("get_activities: %s <- %r", json_filename, activity)
+        file_names = self.__save_activity_details(directory, activity_id_str, overwite)
+        if not os.path.isfile(f'{directory}/{activity_id_str}.fit') or overwite:
+            file_names += self.__save_activity_file(directory, activity_id_str)
+        # Save the activity summary last since it's presence marks the activity as downloaded.
+        self.save_json_to_file(json_filename, activity)
+        file_names.append(f'{json_filename}.json')
+        self.__files_saved('activities', self.__activity_day(activity), file_names)
 
     def get_activities(self, directory, count, overwite=False):
         """Download activities files from Garmin Connect and save the raw files."""
-        self.temp_dir = tempfile.mkdtemp()
-        logger.info("Getting activities: '%s' (%d) temp %s", directory, count, self.temp_dir)
-        activities = self.__get_activity_summaries(0, count)
-        for activity in tqdm(activities or [], unit='activities'):
-            activity_id_str = str(activity['activityId'])
-            activity_name_str = conversions.printable(activity.get('activityName'))
-            root_logger.info("get_activities: %s (%s)", activity_name_str, activity_id_str)
-            json_filename = f'{directory}/activity_{activity_id_str}'
-            if not os.path.isfile(json_filename + '.json') or overwite:
-                root_logger.info("get_activities: %s <- %r", json_filename, activity)
-                self.__save_activity_details(directory, activity_id_str, overwite)
-                self.save_json_to_file(json_filename, activity)
-                if not os.path.isfile(f'{directory}/{activity_id_str}.fit') or overwite:
-                    self.__save_activity_file(activity_id_str)
-                # pause for a second between every page access
-                time.sleep(1)
-            else:
-                root_logger.info("get_activities: skipping download of %s, already present", activity_id_str)
-        self.__unzip_files(directory)
+        logger.info("Getting activities: '%s' (%d)", directory, count)
+        # Activities are downloaded concurrently while the next page of the activity list is fetched.
+        futures = []
+        for activities in self.__get_activity_pages(count):
+            already_present = 0
+            for activity in activities:
+                activity_id_str = str(activity['activityId'])
+                if not JsonArchive.isfile(f'{directory}/activity_{activity_id_str}.json') or overwite:
+                    futures.append(self.executor.submit(self.__save_activity, directory, activity, overwite))
+                else:
+                    root_logger.info("get_activities: skipping download of %s, already present", activity_id_str)
+                    already_present += 1
+            # The list is newest first, so once downloaded activities are reached the older ones have been downloaded too.
+            if already_present > 0 and not overwite:
+                root_logger.info("get_activities: reached activities that were already downloaded, not getting more of the activity list")
+                break
+        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), unit='activities'):
+            future.result()
 
     def get_activity_types(self, directory, overwite):
         """Download the activity types from Garmin Connect and save to a JSON file."""
@@ -262,7 +518,7 @@ class Download():
         json_filename = f'{directory}/activity_types'
         try:
             url = f'{self.garmin_connect_activity_service_url}/activityTypes'
-            self.save_json_to_file(json_filename, self.garth.connectapi(url), overwite)
+            self.save_json_to_file(json_filename, self.connectapi(url), overwite)
         except GarthHTTPError as e:
             root_logger.error("Exception getting activity types: %s", e)
 
@@ -274,44 +530,57 @@ class Download():
         }
         url = f'{self.garmin_connect_sleep_daily_url}/{self.display_name}'
         try:
-            self.save_json_to_file(json_filename, self.garth.connectapi(url, params=params), overwite)
+            return self.__save_stat_json('sleep', date, json_filename, self.connectapi(url, params=params), overwite)
         except GarthHTTPError as e:
             root_logger.error("Exception getting daily summary: %s", e)
 
     def get_sleep(self, directory, date, days, overwite):
         """Download the sleep data from Garmin Connect and save to a JSON file."""
         root_logger.info("Getting sleep: %s (%d)", date, days)
-        self.__get_stat(self.__get_sleep_day, directory, date, days, overwite)
+        self.__get_stat('sleep', self.__get_sleep_day, directory, date, days, overwite)
 
-    def __get_rhr_day(self, directory, day, overwite=False):
-        date_str = day.strftime('%Y-%m-%d')
-        json_filename = f'{directory}/rhr_{date_str}'
+    def __get_rhr_range(self, directory, days):
+        (start, end) = (min(days), max(days))
+        root_logger.info("Checking rhr: %s to %s", start, end)
         params = {
-            'fromDate'  : date_str,
-            'untilDate' : date_str,
+            'fromDate'  : start.strftime('%Y-%m-%d'),
+            'untilDate' : end.strftime('%Y-%m-%d'),
             'metricId'  : 60
         }
         url = f'{self.garmin_connect_rhr}/{self.display_name}'
         try:
-            self.save_json_to_file(json_filename, self.garth.connectapi(url, params=params), overwite)
+            json_data = self.connectapi(url, params=params) or {}
         except GarthHTTPError as e:
-            root_logger.error("Exception getting daily summary %s", e)
+            root_logger.error("Exception getting rhr %s", e)
+            return {}
+        metrics_map = json_data.get('allMetrics', {}).get('metricsMap', {})
+        metrics_by_day = {'WELLNESS_RESTING_HEART_RATE': {}}
+        metrics_by_day.update({metric: self.__entries_by_day(values) for metric, values in metrics_map.items()})
+        saved = {}
+        for day, overwite_day in days.items():
+            date_str = day.strftime('%Y-%m-%d')
+            json_filename = f'{directory}/rhr_{date_str}'
+            # Save the day in the same format as a single day request.
+            day_data = dict(json_data, statisticsStartDate=date_str, statisticsEndDate=date_str)
+            day_data['allMetrics'] = dict(json_data.get('allMetrics', {}), metricsMap={metric: values_by_day.get(date_str, []) for metric, values_by_day in metrics_by_day.items()})
+            saved[day] = self.__save_stat_json('rhr', day, json_filename, day_data, overwite_day)
+        return saved
 
     def get_rhr(self, directory, date, days, overwite):
         """Download the resting heart rate data from Garmin Connect and save to a JSON file."""
         root_logger.info("Getting rhr: %s (%d)", date, days)
-        self.__get_stat(self.__get_rhr_day, directory, date, days, overwite)
+        self.__get_stat_ranges('rhr', self.__get_rhr_range, directory, date, days, overwite)
 
     def __get_hydration_day(self, directory_func, day, overwite=False):
         date_str = day.strftime('%Y-%m-%d')
         json_filename = f'{directory_func(day.year)}/hydration_{date_str}'
         url = f'{self.garmin_connect_daily_hydration_url}/{date_str}'
         try:
-            self.save_json_to_file(json_filename, self.garth.connectapi(url), overwite)
+            return self.__save_stat_json('hydration', day, json_filename, self.connectapi(url), overwite)
         except GarthHTTPError as e:
             root_logger.error("Exception getting hydration: %s", e)
 
     def get_hydration(self, directory_func, date, days, overwite):
         """Download the hydration data from Garmin Connect and save to a JSON file."""
         root_logger.info("Getting hydration: %s (%d)", date, days)
-        self.__get_stat(self.__get_hydration_day, directory_func, date, days, overwite)
+        self.__get_stat('hydration', self.__get_hydration_day, directory_func, date, days, overwite)
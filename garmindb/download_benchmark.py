@@ -0,0 +1,91 @@
+"""Class that benchmarks downloading against a local replay of Garmin Connect."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import sys
+import json
+import time
+import logging
+import datetime
+import tempfile
+import threading
+
+from .garmin_connect_config_manager import GarminConnectConfigManager
+from .download import Download
+from .download_replay import ReplayData, ReplayServer
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+class DownloadBenchmark():
+    """Downloads days of data from a ReplayServer into a temporary directory and reports how fast it went."""
+
+    def __init__(self, days=30, activities=10, latency=0.05, throttle_every=0, retry_after=1, workers=4, requests_per_second=50.0, burst=10, fixtures_dir=None,
+                 json_archive=False):
+        """
+        Return a new DownloadBenchmark instance.
+
+        Parameters:
+        days (int): the number of days of data to download, ending yesterday
+        activities (int): the number of activities to download
+        latency (float): seconds the replay server waits before answering each request
+        throttle_every (int): if set, the replay server answers every Nth request with 429 Too Many Requests
+        retry_after (int): the Retry-After seconds the replay server sends with a 429 response
+        workers (int): the number of download workers
+        requests_per_second (float): the download rate limit
+        burst (int): the download rate limit burst
+        fixtures_dir (string): a directory of previously downloaded files to replay instead of generated data
+        json_archive (Boolean): save downloaded JSON files to JSON archives
+        """
+        self.days = days
+        self.activities = activities
+        self.replay_server = ReplayServer(ReplayData(fixtures_dir, activities=activities), latency, throttle_every, retry_after)
+        self.download_config = {'workers': workers, 'requests_per_second': requests_per_second, 'burst': burst, 'backoff_seconds': 0.1, 'json_archive': json_archive}
+        self.lock = threading.Lock()
+        self.files = 0
+
+    def __files_saved(self, stat, day, file_names):
+        with self.lock:
+            self.files += len(file_names)
+
+    def __write_config(self, config_dir, base_dir):
+        config = {
+            'db': {'type': 'sqlite'},
+            'garmin': {'replay_url': self.replay_server.url},
+            'directories': {'relative_to_home': False, 'base_dir': base_dir},
+            'download': self.download_config,
+        }
+        with open(os.path.join(config_dir, 'GarminConnectConfig.json'), 'w') as file:
+            json.dump(config, file)
+
+    def run(self):
+        """Run the benchmark and return a dict of the results."""
+        with self.replay_server, tempfile.TemporaryDirectory() as temp_dir:
+            self.__write_config(temp_dir, os.path.join(temp_dir, 'HealthData'))
+            gc_config = GarminConnectConfigManager(temp_dir)
+            date = datetime.datetime.now().date() - datetime.timedelta(days=self.days)
+            start = time.perf_counter()
+            download = Download(gc_config)
+            download.add_file_listener(self.__files_saved)
+            download.login()
+            download.download_stats(date, self.days, self.activities)
+            seconds = time.perf_counter() - start
+            download.executor.shutdown()
+        results = {
+            'days'                  : self.days,
+            'activities'            : self.activities,
+            'files'                 : self.files,
+            'requests'              : self.replay_server.requests,
+            'throttled'             : self.replay_server.throttled,
+            'seconds'               : round(seconds, 3),
+            'requests_per_second'   : round(self.replay_server.requests / seconds, 1),
+            'endpoints'             : dict(self.replay_server.endpoints),
+        }
+        root_logger.info("Download benchmark: %r", results)
+        return results
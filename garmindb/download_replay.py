@@ -0,0 +1,295 @@
+"""Classes that replay Garmin Connect locally so that downloads can be tested and benchmarked offline."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import sys
+import io
+import re
+import json
+import time
+import random
+import logging
+import datetime
+import threading
+import zipfile
+import collections
+import http.server
+import urllib.parse
+
+import requests
+from garth.auth_tokens import OAuth1Token, OAuth2Token
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+class ReplayAdapter(requests.adapters.HTTPAdapter):
+    """Sends the requests that garth makes to Garmin Connect to a replay server instead."""
+
+    def __init__(self, replay_url, **kwargs):
+        """Return a new ReplayAdapter instance that sends requests to replay_url."""
+        super().__init__(**kwargs)
+        self.replay_url = replay_url.rstrip('/')
+
+    def send(self, request, **kwargs):
+        """Send the request to the replay server."""
+        url = urllib.parse.urlsplit(request.url)
+        request.url = self.replay_url + urllib.parse.urlunsplit(('', '', url.path, url.query, ''))
+        return super().send(request, **kwargs)
+
+    @classmethod
+    def tokens(cls):
+        """Return OAuth tokens that let garth make API requests without logging in."""
+        now = int(time.time())
+        year = 365 * 24 * 3600
+        oauth1_token = OAuth1Token(oauth_token='replay', oauth_token_secret='replay')
+        oauth2_token = OAuth2Token(scope='replay', jti='replay', token_type='Bearer', access_token='replay', refresh_token='replay', expires_in=year,
+                                   expires_at=now + year, refresh_token_expires_in=year, refresh_token_expires_at=now + year)
+        return (oauth1_token, oauth2_token)
+
+
+class ReplayData():
+    """Responses for the Garmin Connect endpoints that Download uses, from recorded files if present, otherwise generated."""
+
+    display_name = 'replay'
+
+    def __init__(self, fixtures_dir=None, fit_file_size=64 * 1024, activities=100, activity_start=datetime.date(2020, 1, 1)):
+        """
+        Return a new ReplayData instance.
+
+        Parameters:
+        fixtures_dir (string): a directory of files saved by Download, i.e. sleep_2020-01-01.json, that are replayed instead of generated data,
+            zipped FIT files are replayed from wellness_<date>.zip and activity_<id>.zip
+        fit_file_size (int): the size of generated FIT files
+        activities (int): the number of activities in the generated activity list
+        activity_start (date): the day of the oldest generated activity
+        """
+        self.fixtures_dir = fixtures_dir
+        self.fit_file_size = fit_file_size
+        self.activities = activities
+        self.activity_start = activity_start
+
+    def __fixture(self, file_name, binary=False):
+        if self.fixtures_dir:
+            pathname = os.path.join(self.fixtures_dir, file_name)
+            if os.path.isfile(pathname):
+                with open(pathname, 'rb' if binary else 'r') as file:
+                    return file.read() if binary else json.load(file)
+        return None
+
+    def __zip(self, fixture_name, fit_file_name):
+        zip_data = self.__fixture(fixture_name, True)
+        if zip_data is None:
+            zip_buffer = io.BytesIO()
+            with zipfile.ZipFile(zip_buffer, 'w') as files_zip:
+                files_zip.writestr(fit_file_name, random.Random(fit_file_name).randbytes(self.fit_file_size))
+            zip_data = zip_buffer.getvalue()
+        return zip_data
+
+    @classmethod
+    def __days(cls, start_str, end_str):
+        start = datetime.date.fromisoformat(start_str)
+        for day in range((datetime.date.fromisoformat(end_str) - start).days + 1):
+            yield start + datetime.timedelta(days=day)
+
+    def social_profile(self):
+        """Return the user's social profile."""
+        return {'displayName': self.display_name, 'fullName': 'Replay User', 'userName': 'replay@example.com'}
+
+    def user_settings(self):
+        """Return the user's settings."""
+        return {'userData': {'gender': 'MALE', 'weight': 75000.0, 'height': 180.0, 'birthDate': '1980-01-01', 'measurementSystem': 'metric'}}
+
+    def personal_information(self):
+        """Return the user's personal information."""
+        return {'userInfo': {'birthDate': '1980-01-01', 'genderType': 'MALE'}}
+
+    def daily_summary(self, day):
+        """Return the daily summary for day."""
+        return self.__fixture(f'daily_summary_{day}.json') or {
+            'calendarDate': day, 'totalSteps': 10000, 'dailyStepGoal': 8000, 'totalKilocalories': 2500.0, 'restingHeartRate': 55, 'minHeartRate': 50, 'maxHeartRate': 150
+        }
+
+    def hydration(self, day):
+        """Return the hydration data for day."""
+        return self.__fixture(f'hydration_{day}.json') or {'calendarDate': day, 'valueInML': 2000.0, 'goalInML': 2500.0, 'sweatLossInML': 500.0}
+
+    def sleep(self, day):
+        """Return the sleep data for day."""
+        fixture = self.__fixture(f'sleep_{day}.json')
+        if fixture is not None:
+            return fixture
+        start = datetime.datetime.fromisoformat(day) - datetime.timedelta(hours=2)
+        levels = [{'startGMT': (start + datetime.timedelta(minutes=30 * index)).isoformat(), 'endGMT': (start + datetime.timedelta(minutes=30 * (index + 1))).isoformat(),
+                   'activityLevel': float(index % 3)} for index in range(16)]
+        return {'dailySleepDTO': {'calendarDate': day, 'sleepTimeSeconds': 28800, 'deepSleepSeconds': 7200, 'lightSleepSeconds': 14400, 'remSleepSeconds': 7200},
+                'sleepLevels': levels}
+
+    def weight(self, start_str, end_str):
+        """Return the weight data for a range of days."""
+        weights = []
+        for day in self.__days(start_str, end_str):
+            fixture = self.__fixture(f'weight_{day}.json')
+            weights += fixture.get('dateWeightList', []) if fixture is not None else [{'calendarDate': str(day), 'weight': 75000.0 + day.day * 10}]
+        return {'startDate': start_str, 'endDate': end_str, 'dateWeightList': list(reversed(weights))}
+
+    def rhr(self, start_str, end_str):
+        """Return the resting heart rate data for a range of days."""
+        values = []
+        for day in self.__days(start_str, end_str):
+            fixture = self.__fixture(f'rhr_{day}.json')
+            if fixture is not None:
+                values += fixture.get('allMetrics', {}).get('metricsMap', {}).get('WELLNESS_RESTING_HEART_RATE', [])
+            else:
+                values.append({'value': 50.0 + day.day % 10, 'calendarDate': str(day)})
+        return {'statisticsStartDate': start_str, 'statisticsEndDate': end_str, 'allMetrics': {'metricsMap': {'WELLNESS_RESTING_HEART_RATE': values}}}
+
+    def __activity(self, index):
+        day = self.activity_start + datetime.timedelta(days=index)
+        return {'activityId': 1000000 + index, 'activityName': f'Replay Run {index}', 'startTimeLocal': f'{day} 07:00:00',
+                'activityType': {'typeKey': 'running'}, 'duration': 1800.0, 'distance': 5000.0}
+
+    def activity_list(self, start, limit):
+        """Return a page of the activity list, newest activities first."""
+        fixtures = sorted((file_name for file_name in os.listdir(self.fixtures_dir) if re.match(r'activity_\d+\.json', file_name)), reverse=True) if self.fixtures_dir else []
+        if fixtures:
+            return [self.__fixture(file_name) for file_name in fixtures[start:start + limit]]
+        return [self.__activity(index) for index in range(self.activities - 1 - start, max(self.activities - 1 - start - limit, -1), -1)]
+
+    def activity_details(self, activity_id):
+        """Return the details of an activity."""
+        return self.__fixture(f'activity_details_{activity_id}.json') or {'activityId': int(activity_id), 'summaryDTO': {'duration': 1800.0, 'distance': 5000.0}}
+
+    def activity_types(self):
+        """Return the activity types."""
+        return [{'typeId': 1, 'typeKey': 'running', 'parentTypeId': 17}]
+
+    def wellness_zip(self, day):
+        """Return the zipped monitoring FIT files for day."""
+        return self.__zip(f'wellness_{day}.zip', f'{day.replace("-", "")}_WELLNESS.fit')
+
+    def activity_zip(self, activity_id):
+        """Return the zipped FIT file for an activity."""
+        return self.__zip(f'activity_{activity_id}.zip', f'{activity_id}_ACTIVITY.fit')
+
+
+class ReplayServer():
+    """A local HTTP server that stands in for the Garmin Connect API with configurable latency and rate limiting."""
+
+    def __init__(self, replay_data=None, latency=0.0, throttle_every=0, retry_after=1, port=0):
+        """
+        Return a new ReplayServer instance.
+
+        Parameters:
+        replay_data (ReplayData): the responses to serve, generated data if None
+        latency (float): seconds to wait before answering each request
+        throttle_every (int): if set, answer every Nth request with 429 Too Many Requests
+        retry_after (int): the Retry-After seconds sent with a 429 response
+        port (int): the port to listen on, any free port if 0
+        """
+        self.replay_data = replay_data or ReplayData()
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.port = port
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.endpoints = collections.Counter()
+        self.server = None
+        self.thread = None
+        display_name = self.replay_data.display_name
+        self.routes = [
+            (r'/userprofile-service/socialProfile$', lambda match, params: self.replay_data.social_profile()),
+            (r'/userprofile-service/userprofile/user-settings$', lambda match, params: self.replay_data.user_settings()),
+            (r'/userprofile-service/userprofile/personal-information$', lambda match, params: self.replay_data.personal_information()),
+            (rf'/usersummary-service/usersummary/daily/{display_name}$', lambda match, params: self.replay_data.daily_summary(params['calendarDate'])),
+            (r'/usersummary-service/usersummary/hydration/allData/([\d-]+)$', lambda match, params: self.replay_data.hydration(match.group(1))),
+            (rf'/wellness-service/wellness/dailySleepData/{display_name}$', lambda match, params: self.replay_data.sleep(params['date'])),
+            (rf'/userstats-service/wellness/daily/{display_name}$', lambda match, params: self.replay_data.rhr(params['fromDate'], params['untilDate'])),
+            (r'/weight-service/weight/dateRange$', lambda match, params: self.replay_data.weight(params['startDate'], params['endDate'])),
+            (r'/activitylist-service/activities/search/activities$', lambda match, params: self.replay_data.activity_list(int(params['start']), int(params['limit']))),
+            (r'/activity-service/activity/activityTypes$', lambda match, params: self.replay_data.activity_types()),
+            (r'/activity-service/activity/(\d+)$', lambda match, params: self.replay_data.activity_details(match.group(1))),
+            (r'/download-service/files/wellness/([\d-]+)$', lambda match, params: self.replay_data.wellness_zip(match.group(1))),
+            (r'/download-service/files/activity/(\d+)$', lambda match, params: self.replay_data.activity_zip(match.group(1))),
+        ]
+
+    @property
+    def url(self):
+        """Return the base URL of the server."""
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def __count(self, path):
+        with self.lock:
+            self.requests += 1
+            self.endpoints[path.split('/')[1]] += 1
+            if self.throttle_every and self.requests % self.throttle_every == 0:
+                self.throttled += 1
+                return True
+        return False
+
+    def respond(self, path, params):
+        """Return the HTTP status, content type, and body to answer a request with."""
+        if self.latency:
+            time.sleep(self.latency)
+        if self.__count(path):
+            return (429, 'application/json', b'{"message": "Too Many Requests"}')
+        for (path_regex, response_function) in self.routes:
+            match = re.match(path_regex, path)
+            if match:
+                response = response_function(match, params)
+                if isinstance(response, bytes):
+                    return (200, 'application/octet-stream', response)
+                return (200, 'application/json', json.dumps(response).encode())
+        return (404, 'application/json', b'{"message": "Not Found"}')
+
+    def __handler(self):
+        replay_server = self
+
+        class ReplayRequestHandler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                (status, content_type, body) = replay_server.respond(url.path, dict(urllib.parse.parse_qsl(url.query)))
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                if status == 429:
+                    self.send_header('Retry-After', str(replay_server.retry_after))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                root_logger.debug("replay: " + format, *args)
+
+        return ReplayRequestHandler
+
+    def start(self):
+        """Start serving requests on a background thread."""
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', self.port), self.__handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='ReplayServer', daemon=True)
+        self.thread.start()
+        root_logger.info("Replaying Garmin Connect on %s", self.url)
+        return self
+
+    def stop(self):
+        """Stop serving requests."""
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        """Start serving requests when entering a with block."""
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Stop serving requests when leaving a with block."""
+        self.stop()
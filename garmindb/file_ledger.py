@@ -0,0 +1,91 @@
+"""Class that tracks which data files have been imported so that unchanged files can be skipped."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+
+import os
+import sys
+import logging
+
+from .garmindb import GarminDb, ImportLedger, BulkUpsert
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+class FileLedger():
+    """
+    Class that tracks which data files have been imported so that unchanged files can be skipped.
+
+    Files are stated and hashed once when they are checked and their outcomes are written to the ledger in bulk by flush().
+    """
+
+    def __init__(self, db_params, importer, target_db, debug=0, stat_func=os.stat, hash_func=None):
+        """
+        Return a new FileLedger instance.
+
+        Parameters:
+        db_params (dict): database access configuration
+        importer (string): the name of the importer that handles the files
+        target_db (DB): the database the importer writes the files' data to
+        debug (int): the debug level
+        stat_func (callable): returns the size and modification time of a file, for files that are not on disk
+        hash_func (callable): returns a hash of the contents of a file, for files that are not on disk
+        """
+        self.garmin_db = GarminDb(db_params, debug)
+        self.importer = importer
+        self.db_generation = ImportLedger.get_db_generation(target_db)
+        self.stat_func = stat_func
+        self.hash_func = hash_func
+        self.stats = {}
+        self.hashes = {}
+        self.entries = []
+
+    def __stat(self, file_name):
+        stat = self.stats.get(file_name)
+        if stat is None:
+            stat = self.stats[file_name] = self.stat_func(file_name)
+        return stat
+
+    def __hash(self, file_name):
+        content_hash = self.hashes.get(file_name)
+        if content_hash is None:
+            content_hash = self.hashes[file_name] = (self.hash_func or ImportLedger.content_hash)(file_name)
+        return content_hash
+
+    def changed_files(self, file_names):
+        """Return the files that have not been imported in their current state, they are hashed for recording their outcomes later."""
+        with self.garmin_db.managed_session() as session:
+            changed_file_names = [file_name for file_name in file_names
+                                  if not ImportLedger.s_unchanged(session, self.importer, file_name, self.db_generation, self.__stat, self.__hash)]
+        for file_name in changed_file_names:
+            self.__hash(file_name)
+        skipped = len(file_names) - len(changed_file_names)
+        if skipped > 0:
+            logger.info("%s: skipping %d of %d files that were already imported", self.importer, skipped, len(file_names))
+        return changed_file_names
+
+    def record(self, file_name, outcome):
+        """Queue the outcome of importing a file, it is written to the ledger by the next flush()."""
+        try:
+            self.entries.append(ImportLedger.entry(self.importer, file_name, outcome, self.db_generation, self.__stat, self.__hash))
+        except Exception as e:
+            root_logger.error("Failed to record %s for %s in the import ledger: %s", outcome, file_name, e)
+
+    def flush(self):
+        """Write the queued outcomes to the ledger with one commit. Call it once the data of the files has been committed."""
+        entries = self.entries
+        self.entries = []
+        if entries:
+            try:
+                with self.garmin_db.managed_session() as session:
+                    ledger_entries = BulkUpsert(session, ImportLedger, ignore_none=False)
+                    for entry in entries:
+                        ledger_entries.add(entry)
+                    ledger_entries.flush()
+            except Exception as e:
+                root_logger.error("Failed to record %d files in the import ledger: %s", len(entries), e)
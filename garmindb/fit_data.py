@@ -7,22 +7,161 @@ __license__ = "GPL"
 
 import sys
 import logging
+import functools
+import contextlib
 import traceback
+import collections
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 
 import fitfile
+from fitfile.file_header import FileHeader
+from fitfile.record_header import RecordHeader, MessageClass
+from fitfile.definition_message import DefinitionMessage
+from fitfile.data_message import DataMessageDecodeContext, DataMessage
 from idbutils import FileProcessor
 
+from .garmindb import ImportLedger
+from .file_ledger import FileLedger
+
 
 logger = logging.getLogger(__file__)
 logger.addHandler(logging.StreamHandler(stream=sys.stdout))
 root_logger = logging.getLogger()
 
 
+class DecodedMessage():
+    """A picklable copy of a decoded FIT data message."""
+
+    def __init__(self, message):
+        """Return a DecodedMessage instance holding the type and field values of message."""
+        self.type = message.type
+        self.fields = message.fields
+
+    def __str__(self):
+        """Return a string representation of a DecodedMessage instance."""
+        return f'{self.__class__.__name__}: {repr(self.type)}: {str(self.fields)}'
+
+
+class DecodedFitFile(fitfile.file.File):
+    """A picklable copy of a decoded FIT file that can be passed from a decoding process to the database writer."""
+
+    summary_attributes = [
+        'filename', 'measurement_system', 'data_size', 'record_count', 'type', 'time_created', 'product', 'serial_number', 'device', 'utc_offset', 'local_tz',
+        'time_created_local', 'time_ended_local', 'start_time', 'end_time', 'last_message_timestamp', 'sport_type', 'sub_sport_type', 'dev_application_ids',
+        'dev_fields', 'message_types'
+    ]
+
+    def __init__(self, fit_file):
+        """Return a DecodedFitFile instance with the summary and messages of the fitfile.file.File instance fit_file."""
+        for attribute in self.summary_attributes:
+            vars(self)[attribute] = getattr(fit_file, attribute)
+        self.messages = [DecodedMessage(message) for message in fit_file.messages]
+        for message_type in fitfile.MessageType:
+            vars(self)[message_type.name] = []
+        for message in self.messages:
+            vars(self).setdefault(message.type.name, []).append(message)
+
+
+class StreamingFitFile(fitfile.file.File):
+    """
+    A FIT file that is summarized when opened and whose messages are decoded again, a bounded chunk at a time, as they are written.
+
+    The decoding loop and the summary follow fitfile's File, so streaming is only used with the fitfile version it was written for.
+    Files with no more than a chunk of messages keep their messages from the summarizing pass and are not decoded again.
+    """
+
+    fitfile_version = (1, 2)
+
+    # Messages kept from the summarizing pass: the ones the file summary is built from and the ones processors write before the rest.
+    summary_message_types = [
+        fitfile.MessageType.file_id, fitfile.MessageType.device_info, fitfile.MessageType.device_settings, fitfile.MessageType.start, fitfile.MessageType.end,
+        fitfile.MessageType.monitoring_info, fitfile.MessageType.sport, fitfile.MessageType.session, fitfile.MessageType.dev_data_id,
+        fitfile.MessageType.field_description
+    ]
+
+    def __init__(self, filename, measurement_system=fitfile.field_enums.DisplayMeasure.metric, chunk_size=10000):
+        """Return a StreamingFitFile instance with the summary of the FIT file filename, other messages are decoded by message_chunks()."""
+        self.filename = filename
+        self.measurement_system = measurement_system
+        self.chunk_size = chunk_size
+        self.message_types = []
+        self.messages = []
+        for message_type in fitfile.MessageType:
+            vars(self)[message_type.name] = []
+        self.first_chunk = []
+        for message in self.__decode():
+            if message.type not in self.message_types:
+                self.message_types.append(message.type)
+            if message.type in self.summary_message_types:
+                vars(self)[message.type.name].append(message)
+            if self.first_chunk is not None:
+                self.first_chunk.append(message)
+                if len(self.first_chunk) > chunk_size:
+                    self.first_chunk = None
+        # The summary is derived from the kept messages exactly as for a fully decoded file.
+        self._File__sumarize()
+
+    def __decode(self):
+        with open(self.filename, 'rb') as file:
+            self.file_header = FileHeader(file)
+            self.data_size = self.file_header.data_size
+            definition_messages = {}
+            dev_fields = {}
+            data_consumed = 0
+            self.record_count = 0
+            data_message_context = DataMessageDecodeContext()
+            while self.data_size > data_consumed:
+                record_header = RecordHeader(file)
+                local_message_num = record_header.local_message()
+                data_consumed += record_header.file_size
+                self.record_count += 1
+                if record_header.message_class is MessageClass.definition:
+                    definition_message = DefinitionMessage(record_header, dev_fields, file)
+                    data_consumed += definition_message.file_size
+                    definition_messages[local_message_num] = definition_message
+                else:
+                    data_message = DataMessage(definition_messages[local_message_num], file, self.measurement_system, data_message_context)
+                    data_consumed += data_message.file_size
+                    if data_message.type == fitfile.MessageType.field_description:
+                        dev_fields[data_message.fields.field_definition_number] = data_message
+                    yield data_message
+            self.last_message_timestamp = data_message_context.last_timestamp
+
+    @classmethod
+    def supported(cls):
+        """Return True if the installed fitfile version is the one that streaming follows."""
+        return tuple(fitfile.version_info.version_info[:2]) == cls.fitfile_version
+
+    def message_chunks(self):
+        """Return the file's messages in file order as lists of at most chunk_size messages, decoding them again if they were more than a chunk."""
+        if self.first_chunk is not None:
+            if self.first_chunk:
+                yield self.first_chunk
+            return
+        chunk = []
+        for message in self.__decode():
+            chunk.append(message)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def _decode_file(file_name, measurement_system):
+    return fitfile.file.File(file_name, measurement_system)
+
+
+def _decode_file_to_rows(file_name, measurement_system):
+    return DecodedFitFile(_decode_file(file_name, measurement_system))
+
+
 class FitData():
     """Class for importing FIT files into a database."""
 
-    def __init__(self, input_dir, debug, latest=False, recursive=False, fit_types=None, measurement_system=fitfile.field_enums.DisplayMeasure.metric):
+    def __init__(self, input_dir, debug, latest=False, recursive=False, fit_types=None, measurement_system=fitfile.field_enums.DisplayMeasure.metric, workers=1,
+                 chunk_size=None):
         """
         Return an instance of FitData.
 
@@ -32,28 +171,90 @@ class FitData():
         latest (Boolean): check for latest files only
         fit_types (Fit.field_enums.FileType): check for this file type only
         measurement_system (enum): which measurement system to use when importing the files
+        workers (int): number of processes used to decode FIT files, the database is always written from the calling process
+        chunk_size (int): if set, stream the messages of each file to the database in chunks of this many messages instead of decoding whole files
 
         """
         logger.info("Processing %s FIT data from %s", fit_types, input_dir)
         self.measurement_system = measurement_system
         self.debug = debug
         self.fit_types = fit_types
-        self.file_names = FileProcessor.dir_to_files(input_dir, fitfile.file.name_regex, latest, recursive)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        if chunk_size and not StreamingFitFile.supported():
+            logger.warning("Streaming FIT files is not supported with fitfile %s, decoding whole files", fitfile.version_info.__version__)
+            self.chunk_size = None
+        if self.chunk_size and workers > 1:
+            logger.warning("Streamed FIT files are decoded while they are written, so they are not decoded by %d workers", workers)
+        self.file_names = FileProcessor.dir_to_files(input_dir, fitfile.file.name_regex, latest, recursive) if input_dir else []
 
     def file_count(self):
         """Return the number of files that will be processed."""
         return len(self.file_names)
 
-    def process_files(self, fit_file_processor):
-        """Import FIT files into the database."""
-        for file_name in tqdm(self.file_names, unit='files'):
-            try:
-                fit_file = fitfile.file.File(file_name, self.measurement_system)
-                if self.fit_types is None or fit_file.type in self.fit_types:
+    def __decode_files_parallel(self, file_names):
+        # Keep a bounded window of files in flight and hand them back in file order so the writer sees the same sequence as a serial import.
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            pending = collections.deque()
+            for file_name in file_names:
+                pending.append((file_name, executor.submit(_decode_file_to_rows, file_name, self.measurement_system).result))
+                if len(pending) > self.workers * 2:
+                    yield pending.popleft()
+            while pending:
+                yield pending.popleft()
+
+    def __decode_files(self, file_names):
+        if self.chunk_size:
+            # Streamed files are decoded while they are written so that only a chunk of messages is in memory at a time.
+            for file_name in file_names:
+                yield (file_name, functools.partial(StreamingFitFile, file_name, self.measurement_system, self.chunk_size))
+        elif self.workers > 1 and len(file_names) > 1:
+            yield from self.__decode_files_parallel(file_names)
+        else:
+            for file_name in file_names:
+                yield (file_name, functools.partial(_decode_file, file_name, self.measurement_system))
+
+    def process_files(self, fit_file_processor, profiler=None):
+        """
+        Import FIT files into the database, skipping files that were already imported unchanged.
+
+        Parameters:
+        fit_file_processor (FitFileProcessor): the processor that writes the FIT file data to the database
+        profiler (ImportProfiler): if set, the stages of the import are profiled per file
+
+        """
+        importer = f'{self.__class__.__name__}.{fit_file_processor.__class__.__name__}'
+        ledger = FileLedger(fit_file_processor.db_params, importer, fit_file_processor.ledger_db(), self.debug - 1)
+        with profiler.stage('ledger') if profiler else contextlib.nullcontext():
+            file_names = ledger.changed_files(self.file_names)
+        fit_file_processor.profiler = profiler
+        try:
+            with fit_file_processor.import_run() as transaction:
+                for file_name, decode in tqdm(self.__decode_files(file_names), total=len(file_names), unit='files'):
+                    with profiler.file(file_name) if profiler else contextlib.nullcontext():
+                        self.__process_file(fit_file_processor, transaction, ledger, file_name, decode, profiler)
+        finally:
+            fit_file_processor.profiler = None
+            if profiler:
+                profiler.detach()
+                profiler.log_slowest()
+        root_logger.info("%s handler calls: %r", importer, fit_file_processor.handler_call_counts())
+
+    def __process_file(self, fit_file_processor, transaction, ledger, file_name, decode, profiler):
+        # Only record files in the ledger once the batch they were written in has been committed.
+        try:
+            with profiler.stage('decode') if profiler else contextlib.nullcontext():
+                fit_file = decode()
+            if self.fit_types is None or fit_file.type in self.fit_types:
+                with profiler.stage('write') if profiler else contextlib.nullcontext():
                     fit_file_processor.write_file(fit_file)
-                    root_logger.debug("Wrote %s to the database", fit_file)
-                else:
-                    root_logger.info("skipping non-matching %s", fit_file)
-            except Exception as e:
-                logger.error("Failed to parse %s: %s", file_name, e)
-                root_logger.error("Failed to parse %s: %s - %s", file_name, e, traceback.format_exc())
+                root_logger.debug("Wrote %s to the database", fit_file)
+                ledger.record(file_name, ImportLedger.Outcome.imported)
+            else:
+                root_logger.info("skipping non-matching %s", fit_file)
+                ledger.record(file_name, ImportLedger.Outcome.skipped)
+        except Exception as e:
+            logger.error("Failed to parse %s: %s", file_name, e)
+            root_logger.error("Failed to parse %s: %s - %s", file_name, e, traceback.format_exc())
+            ledger.record(file_name, ImportLedger.Outcome.failed)
+        transaction.after_commit(ledger.flush)
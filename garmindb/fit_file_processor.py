@@ -7,10 +7,16 @@ __license__ = "GPL"
 import logging
 import sys
 import traceback
+import contextlib
+import functools
+import collections
 
 import fitfile
 
-from .garmindb import GarminDb, File, Device, DeviceInfo, Stress, Attributes
+from .garmindb import GarminDb, File, Device, DeviceInfo, Stress, Attributes, BulkUpsert
+from .import_transaction import ImportTransaction
+from .import_registry import ImportRegistry
+from .fit_data import StreamingFitFile
 
 
 logger = logging.getLogger(__file__)
@@ -18,49 +24,117 @@ logger.addHandler(logging.StreamHandler(stream=sys.stdout))
 root_logger = logging.getLogger()
 
 
+class PluginHooks(dict):
+    """Dispatch table that maps plugin hook names to the functions of the plugins that implement them."""
+
+    def __init__(self, plugins):
+        """Return a new PluginHooks instance for a list of plugins, hooks are looked up the first time they are dispatched."""
+        super().__init__()
+        self.plugins = plugins
+
+    def __missing__(self, handler_name):
+        functions = [function for function in (getattr(plugin, handler_name, None) for plugin in self.plugins) if function]
+        self[handler_name] = functions
+        return functions
+
+
 class FitFileProcessor():
     """Class that takes a parsed FIT file object and imports it into a database."""
 
-    def __init__(self, db_params, plugin_manager=None, debug=0):
+    # Some ordering is important: 1. create new file entries 2. create new device entries
+    priority_message_types = [fitfile.MessageType.file_id, fitfile.MessageType.device_info]
+    # Message types that are written before the rest when a file is streamed. They must be kept by StreamingFitFile.summary_message_types.
+    stream_priority_message_types = priority_message_types
+
+    def __init__(self, db_params, plugin_manager=None, debug=0, commit_files=1, commit_rows=None):
         """
         Return a new FitFileProcessor instance.
 
         Paramters:
         db_params (dict): database access configuration
         debug (Boolean): if True, debug logging is enabled
+        commit_files (int): during an import run, commit after this many files
+        commit_rows (int): during an import run, commit after this many rows, None to only commit by file count
         """
         root_logger.info("Debug: %s", debug)
         self.plugin_manager = plugin_manager
         self.db_params = db_params
         self.debug = debug
+        self.commit_files = commit_files
+        self.commit_rows = commit_rows
+        self.transaction = None
+        self.profiler = None
+        self.registry = None
+        self.message_type_handlers = {}
+        self.plugin_dispatch_tables = {}
+        self.plugin_hooks = PluginHooks([])
+        self.handler_calls = collections.Counter()
         self.garmin_db = GarminDb(db_params, debug - 1)
 
-    def _plugin_dispatch(self, plugins, handler_name, *args, **kwargs):
+    def ledger_db(self):
+        """Return the database that the processor writes the data from FIT files to."""
+        return self.garmin_db
+
+    def handler_call_counts(self):
+        """Return the number of times each message handler and plugin hook has been called, most called first."""
+        return dict(self.handler_calls.most_common())
+
+    def _profile_stage(self, name):
+        """Return a context that times the block as stage name of the current file if the import is being profiled."""
+        return self.profiler.stage(name) if self.profiler else contextlib.nullcontext()
+
+    def _set_plugins(self, plugins):
+        """Select the dispatch table for plugins, a dict of plugin names to the plugins that handle the current file."""
+        key = frozenset(plugins)
+        if key not in self.plugin_dispatch_tables:
+            self.plugin_dispatch_tables[key] = PluginHooks(list(plugins.values()))
+        self.plugin_hooks = self.plugin_dispatch_tables[key]
+
+    def _plugin_dispatch(self, handler_name, *args, **kwargs):
+        functions = self.plugin_hooks[handler_name]
+        if not functions:
+            return {}
+        self.handler_calls[handler_name] += len(functions)
         result = {}
-        for plugin in plugins:
-            function = getattr(plugin, handler_name, None)
-            if function:
-                result.update(function(*args, **kwargs))
+        for function in functions:
+            result.update(function(*args, **kwargs))
         return result
 
-    def __write_generic(self, fit_file, message_type, messages):
-        """Write all messages of a given message type to the database."""
-        handler_name = '_write_' + message_type.name + '_entry'
-        function = getattr(self, handler_name, None)
-        if function is not None:
-            for message in messages:
-                try:
-                    function(fit_file, message.fields)
-                except Exception as e:
-                    logger.error("Failed to write message %r type %r: %s", message_type, message, e)
-                    root_logger.error("Failed to write message %r type %r: %s", message_type, message, traceback.format_exc())
-        elif isinstance(message_type, fitfile.UnknownMessageType) or message_type.is_unknown():
+    def __write_entries(self, function, fit_file, message_type, messages):
+        """Write all messages of a given message type to the database with a per message handler."""
+        for message in messages:
+            try:
+                function(fit_file, message.fields)
+            except Exception as e:
+                logger.error("Failed to write message %r type %r: %s", message_type, message, e)
+                root_logger.error("Failed to write message %r type %r: %s", message_type, message, traceback.format_exc())
+
+    def __write_unhandled(self, handler_name, fit_file, message_type, messages):
+        if isinstance(message_type, fitfile.UnknownMessageType) or message_type.is_unknown():
             root_logger.debug("No entry handler %s for message type %r (%d) from %s: %s",
                               handler_name, message_type, len(messages), fit_file.filename, messages[0])
         else:
             root_logger.info("No entry handler %s for known message type %r (%d) from %s: %s",
                              handler_name, message_type, len(messages), fit_file.filename, messages[0])
 
+    def __message_type_handler(self, message_type):
+        """Return the name of and the function that writes all messages of message_type, resolving them the first time the type is seen."""
+        # Unknown message types compare equal to known ones with the same value, so key the table by name.
+        handler = self.message_type_handlers.get(message_type.name)
+        if handler is None:
+            handler_name = '_write_' + message_type.name
+            function = getattr(self, handler_name, None)
+            if function is None:
+                handler_name += '_entry'
+                entry_function = getattr(self, handler_name, None)
+                if entry_function is not None:
+                    function = functools.partial(self.__write_entries, entry_function)
+                else:
+                    function = functools.partial(self.__write_unhandled, handler_name)
+            handler = (handler_name, function)
+            self.message_type_handlers[message_type.name] = handler
+        return handler
+
     def _write_file_id(self, fit_file, message_type, messages):
         """Write all file id messages to the database."""
         self.serial_number = None
@@ -69,29 +143,139 @@ class FitFileProcessor():
         for message in messages:
             self._write_file_id_entry(fit_file, message.fields)
 
-    def __write_message_type(self, fit_file, message_type):
-        messages = fit_file[message_type]
-        function = getattr(self, '_write_' + message_type.name, self.__write_generic)
-        function(fit_file, message_type, messages)
+    def _message_offset(self, message_type):
+        """Return the number of messages of message_type from the current file that were written before the ones being written."""
+        return self.message_offsets[message_type.name]
+
+    def __write_message_type(self, fit_file, message_type, messages):
+        handler_name, function = self.__message_type_handler(message_type)
+        self.handler_calls[handler_name] += len(messages)
+        if self.profiler:
+            with self.profiler.message_type(message_type.name):
+                function(fit_file, message_type, messages)
+        else:
+            function(fit_file, message_type, messages)
+        self.message_offsets[message_type.name] += len(messages)
         root_logger.debug("Processed %d %r entries for %s", len(messages), message_type, fit_file.filename)
 
+    def _upsert(self, session, table_class, values_dict):
+        """Queue a row to be inserted or updated in table_class when all of the file's messages have been processed."""
+        if table_class not in self.upserts:
+            self.upserts[table_class] = BulkUpsert(session, table_class)
+        self.upserts[table_class].add(values_dict)
+
+    def _write_upserts(self):
+        """Write all queued rows to the database."""
+        for table_class, upsert in self.upserts.items():
+            upsert.session.flush()
+            count = upsert.flush()
+            root_logger.debug("Wrote %d %s rows", count, table_class.__name__)
+        self.upserts = {}
+
+    def _write_buffered(self, fit_file):
+        """Write the rows that were buffered while processing messages to the database."""
+        with self._profile_stage('upserts'):
+            self._write_upserts()
+
     def _write_message_types(self, fit_file, message_types):
         """Write all messages from the FIT file to the database ordered by message type."""
         root_logger.info("Importing %s (%s) [%s] with message types: %s", fit_file.filename, fit_file.time_created_local, fit_file.type, message_types)
-        #
-        # Some ordering is important: 1. create new file entries 2. create new device entries
-        #
-        priority_message_types = [fitfile.MessageType.file_id, fitfile.MessageType.device_info]
-        for message_type in priority_message_types:
-            self.__write_message_type(fit_file, message_type)
+        self.upserts = {}
+        self.message_offsets = collections.Counter()
+        for message_type in self.priority_message_types:
+            self.__write_message_type(fit_file, message_type, fit_file[message_type])
         for message_type in message_types:
-            if message_type not in priority_message_types:
-                self.__write_message_type(fit_file, message_type)
+            if message_type not in self.priority_message_types:
+                self.__write_message_type(fit_file, message_type, fit_file[message_type])
+        self._write_buffered(fit_file)
+
+    def _write_message_chunks(self, fit_file):
+        """Write the messages of a streamed FIT file to the database a chunk at a time, ordered by message type within each chunk."""
+        root_logger.info("Streaming %s (%s) [%s] with message types: %s", fit_file.filename, fit_file.time_created_local, fit_file.type, fit_file.message_types)
+        self.upserts = {}
+        self.message_offsets = collections.Counter()
+        for message_type in self.stream_priority_message_types:
+            self.__write_message_type(fit_file, message_type, fit_file[message_type])
+        for chunk in fit_file.message_chunks():
+            chunk_message_types = {}
+            for message in chunk:
+                if message.type not in self.stream_priority_message_types:
+                    chunk_message_types.setdefault(message.type, []).append(message)
+            for message_type, messages in chunk_message_types.items():
+                self.__write_message_type(fit_file, message_type, messages)
+            self._write_buffered(fit_file)
+
+    @contextlib.contextmanager
+    def import_run(self):
+        """Write all files in the block with shared database sessions that are committed in batches."""
+        self.transaction = ImportTransaction(self.commit_files, self.commit_rows, self.profiler)
+        try:
+            self.registry = ImportRegistry(self.transaction.session(self.garmin_db))
+            yield self.transaction
+            self.transaction.commit()
+        finally:
+            self.registry = None
+            self.transaction.close()
+            self.transaction = None
+
+    def _session_dbs(self):
+        """Return the session attribute names and databases that data from FIT files is written to."""
+        return {'garmin_db_session': self.garmin_db}
+
+    @contextlib.contextmanager
+    def _file_sessions(self):
+        """Open sessions for writing a file, savepoints in the current import run or a committed session per file otherwise."""
+        session_dbs = self._session_dbs()
+        if self.transaction is not None:
+            with self.transaction.file(session_dbs.values()) as sessions:
+                for session_name, session in zip(session_dbs, sessions):
+                    setattr(self, session_name, session)
+                yield
+        else:
+            with contextlib.ExitStack() as stack:
+                for session_name, db in session_dbs.items():
+                    setattr(self, session_name, stack.enter_context(db.managed_session()))
+                yield
+
+    def _write_file(self, fit_file):
+        """Write all data from the FIT file using the open sessions."""
+        if isinstance(fit_file, StreamingFitFile):
+            self._write_message_chunks(fit_file)
+        else:
+            self._write_message_types(fit_file, fit_file.message_types)
 
     def write_file(self, fit_file):
         """Write all data from the FIT file to database files."""
-        with self.garmin_db.managed_session() as self.garmin_db_session:
-            self._write_message_types(fit_file, fit_file.message_types)
+        if self.registry is not None:
+            self.registry.begin_file()
+        try:
+            with self._file_sessions():
+                self._write_file(fit_file)
+        except Exception:
+            # The file's rows were rolled back, so drop what the registry learned from them.
+            if self.registry is not None:
+                self.registry.rollback_file()
+            raise
+
+    def _file_id(self, pathname):
+        """Return the id of a file given it's pathname."""
+        if self.registry is not None:
+            return self.registry.file_id(pathname)
+        return File.s_get_id(self.garmin_db_session, pathname)
+
+    def _s_insert_or_update_device(self, values_dict, ignore_none=True):
+        """Insert or update a device, skipping the write if the import's registry shows it is unchanged."""
+        if self.registry is not None:
+            self.registry.s_insert_or_update_device(self.garmin_db_session, values_dict, ignore_none)
+        else:
+            Device.s_insert_or_update(self.garmin_db_session, values_dict, ignore_none=ignore_none)
+
+    def _s_insert_or_update_file(self, values_dict):
+        """Insert or update a file, skipping the write if the import's registry shows it is unchanged."""
+        if self.registry is not None:
+            self.registry.s_insert_or_update_file(self.garmin_db_session, values_dict)
+        else:
+            File.s_insert_or_update(self.garmin_db_session, values_dict)
 
     #
     # Message type handlers
@@ -112,7 +296,7 @@ class FitFileProcessor():
                 'manufacturer'  : self.manufacturer,
                 'product'       : fitfile.field_enums.name_for_enum(self.product),
             }
-            Device.s_insert_or_update(self.garmin_db_session, device)
+            self._s_insert_or_update_device(device)
         (file_id, file_name) = File.name_and_id_from_path(fit_file.filename)
         file = {
             'id'            : file_id,
@@ -120,7 +304,7 @@ class FitFileProcessor():
             'type'          : File.FileType.convert(message_fields.type),
             'serial_number' : self.serial_number
         }
-        File.s_insert_or_update(self.garmin_db_session, file)
+        self._s_insert_or_update_file(file)
 
     def _write_device_info_entry(self, fit_file, message_fields):
         timestamp = fit_file.utc_datetime_to_local(message_fields.timestamp)
@@ -141,9 +325,9 @@ class FitFileProcessor():
                 'product'           : fitfile.field_enums.name_for_enum(message_fields.product or self.product),
                 'hardware_version'  : message_fields.hardware_version
             }
-            Device.s_insert_or_update(self.garmin_db_session, device, ignore_none=True)
+            self._s_insert_or_update_device(device, ignore_none=True)
             device_info = {
-                'file_id'               : File.s_get_id(self.garmin_db_session, fit_file.filename),
+                'file_id'               : self._file_id(fit_file.filename),
                 'serial_number'         : serial_number,
                 'timestamp'             : timestamp,
                 'cum_operating_time'    : message_fields.cum_operating_time,
@@ -159,7 +343,7 @@ class FitFileProcessor():
             'timestamp' : message_fields.local_timestamp,
             'stress'    : message_fields.stress_level
         }
-        Stress.s_insert_or_update(self.garmin_db_session, stress)
+        self._upsert(self.garmin_db_session, Stress, stress)
 
     def _write_event_entry(self, fit_file, message_fields):
         root_logger.debug("event message: %r", message_fields)
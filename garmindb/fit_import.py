@@ -0,0 +1,76 @@
+"""Class that imports the FIT files of the configured directories with the configured import settings."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import sys
+import logging
+
+from .garmindb import GarminDb, Attributes
+from .statistics import Statistics
+from .import_monitoring import GarminMonitoringFitData, GarminSleepFitData
+from .activities_fit_data import GarminActivitiesFitData
+from .monitoring_fit_file_processor import MonitoringFitFileProcessor
+from .sleep_fit_file_processor import SleepFitFileProcessor
+from .activity_fit_file_processor import ActivityFitFileProcessor
+from .import_profiler import ImportProfiler
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+class FitImport():
+    """Imports monitoring, sleep, and activity FIT files using the workers, chunk size, commit, and profile settings of the import configuration."""
+
+    def __init__(self, gc_config, plugin_manager, debug=0):
+        """
+        Return a new FitImport instance.
+
+        Parameters:
+        gc_config (GarminConnectConfigManager): the configuration with the directories, databases, and import settings
+        plugin_manager (PluginManager): the plugins that extend the import
+        debug (int): the debug level
+        """
+        self.gc_config = gc_config
+        self.plugin_manager = plugin_manager
+        self.debug = debug
+        self.db_params = gc_config.get_db_params()
+        self.measurement_system = Attributes.measurements_type(GarminDb(self.db_params))
+        self.profile_file = gc_config.import_profile_file()
+        self.profiler = ImportProfiler() if self.profile_file else None
+
+    def fit_data(self, fit_data_class, input_dir, latest=False):
+        """Return a fit_data_class instance for the FIT files in input_dir that decodes with the configured workers and chunk size."""
+        return fit_data_class(input_dir, latest, self.measurement_system, self.debug, self.gc_config.import_workers(), self.gc_config.import_stream_chunk_size())
+
+    def fit_file_processor(self, fit_file_processor_class):
+        """Return a fit_file_processor_class instance that commits as often as configured."""
+        return fit_file_processor_class(self.db_params, self.plugin_manager, self.debug, self.gc_config.import_commit_files(), self.gc_config.import_commit_rows())
+
+    def import_files(self, fit_data_class, fit_file_processor_class, input_dir, latest=False):
+        """Import the FIT files in input_dir and return the number of files that were checked."""
+        fit_data = self.fit_data(fit_data_class, input_dir, latest)
+        if fit_data.file_count() > 0:
+            fit_data.process_files(self.fit_file_processor(fit_file_processor_class), self.profiler)
+        return fit_data.file_count()
+
+    def import_all(self, latest=False):
+        """Import the FIT files of the enabled stats, like a full import does."""
+        if self.gc_config.is_stat_enabled(Statistics.monitoring):
+            monitoring_dir = self.gc_config.get_monitoring_base_dir()
+            root_logger.info("Importing monitoring FIT files from %s", monitoring_dir)
+            self.import_files(GarminMonitoringFitData, MonitoringFitFileProcessor, monitoring_dir, latest)
+            self.import_files(GarminSleepFitData, SleepFitFileProcessor, monitoring_dir, latest)
+        if self.gc_config.is_stat_enabled(Statistics.activities):
+            activities_dir = self.gc_config.get_activities_dir()
+            root_logger.info("Importing activity FIT files from %s", activities_dir)
+            self.import_files(GarminActivitiesFitData, ActivityFitFileProcessor, activities_dir, latest)
+        self.write_profile()
+
+    def write_profile(self):
+        """Write the profile of the imports so far to the configured profile file if the imports are profiled."""
+        if self.profiler:
+            self.profiler.write_report(self.profile_file)
@@ -54,8 +54,8 @@ class GarminConnectConfigManager(JsonConfig):
 
     @classmethod
     def __create_dir_if_needed(cls, dir):
-        if not os.path.exists(dir):
-            os.makedirs(dir)
+        # Directories are created from concurrent download threads.
+        os.makedirs(dir, exist_ok=True)
         return dir
 
     def get_session_file(self):
@@ -199,6 +199,10 @@ class GarminConnectConfigManager(JsonConfig):
         """Return the Garmin base domain to use for api calls."""
         return self.get_node_value_default('garmin', 'domain', "garmin.com")
 
+    def get_garmin_replay_url(self):
+        """Return the URL of a replay server to download from instead of Garmin Connect, if any."""
+        return self.get_node_value_default('garmin', 'replay_url', None)
+
     def default_display_activities(cls):
         """Return a list of the default activities to display."""
         return [Sport.strict_from_string(activity) for activity in super().default_display_activities]
@@ -244,6 +248,62 @@ class GarminConnectConfigManager(JsonConfig):
         """Return the number of days to overlap previously downloaded data when downloading."""
         return self.get_node_value('data', 'download_days_overlap')
 
+    def download_workers(self):
+        """Return the number of requests to Garmin Connect that can be in progress at the same time when downloading."""
+        return self.get_node_value_default('download', 'workers', 4)
+
+    def download_rate(self):
+        """Return the average number of requests per second to make to Garmin Connect when downloading."""
+        return self.get_node_value_default('download', 'requests_per_second', 1.0)
+
+    def download_burst(self):
+        """Return the number of requests that can be made back to back before being limited to the request rate."""
+        return self.get_node_value_default('download', 'burst', 4)
+
+    def download_retries(self):
+        """Return the number of times to retry a request that failed because Garmin Connect was busy or had an error."""
+        return self.get_node_value_default('download', 'retries', 3)
+
+    def download_backoff_seconds(self):
+        """Return the number of seconds to wait before the first retry of a failed request, doubled for every retry."""
+        return self.get_node_value_default('download', 'backoff_seconds', 2.0)
+
+    def download_range_days(self):
+        """Return the number of days to request at a time for stats, like weight and rhr, whose API takes a date range."""
+        return self.get_node_value_default('download', 'range_days', 28)
+
+    def download_activity_page_size(self):
+        """Return the number of activities to request at a time when getting the activity list."""
+        return self.get_node_value_default('download', 'activity_page_size', 100)
+
+    def download_json_archive(self):
+        """Return whether to save downloaded JSON files compressed in a JSON archive per directory instead of as individual files."""
+        return self.get_node_value_default('download', 'json_archive', False)
+
+    def import_workers(self):
+        """Return the number of processes to use for decoding FIT files during an import."""
+        return self.get_node_value_default('import', 'workers', 1)
+
+    def import_commit_files(self):
+        """Return the number of FIT files to write to the database between commits during an import."""
+        return self.get_node_value_default('import', 'commit_files', 100)
+
+    def import_commit_rows(self):
+        """Return the number of rows to write to the database between commits during an import."""
+        return self.get_node_value_default('import', 'commit_rows', 100000)
+
+    def import_stream_chunk_size(self):
+        """Return the number of messages to stream to the database at a time when importing FIT files, None to decode whole files."""
+        return self.get_node_value_default('import', 'stream_chunk_size', 0) or None
+
+    def import_profile_file(self):
+        """Return the file to write a profile of the FIT file imports to, a .csv or JSON file, None to not profile the imports."""
+        return self.get_node_value_default('import', 'profile_file', None) or None
+
+    def analyze_workers(self):
+        """Return the number of processes to use for calculating the summaries of years during an analyze."""
+        return self.get_node_value_default('analyze', 'workers', 1)
+
     def course_views(self, type):
         """Return a list of course ids to create views for for the given activitiy type."""
         return self.get_node_value('course_views', type)
@@ -10,9 +10,9 @@ import logging
 import dateutil.parser
 
 import fitfile
-from idbutils import JsonFileProcessor
 
 from .garmin_connect_enums import Event, get_summary_sport, get_details_sport
+from .garmin_json_file_processor import GarminJsonFileProcessor
 from .garmindb import ActivitiesDb, Activities, StepsActivities, PaddleActivities, CycleActivities
 
 
@@ -21,7 +21,7 @@ logger.addHandler(logging.StreamHandler(stream=sys.stdout))
 root_logger = logging.getLogger()
 
 
-class GarminJsonActivityData(JsonFileProcessor):
+class GarminJsonActivityData(GarminJsonFileProcessor):
     """Base class for importing Garmin activity data from JSON formatted Garmin Connect details downloads."""
 
     def __init__(self, db_params, file_regex, input_dir, latest, measurement_system, debug):
@@ -37,11 +37,18 @@ class GarminJsonActivityData(JsonFileProcessor):
         debug (Boolean): enable debug logging
 
         """
-        super().__init__(file_regex, input_dir=input_dir, latest=latest, debug=debug)
+        super().__init__(db_params, file_regex, input_dir=input_dir, latest=latest, debug=debug)
         self.measurement_system = measurement_system
         self.garmin_act_db = ActivitiesDb(db_params, self.debug - 1)
         self.conversions = {}
 
+    def _ledger_db(self):
+        return self.garmin_act_db
+
+    def _session_dbs(self):
+        """Return the session attribute names and databases that the JSON data is written to."""
+        return {'garmin_act_db_session': self.garmin_act_db}
+
     def _process_common(self, json_data):
         distance = self._get_field_obj(json_data, 'distance', fitfile.Distance.from_meters)
         ascent = self._get_field_obj(json_data, 'elevationGain', fitfile.Distance.from_meters)
@@ -82,8 +89,7 @@ class GarminJsonActivityData(JsonFileProcessor):
 
     def _process_json(self, json_data):
         """Import data from files into the database."""
-        with self.garmin_act_db.managed_session() as self.garmin_act_db_session:
-            return self._activities_process_json(json_data)
+        return self._activities_process_json(json_data)
 
 
 class GarminJsonSummaryData(GarminJsonActivityData):
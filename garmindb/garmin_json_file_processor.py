@@ -0,0 +1,101 @@
+"""Base class for importing JSON formatted Garmin data into a database."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+
+import json
+import traceback
+from tqdm import tqdm
+
+from idbutils import JsonFileProcessor
+
+from .garmindb import ImportLedger
+from .file_ledger import FileLedger
+from .import_transaction import ImportTransaction
+from .json_archive import JsonArchive
+
+
+class GarminJsonFileProcessor(JsonFileProcessor):
+    """Base class for importing JSON formatted Garmin data, from files or JSON archives, into a database that skips files that were already imported unchanged."""
+
+    def __init__(self, db_params, file_regex, input_file=None, input_dir=None, latest=True, debug=False, recursive=False):
+        """
+        Return an instance of GarminJsonFileProcessor.
+
+        Parameters:
+        ----------
+            db_params (dict): configuration data for accessing the database
+            file_regex (string): only process files that match this regex
+            input_file (string): file (full path) to check for data
+            input_dir (string): directory (full path) to check for data files
+            latest (Boolean): check for latest files only
+            debug (Boolean): enable debug logging
+            recursive (Boolean): check the search directory recursively
+
+        """
+        super().__init__(file_regex, input_file=input_file, latest=latest, debug=debug, recursive=recursive)
+        if input_dir:
+            self.file_names = JsonArchive.dir_to_files(input_dir, file_regex, latest, recursive)
+            self.logger.info("Found %d json files for %s in %s", self.file_count(), file_regex, input_dir)
+        self.db_params = db_params
+
+    def _ledger_db(self):
+        """Return the database that the JSON data is imported into."""
+        return self.garmin_db
+
+    def _session_dbs(self):
+        """Return the session attribute names and databases that the JSON data is written to."""
+        return {'garmin_db_session': self.garmin_db}
+
+    def _parse_file(self, filename):
+        def parser(entry):
+            for (conversion_key, conversion_func) in self.conversions.items():
+                entry_value = entry.get(conversion_key)
+                if entry_value is not None:
+                    entry[conversion_key] = conversion_func(entry_value)
+            return entry
+        return json.loads(JsonArchive.read_file(filename), object_hook=parser)
+
+    def _process_files(self, commit_files=100, commit_rows=100000):
+        ledger = FileLedger(self.db_params, self.__class__.__name__, self._ledger_db(), self.debug - 1, JsonArchive.file_stat, JsonArchive.content_hash)
+        file_names = ledger.changed_files(self.file_names)
+        self.logger.info("Processing %d json files", len(file_names))
+        session_dbs = self._session_dbs()
+        transaction = ImportTransaction(commit_files, commit_rows)
+        try:
+            for file_name in tqdm(file_names, unit='files'):
+                # Only record files in the ledger once the batch they were written in has been committed.
+                try:
+                    json_data = self._parse_file(file_name)
+                    with transaction.file(session_dbs.values()) as sessions:
+                        for session_name, session in zip(session_dbs, sessions):
+                            setattr(self, session_name, session)
+                        updates = self._process_json(json_data)
+                    if updates > 0:
+                        self.logger.info("DB updated with %d entries from %s", updates, file_name)
+                        self.total_updates += updates
+                    else:
+                        self.logger.warning("No data saved for %s", file_name)
+                    ledger.record(file_name, ImportLedger.Outcome.imported)
+                except Exception:
+                    self.logger.error("Failed to parse %s: %s", file_name, traceback.format_exc())
+                    ledger.record(file_name, ImportLedger.Outcome.failed)
+                transaction.after_commit(ledger.flush)
+            transaction.commit()
+        finally:
+            transaction.close()
+        self.logger.info("DB updated with %d entries from %d files.", self.total_updates, len(file_names))
+
+    def process(self, commit_files=100, commit_rows=100000):
+        """
+        Import files into the database sharing one session per database, committing in batches.
+
+        Parameters:
+        ----------
+            commit_files (int): commit after this many files have been imported
+            commit_rows (int): commit after this many rows have been written, None to only commit by file count
+
+        """
+        self._process_files(commit_files, commit_rows)
@@ -13,7 +13,8 @@ import traceback
 from idbutils import FileProcessor
 from .tcx import Tcx
 
-from .garmindb import GarminDb, Device, File, ActivitiesDb, Activities, ActivityRecords, ActivityLaps
+from .garmindb import GarminDb, Device, File, ActivitiesDb, Activities, ActivityRecords, ActivityLaps, ImportLedger, DirtyDays
+from .file_ledger import FileLedger
 
 
 logger = logging.getLogger(__file__)
@@ -132,6 +133,7 @@ class GarminTcxData():
         if end_loc is not None:
             activity.update({'stop_lat': end_loc.lat_deg, 'stop_long': end_loc.long_deg})
         Activities.s_insert_or_update(self.garmin_act_db_session, activity, ignore_none=True, ignore_zero=True)
+        DirtyDays.s_add(self.garmin_db_session, DirtyDays.days_written(Activities.__tablename__, [activity]))
         for lap_number, lap in enumerate(tcx.laps):
             self.__process_lap(tcx, file_id, lap_number, lap)
 
@@ -139,10 +141,15 @@ class GarminTcxData():
         """Import data from TCX files into the database."""
         garmin_db = GarminDb(db_params, self.debug - 1)
         garmin_act_db = ActivitiesDb(db_params, self.debug - 1)
+        ledger = FileLedger(db_params, self.__class__.__name__, garmin_act_db, self.debug - 1)
         with garmin_db.managed_session() as self.garmin_db_session, garmin_act_db.managed_session() as self.garmin_act_db_session:
-            for file_name in tqdm(self.file_names, unit='files'):
+            for file_name in tqdm(ledger.changed_files(self.file_names), unit='files'):
                 try:
                     self.__process_file(file_name)
+                    ledger.record(file_name, ImportLedger.Outcome.imported)
                 except Exception as e:
                     logger.error('Failed to processes TCX file %s: %s', file_name, e)
                     root_logger.error('Failed to processes TCX file %s: %s', file_name, traceback.format_exc())
+                    ledger.record(file_name, ImportLedger.Outcome.failed)
+        # only record the outcomes once the data has been committed
+        ledger.flush()
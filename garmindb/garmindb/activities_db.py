@@ -14,6 +14,8 @@ from sqlalchemy.ext.hybrid import hybrid_property
 import fitfile
 import idbutils
 
+from .stats_by_day import s_get_stats_by_day, col_sum, row_count
+
 
 logger = logging.getLogger(__name__)
 
@@ -181,6 +183,15 @@ class Activities(ActivitiesDb.Base, ActivitiesCommon):
         }
         return stats
 
+    @classmethod
+    def s_get_stats_by_day(cls, session, start_ts, end_ts):
+        """Return a dict of days and the stats of each day in the time range."""
+        return s_get_stats_by_day(session, cls, {
+            'activities'            : row_count(),
+            'activities_calories'   : col_sum(cls.calories),
+            'activities_distance'   : col_sum(cls.distance),
+        }, start_ts, end_ts)
+
 
 class ActivityLaps(ActivitiesDb.Base, ActivitiesCommon):
     """Class that holds data for an activity lap."""
@@ -306,6 +317,11 @@ class ActivityRecords(ActivitiesDb.Base, idbutils.DbObject):
         with db.managed_session() as session:
             return cls.s_get_activity(session, activity_id)
 
+    @classmethod
+    def s_get_record_numbers(cls, session, activity_id):
+        """Return the set of record numbers already stored for a given activity_id."""
+        return {record for (record,) in session.query(cls.record).filter(cls.activity_id == activity_id)}
+
     @hybrid_property
     def position(self):
         """Return the location where the record was recorded."""
@@ -0,0 +1,140 @@
+"""Functions for writing many rows to a database table with a minimum of statements."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+
+from sqlalchemy import insert, func
+from sqlalchemy.dialects import sqlite, postgresql, mysql
+
+
+logger = logging.getLogger(__name__)
+
+
+def _insert_or_ignore_statement(session, table):
+    dialect = session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == 'mysql':
+        return insert(table).prefix_with('IGNORE')
+    return insert(table)
+
+
+def _uniform_rows(rows):
+    # executemany needs every row to have the same set of columns
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+    return [{column: row.get(column) for column in columns} for row in rows]
+
+
+def s_insert_or_ignore(session, table_class, rows):
+    """Insert a list of row dicts into the table of table_class with one statement, skipping rows whose primary key already exists."""
+    if rows:
+        logger.debug("Inserting %d rows into %s", len(rows), table_class.__tablename__)
+        session.execute(_insert_or_ignore_statement(session, table_class.__table__), _uniform_rows(rows))
+    return len(rows)
+
+
+class BulkUpsert():
+    """Collects rows for a table and writes them with native upsert statements, merging values the way DbObject.s_insert_or_update does."""
+
+    def __init__(self, session, table_class, ignore_none=True):
+        """
+        Return a new BulkUpsert instance.
+
+        Parameters:
+        session (Session): the session the rows will be written with
+        table_class (DbObject): the class of the table the rows will be written to
+        ignore_none (Boolean): if True, None values do not overwrite values from earlier rows or the database
+        """
+        self.session = session
+        self.table_class = table_class
+        self.ignore_none = ignore_none
+        self.table = table_class.__table__
+        self.primary_key_cols = [col.name for col in self.table.primary_key.columns]
+        self.rows = {}
+
+    def __len__(self):
+        """Return the number of distinct rows waiting to be written."""
+        return len(self.rows)
+
+    def add(self, values_dict):
+        """Add a row, merging it with any pending row that has the same primary key."""
+        key = tuple(values_dict[col_name] for col_name in self.primary_key_cols)
+        row = self.rows.get(key)
+        if row is None:
+            self.rows[key] = dict(values_dict)
+        else:
+            row.update({col_name: value for col_name, value in values_dict.items() if not self.ignore_none or value is not None})
+
+    def __update_value(self, new_value, col_name):
+        if self.ignore_none:
+            return func.coalesce(new_value, self.table.c[col_name])
+        return new_value
+
+    def __upsert_statement(self, dialect, col_names):
+        update_col_names = [col_name for col_name in col_names if col_name not in self.primary_key_cols]
+        if dialect in ['sqlite', 'postgresql']:
+            statement = (sqlite.insert if dialect == 'sqlite' else postgresql.insert)(self.table)
+            if not update_col_names:
+                return statement.on_conflict_do_nothing(index_elements=self.primary_key_cols)
+            return statement.on_conflict_do_update(
+                index_elements=self.primary_key_cols,
+                set_={col_name: self.__update_value(statement.excluded[col_name], col_name) for col_name in update_col_names}
+            )
+        statement = mysql.insert(self.table)
+        if not update_col_names:
+            return statement.prefix_with('IGNORE')
+        return statement.on_duplicate_key_update({col_name: self.__update_value(statement.inserted[col_name], col_name) for col_name in update_col_names})
+
+    def flush(self):
+        """Write all pending rows to the database and return the number of rows written."""
+        count = len(self.rows)
+        dialect = self.session.get_bind().dialect.name
+        if dialect in ['sqlite', 'postgresql', 'mysql']:
+            # Group rows by the columns they set so that columns a row doesn't set still get their defaults on insert.
+            rows_by_cols = {}
+            for row in self.rows.values():
+                rows_by_cols.setdefault(tuple(row), []).append(row)
+            for col_names, rows in rows_by_cols.items():
+                self.session.execute(self.__upsert_statement(dialect, col_names), rows)
+        else:
+            for row in self.rows.values():
+                self.table_class.s_insert_or_update(self.session, row, ignore_none=self.ignore_none)
+        logger.debug("Upserted %d rows into %s", count, self.table.name)
+        self.rows = {}
+        return count
+
+
+class UpsertBatch():
+    """Collects rows for several tables without a session, so that they can be calculated in one process and written with BulkUpsert by another."""
+
+    def __init__(self):
+        """Return a new, empty, UpsertBatch instance."""
+        self.rows = []
+
+    def __len__(self):
+        """Return the number of rows in the batch."""
+        return len(self.rows)
+
+    def add(self, table_class, values_dict, ignore_none=True):
+        """Add a row for the table of table_class, it is merged with earlier rows the way BulkUpsert.add does when the batch is written."""
+        self.rows.append((table_class, ignore_none, dict(values_dict)))
+
+    def write(self, sessions):
+        """
+        Write the rows in the order they were added with one BulkUpsert per table and return the number of rows written.
+
+        Parameters:
+        sessions (dict): the databases of the tables, like GarminSummaryDb, and the sessions to write them with
+        """
+        bulk_upserts = {}
+        for table_class, ignore_none, values_dict in self.rows:
+            bulk_upsert = bulk_upserts.get((table_class, ignore_none))
+            if bulk_upsert is None:
+                bulk_upsert = bulk_upserts[(table_class, ignore_none)] = BulkUpsert(sessions[table_class.db], table_class, ignore_none)
+            bulk_upsert.add(values_dict)
+        return sum(bulk_upsert.flush() for bulk_upsert in bulk_upserts.values())
@@ -0,0 +1,201 @@
+"""Objects for rolling up the statistics of weeks, months, and years from the DaysSummary rows of their days."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import datetime
+
+import fitfile
+
+from .garmin_summary_db import DaysSummary, DaysSummaryWeights
+
+
+logger = logging.getLogger(__name__)
+
+
+def _values(days, col_name):
+    return [day[col_name] for day in days if day[col_name] is not None]
+
+
+def _avg(days, col_name):
+    values = _values(days, col_name)
+    return sum(values) / len(values) if values else None
+
+
+def _weighted_avg(days, col_name, weight_col_name):
+    # days without a sample count weigh like one sample
+    weighted_values = [(day[col_name], day[weight_col_name] or 1) for day in days if day[col_name] is not None]
+    total_weight = sum(weight for _, weight in weighted_values)
+    return sum(value * weight for value, weight in weighted_values) / total_weight if weighted_values else None
+
+
+def _min(days, col_name):
+    values = _values(days, col_name)
+    return min(values) if values else None
+
+
+def _max(days, col_name):
+    values = _values(days, col_name)
+    return max(values) if values else None
+
+
+def _sum(days, col_name):
+    values = _values(days, col_name)
+    return sum(values) if values else None
+
+
+def _time_secs(days, col_name):
+    # like the SQL time aggregates, zero times are no data
+    return [secs for secs in (fitfile.conversions.time_to_secs(day[col_name]) for day in days if day[col_name] is not None) if secs > 0]
+
+
+def _time(secs):
+    # like the SQL time aggregates, times wrap around at a day and fractions of a second are dropped
+    return fitfile.conversions.secs_to_dt_time(int(secs)) if secs else datetime.time.min
+
+
+def _time_avg_secs(days, col_name):
+    secs = _time_secs(days, col_name)
+    return sum(secs) / len(secs) if secs else None
+
+
+def _time_avg(days, col_name):
+    return _time(_time_avg_secs(days, col_name))
+
+
+def _time_min(days, col_name):
+    return _time(min(_time_secs(days, col_name), default=None))
+
+
+def _time_max(days, col_name):
+    return _time(max(_time_secs(days, col_name), default=None))
+
+
+def _time_sum(days, col_name):
+    return _time(sum(_time_secs(days, col_name)))
+
+
+class DaysRollup():
+    """The DaysSummary rows of a time period, for calculating the statistics of weeks, months, and years without rescanning the raw data."""
+
+    aggregates = {
+        'hr_min'                    : _min,
+        'hr_max'                    : _max,
+        'inactive_hr_min'           : _min,
+        'inactive_hr_max'           : _max,
+        'weight_avg'                : _avg,
+        'weight_min'                : _min,
+        'weight_max'                : _max,
+        'intensity_time'            : _time_avg,
+        'moderate_activity_time'    : _time_avg,
+        'vigorous_activity_time'    : _time_sum,
+        'steps_goal'                : _sum,
+        'floors_goal'               : _sum,
+        'sleep_avg'                 : _time_avg,
+        'sleep_min'                 : _time_min,
+        'sleep_max'                 : _time_max,
+        'rem_sleep_avg'             : _time_avg,
+        'rem_sleep_min'             : _time_min,
+        'rem_sleep_max'             : _time_max,
+        'calories_avg'              : _avg,
+        'calories_bmr_avg'          : _avg,
+        'calories_goal'             : _sum,
+        'calories_consumed_avg'     : _avg,
+        'activities_calories'       : _sum,
+        'activities_distance'       : _sum,
+        'hydration_goal'            : _sum,
+        'hydration_avg'             : _avg,
+        'hydration_intake'          : _sum,
+        'sweat_loss_avg'            : _avg,
+        'sweat_loss'                : _sum,
+        'spo2_avg'                  : _avg,
+        'spo2_min'                  : _min,
+        'rr_waking_avg'             : _avg,
+        'rr_max'                    : _max,
+        'rr_min'                    : _min,
+        'bb_max'                    : _avg,
+        'bb_min'                    : _avg,
+    }
+    weighted_aggregates = {
+        'hr_avg'            : 'hr_samples',
+        'inactive_hr_avg'   : 'inactive_hr_samples',
+    }
+
+    def __init__(self, days):
+        """Return a new DaysRollup instance for a list of dicts of DaysSummary and DaysSummaryWeights values ordered by day."""
+        self.days = days
+
+    @classmethod
+    def s_get(cls, session, start_ts, end_ts):
+        """Return a DaysRollup of the DaysSummary rows, and their weights, from start_ts up to end_ts."""
+        days_summary_cols = [col.name for col in DaysSummary.__table__.columns]
+        weights_cols = [col.name for col in DaysSummaryWeights.__table__.columns if col.name != 'day']
+        query = (
+            session.query(DaysSummary, DaysSummaryWeights).outerjoin(DaysSummaryWeights, DaysSummaryWeights.day == DaysSummary.day)
+            .filter(DaysSummary.day >= start_ts, DaysSummary.day < end_ts).order_by(DaysSummary.day)
+        )
+        days = []
+        for days_summary, weights in query:
+            day = {col_name: getattr(days_summary, col_name) for col_name in days_summary_cols}
+            day.update({col_name: getattr(weights, col_name) if weights is not None else None for col_name in weights_cols})
+            days.append(day)
+        logger.debug("Loaded %d days to roll up from %s to %s", len(days), start_ts, end_ts)
+        return cls(days)
+
+    def months(self):
+        """Return the months that have days."""
+        return sorted({day['day'].month for day in self.days})
+
+    def __days(self, start_ts, end_ts):
+        return [day for day in self.days if start_ts <= day['day'] < end_ts]
+
+    @classmethod
+    def __prefer_daily_summary(cls, days, flag_col_name):
+        # Like the weekly stats, use the days the daily summary has the value for. Only if there are none fall back to the other days.
+        daily_summary_days = [day for day in days if day[flag_col_name]]
+        return (daily_summary_days or days, bool(daily_summary_days))
+
+    def __intensity_time_goal(self, first_day_ts, goal_weeks):
+        # intensity_time_goal is a weekly goal and each day holds 1/7 of it, so sum up weekly values like DailySummary.get_monthly_stats
+        goal_secs = 0
+        for week in range(goal_weeks):
+            week_start_ts = first_day_ts + datetime.timedelta(7 * week)
+            day_goal_secs = _time_secs(self.__days(week_start_ts, week_start_ts + datetime.timedelta(7)), 'intensity_time_goal')
+            if day_goal_secs:
+                goal_secs += (7 * sum(day_goal_secs)) // len(day_goal_secs)
+        return _time(goal_secs)
+
+    def get_stats(self, start_ts, end_ts, goal_weeks=1):
+        """
+        Return a dictionary of aggregate statistics for the time period from the statistics of its days.
+
+        Parameters:
+        start_ts (date): the first day of the time period
+        end_ts (date): the day after the last day of the time period
+        goal_weeks (int): the number of weeks, starting from the first day, that the intensity time goal is summed up for
+        """
+        days = self.__days(start_ts, end_ts)
+        stats = {col_name: aggregate(days, col_name) for col_name, aggregate in self.aggregates.items()}
+        for col_name, weight_col_name in self.weighted_aggregates.items():
+            stats[col_name] = _weighted_avg(days, col_name, weight_col_name)
+        stats['intensity_time_goal'] = self.__intensity_time_goal(start_ts, goal_weeks)
+        (rhr_days, _) = self.__prefer_daily_summary(days, 'daily_summary_rhr')
+        stats.update({'rhr_avg': _avg(rhr_days, 'rhr_avg'), 'rhr_min': _min(rhr_days, 'rhr_min'), 'rhr_max': _max(rhr_days, 'rhr_max')})
+        (stress_days, from_daily_summary) = self.__prefer_daily_summary(days, 'daily_summary_stress')
+        stats['stress_avg'] = _avg(stress_days, 'stress_avg') if from_daily_summary else _weighted_avg(stress_days, 'stress_avg', 'stress_samples')
+        (floors_days, from_daily_summary) = self.__prefer_daily_summary(days, 'daily_summary_floors')
+        stats['floors'] = _sum(floors_days, 'floors')
+        if not from_daily_summary:
+            # like MonitoringClimb, no climb data is 0 floors
+            stats['floors'] = stats['floors'] or 0
+        (steps_days, from_daily_summary) = self.__prefer_daily_summary(days, 'daily_summary_steps')
+        stats['steps'] = _sum(steps_days, 'steps')
+        stats['calories_active_avg'] = _avg(steps_days, 'calories_active_avg')
+        if not from_daily_summary:
+            # like Monitoring, no active calories data is 0 active calories
+            stats['calories_active_avg'] = stats['calories_active_avg'] or 0
+        stats['activities'] = _sum(days, 'activities') or 0
+        stats['first_day'] = start_ts
+        return stats
@@ -8,12 +8,17 @@ import os
 import datetime
 import logging
 import re
-from sqlalchemy import Column, Integer, Date, DateTime, Time, Float, String, Enum, ForeignKey, func, PrimaryKeyConstraint
+import enum
+import uuid
+import hashlib
+from sqlalchemy import Column, Integer, BigInteger, Boolean, Date, DateTime, Time, Float, String, Enum, ForeignKey, func, PrimaryKeyConstraint
 from sqlalchemy.ext.hybrid import hybrid_property
 
 import fitfile
 import idbutils
 
+from .bulk_writer import BulkUpsert
+from .stats_by_day import s_get_stats_by_day, col_avg, col_count, col_min, col_max, col_sum, time_col_avg, time_col_min, time_col_max, time_col_sum
 
 logger = logging.getLogger(__name__)
 
@@ -199,6 +204,15 @@ class Weight(GarminDb.Base, idbutils.DbObject):
             'weight_max': cls.s_get_col_max(session, cls.weight, start_ts, end_ts)
         }
 
+    @classmethod
+    def s_get_stats_by_day(cls, session, start_ts, end_ts):
+        """Return a dictionary of days and the aggregate statistics of each day in the given time period."""
+        return s_get_stats_by_day(session, cls, {
+            'weight_avg': col_avg(cls.weight, True),
+            'weight_min': col_min(cls.weight, True),
+            'weight_max': col_max(cls.weight)
+        }, start_ts, end_ts)
+
 
 class Stress(GarminDb.Base, idbutils.DbObject):
     """Class representing a stress reading."""
@@ -218,6 +232,14 @@ class Stress(GarminDb.Base, idbutils.DbObject):
             'stress_avg': cls.s_get_col_avg(session, cls.stress, start_ts, end_ts, True),
         }
 
+    @classmethod
+    def s_get_stats_by_day(cls, session, start_ts, end_ts, samples=False):
+        """Return a dictionary of days and the aggregate statistics of each day in the given time period, with the sample count if samples is True."""
+        aggregates = {'stress_avg': col_avg(cls.stress, True)}
+        if samples:
+            aggregates['stress_samples'] = col_count(cls.stress, True)
+        return s_get_stats_by_day(session, cls, aggregates, start_ts, end_ts)
+
 
 class Sleep(GarminDb.Base, idbutils.DbObject):
     """Class representing a sleep session."""
@@ -253,6 +275,18 @@ class Sleep(GarminDb.Base, idbutils.DbObject):
             'rem_sleep_max' : cls.s_get_time_col_max(session, cls.rem_sleep, start_ts, end_ts),
         }
 
+    @classmethod
+    def s_get_stats_by_day(cls, session, start_ts, end_ts):
+        """Return a dictionary of days and the aggregate statistics of each day in the given time period."""
+        return s_get_stats_by_day(session, cls, {
+            'sleep_avg'     : time_col_avg(cls, cls.total_sleep),
+            'sleep_min'     : time_col_min(cls, cls.total_sleep),
+            'sleep_max'     : time_col_max(cls, cls.total_sleep),
+            'rem_sleep_avg' : time_col_avg(cls, cls.rem_sleep),
+            'rem_sleep_min' : time_col_min(cls, cls.rem_sleep),
+            'rem_sleep_max' : time_col_max(cls, cls.rem_sleep),
+        }, start_ts, end_ts)
+
 
 class SleepEvents(GarminDb.Base, idbutils.DbObject):
     """Table that stores events recorded during sleep."""
@@ -321,6 +355,15 @@ class RestingHeartRate(GarminDb.Base, idbutils.DbObject):
             'rhr_max': cls.s_get_col_max(session, cls.resting_heart_rate, start_ts, end_ts),
         }
 
+    @classmethod
+    def s_get_stats_by_day(cls, session, start_ts, end_ts):
+        """Return a dictionary of days and the aggregate statistics of each day in the given time period."""
+        return s_get_stats_by_day(session, cls, {
+            'rhr_avg': col_avg(cls.resting_heart_rate, ignore_le_zero=True),
+            'rhr_min': col_min(cls.resting_heart_rate, ignore_le_zero=True),
+            'rhr_max': col_max(cls.resting_heart_rate),
+        }, start_ts, end_ts)
+
 
 class DailySummary(GarminDb.Base, idbutils.DbObject):
     """Class representing a Garmin daily summary."""
@@ -453,6 +496,45 @@ class DailySummary(GarminDb.Base, idbutils.DbObject):
         stats['day'] = day_ts
         return stats
 
+    @classmethod
+    def s_get_stats_by_day(cls, session, start_ts, end_ts):
+        """Return a dictionary of days and the aggregate statistics of each day in the given time period."""
+        stats_by_day = s_get_stats_by_day(session, cls, {
+            'rhr_avg'                   : col_avg(cls.rhr),
+            'rhr_min'                   : col_min(cls.rhr),
+            'rhr_max'                   : col_max(cls.rhr),
+            'stress_avg'                : col_avg(cls.stress_avg),
+            'steps'                     : col_sum(cls.steps),
+            'steps_goal'                : col_sum(cls.step_goal),
+            'floors'                    : col_sum(cls.floors_up),
+            'floors_goal'               : col_sum(cls.floors_goal),
+            'intensity_time'            : time_col_avg(cls, cls.intensity_time),
+            'moderate_activity_time'    : time_col_avg(cls, cls.moderate_activity_time),
+            'vigorous_activity_time'    : time_col_sum(cls, cls.vigorous_activity_time),
+            'intensity_time_goal'       : time_col_avg(cls, cls.intensity_time_goal),
+            'calories_goal'             : col_sum(cls.calories_goal),
+            'calories_avg'              : col_avg(cls.calories_total),
+            'calories_bmr_avg'          : col_avg(cls.calories_bmr),
+            'calories_active_avg'       : col_avg(cls.calories_active),
+            'calories_consumed_avg'     : col_avg(cls.calories_consumed),
+            'hydration_goal'            : col_sum(cls.hydration_goal),
+            'hydration_avg'             : col_avg(cls.hydration_intake),
+            'hydration_intake'          : col_sum(cls.hydration_intake),
+            'sweat_loss_avg'            : col_avg(cls.sweat_loss),
+            'sweat_loss'                : col_sum(cls.sweat_loss),
+            'spo2_avg'                  : col_avg(cls.spo2_avg),
+            'spo2_min'                  : col_min(cls.spo2_min),
+            'rr_waking_avg'             : col_avg(cls.rr_waking_avg),
+            'rr_max'                    : col_max(cls.rr_max),
+            'rr_min'                    : col_min(cls.rr_min),
+            'bb_max'                    : col_avg(cls.bb_max),
+            'bb_min'                    : col_avg(cls.bb_min),
+        }, start_ts, end_ts)
+        # intensity_time_goal is a weekly goal, so the daily value is 1/7 of the weekly goal
+        for stats in [stats_by_day.empty_stats] + list(stats_by_day.values()):
+            stats['intensity_time_goal'] = fitfile.conversions.secs_to_dt_time(int(fitfile.conversions.time_to_secs(stats['intensity_time_goal']) / 7))
+        return stats_by_day
+
     @classmethod
     def get_monthly_stats(cls, session, first_day_ts, last_day_ts):
         """Return a dictionary of aggregate statistics for the given month."""
@@ -474,3 +556,264 @@ class DailySummary(GarminDb.Base, idbutils.DbObject):
         )
         stats['first_day'] = first_day_ts
         return stats
+
+
+class ImportLedger(GarminDb.Base, idbutils.DbObject):
+    """Class representing a record of a data file that has been handled by an importer."""
+
+    __tablename__ = 'import_ledger'
+
+    db = GarminDb
+    table_version = 1
+    hash_block_size = 1024 * 1024
+    db_generation_key = 'import_ledger.generation'
+
+    class Outcome(enum.Enum):
+        """The result of importing a file."""
+
+        imported = 0
+        skipped = 1
+        failed = 2
+
+    path = Column(String)
+    importer = Column(String)
+    size = Column(BigInteger)
+    # nanoseconds since the epoch
+    mtime = Column(BigInteger)
+    hash = Column(String)
+    # identifies the instance of the database the file was imported into
+    db_generation = Column(String)
+    outcome = Column(Enum(Outcome))
+    timestamp = Column(DateTime)
+
+    __table_args__ = (PrimaryKeyConstraint('path', 'importer'),)
+
+    @classmethod
+    def s_get_from_dict(cls, session, values_dict):
+        """Return the ledger entry for the given path and importer."""
+        return session.get(cls, (values_dict['path'], values_dict['importer']))
+
+    @classmethod
+    def content_hash(cls, pathname):
+        """Return a hash of the contents of a file."""
+        sha = hashlib.sha256()
+        with open(pathname, 'rb') as file:
+            for block in iter(lambda: file.read(cls.hash_block_size), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    @classmethod
+    def get_db_generation(cls, db):
+        """Return an id that changes when the given database is deleted and recreated."""
+        db.attributes.set_if_unset(db, cls.db_generation_key, uuid.uuid4().hex)
+        return db.attributes.get_string(db, cls.db_generation_key)
+
+    @classmethod
+    def s_unchanged(cls, session, importer, pathname, db_generation, stat_func=os.stat, hash_func=None):
+        """Return True if the file was handled by the importer and hasn't changed since. Files that are not on disk are accessed with stat_func and hash_func."""
+        entry = session.get(cls, (os.path.abspath(pathname), importer))
+        if entry is None or entry.outcome is cls.Outcome.failed or entry.db_generation != db_generation:
+            return False
+        stat = stat_func(pathname)
+        if entry.size != stat.st_size:
+            return False
+        if entry.mtime == stat.st_mtime_ns:
+            return True
+        # The file was touched, only hash it if the cheap checks are not conclusive.
+        if entry.hash == (hash_func or cls.content_hash)(pathname):
+            entry.mtime = stat.st_mtime_ns
+            return True
+        return False
+
+    @classmethod
+    def entry(cls, importer, pathname, outcome, db_generation, stat_func=os.stat, hash_func=None):
+        """Return the ledger entry for the outcome of an importer handling a file. Files that are not on disk are accessed with stat_func and hash_func."""
+        stat = stat_func(pathname)
+        return {
+            'path'          : os.path.abspath(pathname),
+            'importer'      : importer,
+            'size'          : stat.st_size,
+            'mtime'         : stat.st_mtime_ns,
+            'hash'          : (hash_func or cls.content_hash)(pathname),
+            'db_generation' : db_generation,
+            'outcome'       : outcome,
+            'timestamp'     : datetime.datetime.now()
+        }
+
+    @classmethod
+    def s_record(cls, session, importer, pathname, outcome, db_generation, stat_func=os.stat, hash_func=None):
+        """Record the outcome of an importer handling a file. Files that are not on disk are accessed with stat_func and hash_func."""
+        cls.s_insert_or_update(session, cls.entry(importer, pathname, outcome, db_generation, stat_func, hash_func), ignore_none=False)
+
+
+class DownloadLedger(GarminDb.Base, idbutils.DbObject):
+    """Class representing a record of a day of a stat that has been downloaded from Garmin Connect."""
+
+    __tablename__ = 'download_ledger'
+
+    db = GarminDb
+    table_version = 1
+
+    stat = Column(String)
+    day = Column(Date)
+    # the file the day was saved to, if the day was saved to a single file
+    path = Column(String)
+    # days downloaded before they were over and synced may be missing data
+    complete = Column(Boolean)
+    hash = Column(String)
+    timestamp = Column(DateTime)
+
+    __table_args__ = (PrimaryKeyConstraint('stat', 'day'),)
+
+    @classmethod
+    def s_get_from_dict(cls, session, values_dict):
+        """Return the ledger entry for the given stat and day."""
+        return session.get(cls, (values_dict['stat'], values_dict['day']))
+
+    @classmethod
+    def payload_hash(cls, payload):
+        """Return a hash of downloaded data."""
+        return hashlib.sha256(payload).hexdigest()
+
+    @classmethod
+    def s_complete_days(cls, session, stat, start, end, exists_func=os.path.isfile):
+        """Return the days between start and end that have been completely downloaded and whose file is still present according to exists_func."""
+        query = session.query(cls.day, cls.path).filter(cls.stat == stat, cls.complete.is_(True), cls.day >= start, cls.day <= end)
+        return {day for (day, path) in query if path is None or exists_func(path)}
+
+    @classmethod
+    def s_record(cls, session, stat, day, path, payload_hash, complete):
+        """Record that a day of a stat was downloaded."""
+        entry = {
+            'stat'      : stat,
+            'day'       : day,
+            'path'      : path,
+            'complete'  : complete,
+            'hash'      : payload_hash,
+            'timestamp' : datetime.datetime.now()
+        }
+        cls.s_insert_or_update(session, entry, ignore_none=False)
+
+
+class SyncLedger(GarminDb.Base, idbutils.DbObject):
+    """Class representing a record of a row that has been synced to a remote table."""
+
+    __tablename__ = 'sync_ledger'
+
+    db = GarminDb
+    table_version = 1
+    high_water_key = 'sync_ledger.high_water.'
+
+    remote_table = Column(String)
+    # the primary key of the row in the remote table
+    key = Column(String)
+    # a hash of the row as it was uploaded
+    hash = Column(String)
+    timestamp = Column(DateTime)
+
+    __table_args__ = (PrimaryKeyConstraint('remote_table', 'key'),)
+
+    @classmethod
+    def s_get_from_dict(cls, session, values_dict):
+        """Return the ledger entry for the given remote table and key."""
+        return session.get(cls, (values_dict['remote_table'], values_dict['key']))
+
+    @classmethod
+    def s_hashes(cls, session, remote_table):
+        """Return a dict of the keys and hashes of the rows that have been synced to a remote table."""
+        return dict(session.query(cls.key, cls.hash).filter(cls.remote_table == remote_table))
+
+    @classmethod
+    def s_record(cls, session, remote_table, hashes):
+        """Record that rows, a dict of keys and hashes, have been synced to a remote table."""
+        timestamp = datetime.datetime.now()
+        bulk_upsert = BulkUpsert(session, cls, ignore_none=False)
+        for key, row_hash in hashes.items():
+            bulk_upsert.add({'remote_table': remote_table, 'key': key, 'hash': row_hash, 'timestamp': timestamp})
+        return bulk_upsert.flush()
+
+    @classmethod
+    def high_water(cls, db, remote_table):
+        """Return the high-water mark, the latest time of the rows that have been synced to a remote table, as a string."""
+        return Attributes.get_string(db, cls.high_water_key + remote_table)
+
+    @classmethod
+    def s_set_high_water(cls, session, remote_table, high_water):
+        """Set the high-water mark of a remote table."""
+        Attributes.s_insert_or_update(session, {'timestamp': datetime.datetime.now(), 'key': cls.high_water_key + remote_table, 'value': str(high_water)})
+
+
+class DirtyDays(GarminDb.Base, idbutils.DbObject):
+    """Class representing a day whose data changed since summaries were last calculated."""
+
+    __tablename__ = 'dirty_days'
+
+    db = GarminDb
+    table_version = 1
+    tracking_key = 'dirty_days.tracking'
+
+    # The tables that summaries are calculated from and the column that holds the day or time of their rows.
+    source_columns = {
+        'daily_summary'         : 'day',
+        'resting_hr'            : 'day',
+        'sleep'                 : 'day',
+        'weight'                : 'day',
+        'stress'                : 'timestamp',
+        'monitoring'            : 'timestamp',
+        'monitoring_hr'         : 'timestamp',
+        'monitoring_intensity'  : 'timestamp',
+        'monitoring_climb'      : 'timestamp',
+        'activities'            : 'start_time',
+    }
+
+    day = Column(Date, primary_key=True)
+
+    @classmethod
+    def days_written(cls, table_name, rows):
+        """Return the days of rows, dicts of column values, written to a table. Rows of tables that summaries are not calculated from have no days."""
+        col_name = cls.source_columns.get(table_name)
+        if col_name is None:
+            return set()
+        # ORM updates name the primary key parameter after the table
+        col_names = [col_name, f'{table_name}_{col_name}']
+        days = set()
+        for row in rows:
+            for name in col_names:
+                value = row.get(name)
+                if isinstance(value, datetime.datetime):
+                    days.add(value.date())
+                elif isinstance(value, datetime.date):
+                    days.add(value)
+        return days
+
+    @classmethod
+    def s_add(cls, session, days):
+        """Mark days as changed."""
+        bulk_upsert = BulkUpsert(session, cls)
+        for day in days:
+            bulk_upsert.add({'day': day})
+        return bulk_upsert.flush()
+
+    @classmethod
+    def get_days(cls, db):
+        """Return a sorted list of the days that changed since summaries were last calculated."""
+        with db.managed_session() as session:
+            return [day for (day,) in session.query(cls.day).order_by(cls.day)]
+
+    @classmethod
+    def s_clear(cls, session, days=None):
+        """Unmark days, or all days if days is None, once their summaries have been calculated."""
+        query = session.query(cls)
+        if days is not None:
+            query = query.filter(cls.day.in_(days))
+        query.delete(synchronize_session=False)
+
+    @classmethod
+    def tracking(cls, db):
+        """Return True if changed days have been tracked since summaries were last fully calculated."""
+        return Attributes.get_string(db, cls.tracking_key) == 'True'
+
+    @classmethod
+    def s_set_tracking(cls, session):
+        """Record that summaries were fully calculated, so that from now on only changed days need to be calculated."""
+        Attributes.s_insert_or_update(session, {'timestamp': datetime.datetime.now(), 'key': cls.tracking_key, 'value': 'True'})
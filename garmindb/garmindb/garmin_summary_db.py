@@ -6,11 +6,12 @@ __license__ = "GPL"
 
 import logging
 import datetime
-from sqlalchemy import Column, Integer, Date, DateTime
+from sqlalchemy import Column, Integer, Boolean, Date, DateTime, and_
 
 import idbutils
 
 from ..summarydb import SummaryBase
+from .stats_by_day import s_get_stats_by_day, col_avg, col_count, col_min, col_max
 
 
 logger = logging.getLogger(__name__)
@@ -99,6 +100,37 @@ class DaysSummary(GarminSummaryDb.Base, SummaryBase):
         cls.create_days_view(db)
 
 
+class DaysSummaryWeights(GarminSummaryDb.Base, idbutils.DbObject):
+    """A table holding the number of samples behind the averages of a DaysSummary row and which of its statistics came from the daily summary."""
+
+    __tablename__ = 'days_summary_weights'
+
+    db = GarminSummaryDb
+    table_version = 1
+
+    day = Column(Date, primary_key=True)
+    hr_samples = Column(Integer)
+    inactive_hr_samples = Column(Integer)
+    stress_samples = Column(Integer)
+    daily_summary_rhr = Column(Boolean)
+    daily_summary_stress = Column(Boolean)
+    daily_summary_floors = Column(Boolean)
+    daily_summary_steps = Column(Boolean)
+
+    samples_cols = ['hr_samples', 'inactive_hr_samples', 'stress_samples']
+
+    @classmethod
+    def from_daily_summary_stats(cls, day, daily_summary_stats):
+        """Return the weights of a day, with the statistics that the daily summary has for it marked."""
+        return {
+            'day'                   : day,
+            'daily_summary_rhr'     : daily_summary_stats.get('rhr_avg') is not None,
+            'daily_summary_stress'  : daily_summary_stats.get('stress_avg') is not None,
+            'daily_summary_floors'  : daily_summary_stats.get('floors') is not None,
+            'daily_summary_steps'   : daily_summary_stats.get('steps') is not None,
+        }
+
+
 class IntensityHR(GarminSummaryDb.Base, idbutils.DbObject):
     """Monitoring heart rate values that fall within a intensity period."""
 
@@ -119,3 +151,15 @@ class IntensityHR(GarminSummaryDb.Base, idbutils.DbObject):
             'inactive_hr_min' : cls.s_get_col_min_for_value(session, cls.heart_rate, cls.intensity, 0, start_ts, end_ts, True),
             'inactive_hr_max' : cls.s_get_col_max_for_value(session, cls.heart_rate, cls.intensity, 0, start_ts, end_ts, True),
         }
+
+    @classmethod
+    def s_get_stats_by_day(cls, session, start_ts, end_ts, samples=False):
+        """Return a dictionary of days and the aggregate statistics of each day in the given time period, with the sample count if samples is True."""
+        aggregates = {
+            'inactive_hr_avg' : col_avg(cls.heart_rate),
+            'inactive_hr_min' : col_min(cls.heart_rate),
+            'inactive_hr_max' : col_max(cls.heart_rate),
+        }
+        if samples:
+            aggregates['inactive_hr_samples'] = col_count(cls.heart_rate)
+        return s_get_stats_by_day(session, cls, aggregates, start_ts, end_ts, and_(cls.intensity == 0, cls.heart_rate > 0))
@@ -13,6 +13,8 @@ from sqlalchemy.ext.hybrid import hybrid_property
 import fitfile
 import idbutils
 
+from .stats_by_day import s_get_stats_by_day, col_avg, col_count, col_min, col_max, time_col_sum
+
 
 logger = logging.getLogger(__name__)
 
@@ -77,6 +79,18 @@ class MonitoringHeartRate(MonitoringDb.Base, idbutils.DbObject):
             'hr_max' : cls.s_get_col_max(session, cls.heart_rate, start_ts, end_ts),
         }
 
+    @classmethod
+    def s_get_stats_by_day(cls, session, start_ts, end_ts, samples=False):
+        """Return a dict of days and the stats of each day within the time span, with the sample count if samples is True."""
+        aggregates = {
+            'hr_avg' : col_avg(cls.heart_rate, True),
+            'hr_min' : col_min(cls.heart_rate, True),
+            'hr_max' : col_max(cls.heart_rate),
+        }
+        if samples:
+            aggregates['hr_samples'] = col_count(cls.heart_rate, True)
+        return s_get_stats_by_day(session, cls, aggregates, start_ts, end_ts)
+
     @classmethod
     def get_resting_heartrate(cls, db, wake_ts):
         """Return a resting heart rate value for the day specified."""
@@ -118,6 +132,15 @@ class MonitoringIntensity(MonitoringDb.Base, idbutils.DbObject):
             'vigorous_activity_time'    : cls.s_get_time_col_sum(session, cls.vigorous_activity_time, start_ts, end_ts),
         }
 
+    @classmethod
+    def s_get_stats_by_day(cls, session, start_ts, end_ts):
+        """Return a dict of days and the stats of each day within the time span."""
+        return s_get_stats_by_day(session, cls, {
+            'intensity_time'            : time_col_sum(cls, cls.intensity_time),
+            'moderate_activity_time'    : time_col_sum(cls, cls.moderate_activity_time),
+            'vigorous_activity_time'    : time_col_sum(cls, cls.vigorous_activity_time),
+        }, start_ts, end_ts)
+
 
 class MonitoringClimb(MonitoringDb.Base, idbutils.DbObject):
     """Class representing monitoring data about elvation gained."""
@@ -161,6 +184,22 @@ class MonitoringClimb(MonitoringDb.Base, idbutils.DbObject):
         stats['day'] = day_ts
         return stats
 
+    @classmethod
+    def s_get_stats_by_day(cls, session, start_ts, end_ts, measurement_system):
+        """Return a dict of days and the stats of each day within the time span."""
+        stats_by_day = s_get_stats_by_day(session, cls, {'cum_ascent' : col_max(cls.cum_ascent)}, start_ts, end_ts)
+        # the same conversion to floors as get_stats
+        for stats in [stats_by_day.empty_stats] + list(stats_by_day.values()):
+            cum_ascent = stats.pop('cum_ascent')
+            if cum_ascent:
+                if measurement_system is fitfile.field_enums.DisplayMeasure.metric:
+                    stats['floors'] = cum_ascent / cls.feet_to_floors
+                else:
+                    stats['floors'] = cum_ascent / cls.meters_to_floors
+            else:
+                stats['floors'] = 0
+        return stats_by_day
+
     @classmethod
     def get_weekly_stats(cls, session, first_day_ts, measurement_system):
         """Return a dict of stats for table entries for the week day."""
@@ -235,6 +274,20 @@ class Monitoring(MonitoringDb.Base, idbutils.DbObject):
         stats['day'] = day_ts
         return stats
 
+    @classmethod
+    def s_get_stats_by_day(cls, session, start_ts, end_ts):
+        """Return a dict of days and the stats of each day within the time span."""
+        stats_by_day = s_get_stats_by_day(session, cls, {
+            'steps'                 : col_max(cls.steps),
+            'active_calories_max'   : col_max(cls.active_calories),
+        }, start_ts, end_ts)
+        # For one day get_active_calories returns the day's maximum active calories for each of the running, cycling, and walking activity
+        # types because the activity type does not limit the per day maximums it averages.
+        for stats in [stats_by_day.empty_stats] + list(stats_by_day.values()):
+            active_calories_max = stats.pop('active_calories_max')
+            stats['calories_active_avg'] = 3 * (active_calories_max if active_calories_max is not None else 0)
+        return stats_by_day
+
     @classmethod
     def get_weekly_stats(cls, session, first_day_ts):
         """Return a dict of stats for table entries for the given week."""
@@ -0,0 +1,128 @@
+"""Functions for calculating the aggregate statistics of every day of a time period with one query per table."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import datetime
+
+from sqlalchemy import Date, func, case, literal_column
+
+
+logger = logging.getLogger(__name__)
+
+
+class StatsByDay(dict):
+    """A dict of days and their aggregate statistics. Days without rows have the statistics of an empty time period."""
+
+    def __init__(self, empty_stats):
+        """Return a new StatsByDay instance where days without rows have empty_stats."""
+        super().__init__()
+        self.empty_stats = empty_stats
+
+    def __missing__(self, day):
+        """Return the statistics of a day without rows."""
+        return dict(self.empty_stats)
+
+
+def _value(value):
+    return value
+
+
+def _count(value):
+    return value if value is not None else 0
+
+
+def _time(value):
+    # Matches DbObject._s_get_time_col_func: sqlite returns a string, other databases a time or a timedelta.
+    if value is None:
+        return datetime.time.min
+    if isinstance(value, datetime.time):
+        return value
+    if isinstance(value, datetime.timedelta):
+        total = int(value.total_seconds()) % 86400
+        return datetime.time(total // 3600, (total % 3600) // 60, total % 60)
+    return datetime.datetime.strptime(value, '%H:%M:%S').time()
+
+
+def _positive(col):
+    return case((col > 0, col))
+
+
+def col_avg(col, ignore_le_zero=False):
+    """Return the aggregate for the average of a column, like DbObject.s_get_col_avg."""
+    return (func.avg(_positive(col) if ignore_le_zero else col), _value)
+
+
+def col_min(col, ignore_le_zero=False):
+    """Return the aggregate for the minimum of a column, like DbObject.s_get_col_min."""
+    return (func.min(_positive(col) if ignore_le_zero else col), _value)
+
+
+def col_max(col, ignore_le_zero=False):
+    """Return the aggregate for the maximum of a column, like DbObject.s_get_col_max."""
+    return (func.max(_positive(col) if ignore_le_zero else col), _value)
+
+
+def col_sum(col):
+    """Return the aggregate for the sum of a column, like DbObject.s_get_col_sum."""
+    return (func.sum(col), _value)
+
+
+def col_count(col, ignore_le_zero=False):
+    """Return the aggregate for the number of values of a column that averages are calculated from."""
+    return (func.count(_positive(col) if ignore_le_zero else col), _count)
+
+
+def row_count():
+    """Return the aggregate for the number of rows, like DbObject.s_row_count_for_period."""
+    return (func.count(literal_column('*')), _count)
+
+
+def _time_col_func(table_class, col, stat_func):
+    secs = table_class._secs_from_time(col)
+    return (table_class._time_from_secs(stat_func(_positive(secs))), _time)
+
+
+def time_col_avg(table_class, col):
+    """Return the aggregate for the average of a time column, like DbObject.s_get_time_col_avg."""
+    return _time_col_func(table_class, col, func.avg)
+
+
+def time_col_min(table_class, col):
+    """Return the aggregate for the minimum of a time column, like DbObject.s_get_time_col_min."""
+    return _time_col_func(table_class, col, func.min)
+
+
+def time_col_max(table_class, col):
+    """Return the aggregate for the maximum of a time column, like DbObject.s_get_time_col_max."""
+    return _time_col_func(table_class, col, func.max)
+
+
+def time_col_sum(table_class, col):
+    """Return the aggregate for the sum of a time column, like DbObject.s_get_time_col_sum."""
+    return _time_col_func(table_class, col, func.sum)
+
+
+def s_get_stats_by_day(session, table_class, aggregates, start_ts, end_ts, where=None):
+    """
+    Return a StatsByDay of the aggregate statistics of each day from start_ts up to end_ts, calculated with one GROUP BY day query.
+
+    Parameters:
+    session (Session): the session to query with
+    table_class (DbObject): the table to query, its time column determines the day of a row
+    aggregates (dict): statistic names and the aggregates, from functions like col_avg, that calculate them
+    start_ts (date): the first day
+    end_ts (date): the day after the last day
+    where (ColumnElement): if set, only rows that match are aggregated
+    """
+    day = func.date(table_class.time_col, type_=Date)
+    query = session.query(day, *[expression for (expression, _) in aggregates.values()]).filter(table_class.during(start_ts, end_ts))
+    if where is not None:
+        query = query.filter(where)
+    stats_by_day = StatsByDay({name: convert(None) for name, (_, convert) in aggregates.items()})
+    for row in query.group_by(day):
+        stats_by_day[row[0]] = {name: convert(value) for (name, (_, convert)), value in zip(aggregates.items(), row[1:])}
+    logger.debug("Calculated %d days of stats for %s", len(stats_by_day), table_class.__tablename__)
+    return stats_by_day
@@ -11,10 +11,11 @@ import datetime
 import enum
 
 import fitfile
-from idbutils import JsonFileProcessor, Conversions
+from idbutils import Conversions
 
 from .garmindb import GarminDb, Attributes, Weight, Sleep, SleepEvents, RestingHeartRate, DailySummary
 from .fit_data import FitData
+from .garmin_json_file_processor import GarminJsonFileProcessor
 
 
 logger = logging.getLogger(__file__)
@@ -22,7 +23,7 @@ logger.addHandler(logging.StreamHandler(stream=sys.stdout))
 root_logger = logging.getLogger()
 
 
-class GarminWeightData(JsonFileProcessor):
+class GarminWeightData(GarminJsonFileProcessor):
     """Class for importing JSON formatted Garmin Connect weight data into a database."""
 
     def __init__(self, db_params, input_dir, latest, measurement_system, debug):
@@ -39,7 +40,7 @@ class GarminWeightData(JsonFileProcessor):
 
         """
         logger.info("Processing weight data")
-        super().__init__(r'weight_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug)
+        super().__init__(db_params, r'weight_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug)
         self.measurement_system = measurement_system
         self.garmin_db = GarminDb(db_params)
         self.conversions = {'startDate': self._parse_date}
@@ -52,7 +53,7 @@ class GarminWeightData(JsonFileProcessor):
                 'day': json_data['startDate'].date(),
                 'weight': weight.kgs_or_lbs(self.measurement_system)
             }
-            Weight.insert_or_update(self.garmin_db, point)
+            Weight.s_insert_or_update(self.garmin_db_session, point, ignore_none=False)
             return 1
         return 0
 
@@ -60,7 +61,7 @@ class GarminWeightData(JsonFileProcessor):
 class GarminMonitoringFitData(FitData):
     """Class for importing monitoring FIT files into a database."""
 
-    def __init__(self, input_dir, latest, measurement_system, debug):
+    def __init__(self, input_dir, latest, measurement_system, debug, workers=1, chunk_size=None):
         """
         Return an instance of GarminMonitoringFitData.
 
@@ -70,15 +71,17 @@ class GarminMonitoringFitData(FitData):
         latest (Boolean): check for latest files only
         measurement_system (enum): which measurement system to use when importing the files
         debug (Boolean): enable debug logging
+        workers (int): number of processes used to decode FIT files
+        chunk_size (int): if set, stream each file to the database in chunks of this many messages
 
         """
-        super().__init__(input_dir, debug, latest, True, [fitfile.FileType.monitoring_b], measurement_system)
+        super().__init__(input_dir, debug, latest, True, [fitfile.FileType.monitoring_b], measurement_system, workers, chunk_size)
 
 
 class GarminSleepFitData(FitData):
     """Class for importing sleep FIT files into a database."""
 
-    def __init__(self, input_dir, latest, measurement_system, debug):
+    def __init__(self, input_dir, latest, measurement_system, debug, workers=1, chunk_size=None):
         """
         Return an instance of GarminSleepFitData.
 
@@ -88,9 +91,11 @@ class GarminSleepFitData(FitData):
         latest (Boolean): check for latest files only
         measurement_system (enum): which measurement system to use when importing the files
         debug (Boolean): enable debug logging
+        workers (int): number of processes used to decode FIT files
+        chunk_size (int): if set, stream each file to the database in chunks of this many messages
 
         """
-        super().__init__(input_dir, debug, latest, True, [fitfile.FileType.sleep], measurement_system)
+        super().__init__(input_dir, debug, latest, True, [fitfile.FileType.sleep], measurement_system, workers, chunk_size)
 
 
 class GarminSettingsFitData(FitData):
@@ -128,7 +133,7 @@ class RemSleepActivityLevels(enum.Enum):
     awake = 3.0
 
 
-class GarminSleepData(JsonFileProcessor):
+class GarminSleepData(GarminJsonFileProcessor):
     """Class for importing JSON formatted Garmin Connect sleep data into a database."""
 
     def __init__(self, db_params, input_dir, latest, debug):
@@ -144,7 +149,7 @@ class GarminSleepData(JsonFileProcessor):
 
         """
         logger.info("Processing sleep data")
-        super().__init__(r'sleep_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug)
+        super().__init__(db_params, r'sleep_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug)
         self.garmin_db = GarminDb(db_params)
         self.conversions = {
             'calendarDate': self._parse_date,
@@ -207,7 +212,7 @@ class GarminSleepData(JsonFileProcessor):
             'score': score,
             'qualifier': qualifier
         }
-        Sleep.insert_or_update(self.garmin_db, day_data, ignore_none=True)
+        Sleep.s_insert_or_update(self.garmin_db_session, day_data, ignore_none=True)
         sleep_levels = json_data.get('sleepLevels')
         if sleep_levels is None:
             return 0
@@ -223,11 +228,11 @@ class GarminSleepData(JsonFileProcessor):
                 'event': event.name,
                 'duration': duration
             }
-            SleepEvents.insert_or_update(self.garmin_db, level_data, ignore_none=True)
+            SleepEvents.s_insert_or_update(self.garmin_db_session, level_data, ignore_none=True)
         return len(sleep_levels)
 
 
-class GarminRhrData(JsonFileProcessor):
+class GarminRhrData(GarminJsonFileProcessor):
     """Class for importing JSON formatted Garmin Connect resting heart rate data into a database."""
 
     def __init__(self, db_params, input_dir, latest, debug):
@@ -243,7 +248,7 @@ class GarminRhrData(JsonFileProcessor):
 
         """
         logger.info("Processing rhr data")
-        super().__init__(r'rhr_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug)
+        super().__init__(db_params, r'rhr_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug)
         self.garmin_db = GarminDb(db_params)
         self.conversions = {'statisticsStartDate': self._parse_date}
 
@@ -256,13 +261,12 @@ class GarminRhrData(JsonFileProcessor):
                     'day': json_data['statisticsStartDate'].date(),
                     'resting_heart_rate': rhr
                 }
-                RestingHeartRate.insert_or_update(
-                    self.garmin_db, point, ignore_none=True)
+                RestingHeartRate.s_insert_or_update(self.garmin_db_session, point, ignore_none=True)
                 return 1
         return 0
 
 
-class GarminProfile(JsonFileProcessor):
+class GarminProfile(GarminJsonFileProcessor):
     """Class for importing JSON formatted Garmin Connect profile data into a database."""
 
     def __init__(self, db_params, file_regex, input_dir, debug):
@@ -278,7 +282,7 @@ class GarminProfile(JsonFileProcessor):
 
         """
         logger.info("Processing profile data")
-        super().__init__(file_regex, input_dir=input_dir, latest=False, debug=debug)
+        super().__init__(db_params, file_regex, input_dir=input_dir, latest=False, debug=debug)
         self.garmin_db = GarminDb(db_params)
         self.conversions = {'calendarDate': self._parse_date}
 
@@ -286,7 +290,7 @@ class GarminProfile(JsonFileProcessor):
         attributes = self._process_attributes(json_data)
         logger.info("Processing profile data: %r", attributes)
         for attribute_name, attribute_value in attributes.items():
-            Attributes.set_newer(self.garmin_db, attribute_name, attribute_value)
+            Attributes.s_set_newer(self.garmin_db_session, attribute_name, attribute_value)
         return len(attributes)
 
 
@@ -375,7 +379,7 @@ class GarminSocialProfile(GarminProfile):
         }
 
 
-class GarminSummaryData(JsonFileProcessor):
+class GarminSummaryData(GarminJsonFileProcessor):
     """Class for importing JSON formatted Garmin Connect daily summary data into a database."""
 
     def __init__(self, db_params, input_dir, latest, measurement_system, debug):
@@ -392,7 +396,7 @@ class GarminSummaryData(JsonFileProcessor):
 
         """
         logger.info("Processing daily summary data")
-        super().__init__(r'daily_summary_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug, recursive=True)
+        super().__init__(db_params, r'daily_summary_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug, recursive=True)
         self.input_dir = input_dir
         self.measurement_system = measurement_system
         self.garmin_db = GarminDb(db_params)
@@ -437,12 +441,11 @@ class GarminSummaryData(JsonFileProcessor):
             'bb_min': self._get_field(json_data, 'bodyBatteryLowestValue', int),
             'description': self._get_field(json_data, 'wellnessDescription'),
         }
-        DailySummary.insert_or_update(
-            self.garmin_db, summary, ignore_none=True)
+        DailySummary.s_insert_or_update(self.garmin_db_session, summary, ignore_none=True)
         return 1
 
 
-class GarminHydrationData(JsonFileProcessor):
+class GarminHydrationData(GarminJsonFileProcessor):
     """Class for importing JSON formatted Garmin Connect daily summary data into a database."""
 
     def __init__(self, db_params, input_dir, latest, measurement_system, debug):
@@ -459,7 +462,7 @@ class GarminHydrationData(JsonFileProcessor):
 
         """
         logger.debug("Processing daily hydration data")
-        super().__init__(r'hydration_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug, recursive=True)
+        super().__init__(db_params, r'hydration_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug, recursive=True)
         self.input_dir = input_dir
         self.measurement_system = measurement_system
         self.garmin_db = GarminDb(db_params)
@@ -478,6 +481,5 @@ class GarminHydrationData(JsonFileProcessor):
             'sweat_loss': sweat_loss.ml_or_oz(self.measurement_system, rounded=True)
         }
         root_logger.debug("Processing daily hydration data %r", summary)
-        DailySummary.insert_or_update(
-            self.garmin_db, summary, ignore_none=True)
+        DailySummary.s_insert_or_update(self.garmin_db_session, summary, ignore_none=True)
         return 1
@@ -0,0 +1,176 @@
+"""Class that imports files while they are being downloaded."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import re
+import sys
+import logging
+import threading
+import queue
+import functools
+import traceback
+import contextlib
+import collections
+
+import fitfile
+
+from .import_monitoring import GarminMonitoringFitData, GarminSleepFitData, GarminSummaryData, GarminHydrationData, GarminSleepData, GarminWeightData, GarminRhrData
+from .activities_fit_data import GarminActivitiesFitData
+from .garmin_json_data import GarminJsonSummaryData, GarminJsonDetailsData
+from .monitoring_fit_file_processor import MonitoringFitFileProcessor
+from .sleep_fit_file_processor import SleepFitFileProcessor
+from .activity_fit_file_processor import ActivityFitFileProcessor
+from .fit_import import FitImport
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+def _import_fit_files(fit_data_factory, fit_file_processor_factory, file_names):
+    fit_data = fit_data_factory()
+    fit_data.file_names = file_names
+    fit_data.process_files(fit_file_processor_factory())
+
+
+def _import_json_files(json_file_processor_factory, commit_files, commit_rows, file_names):
+    json_file_processor = json_file_processor_factory()
+    json_file_processor.file_names = file_names
+    json_file_processor.process(commit_files, commit_rows)
+
+
+class ImportRoute():
+    """A kind of downloaded file and the function that imports a batch of them."""
+
+    def __init__(self, stat, file_regex, import_files):
+        """
+        Return a new ImportRoute instance.
+
+        Parameters:
+        stat (string): the stat the files are downloaded for, i.e. sleep or monitoring
+        file_regex (string): the regex the names of the files have to match
+        import_files (callable): called with a list of file names to import them
+        """
+        self.stat = stat
+        self.file_regex = re.compile(file_regex)
+        self.import_files = import_files
+
+    def matches(self, stat, file_name):
+        """Return True if the route imports file_name downloaded for stat."""
+        return stat == self.stat and self.file_regex.match(os.path.basename(file_name)) is not None
+
+
+class ImportPipeline():
+    """Imports files on a background thread as Download saves them so that downloading and importing overlap."""
+
+    def __init__(self, routes, queue_size=100, batch_size=25, idle_seconds=1.0):
+        """
+        Return a new ImportPipeline instance.
+
+        Parameters:
+        routes (list): the ImportRoutes for the downloaded files, batches are imported in this order
+        queue_size (int): the number of downloads that can wait to be imported before downloading blocks
+        batch_size (int): import the waiting files when a route has this many files
+        idle_seconds (float): import the waiting files when no files have been downloaded for this long
+        """
+        self.routes = routes
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.idle_seconds = idle_seconds
+        self.batches = [[] for route in routes]
+        self.affected_days = set()
+        self.imported = collections.Counter()
+        self.failed = collections.Counter()
+
+    @classmethod
+    def default_routes(cls, gc_config, plugin_manager, debug=0):
+        """Return routes that import every stat downloaded by Download the same way a full import does."""
+        fit_import = FitImport(gc_config, plugin_manager, debug)
+        db_params = fit_import.db_params
+        measurement_system = fit_import.measurement_system
+        commit_files = gc_config.import_commit_files()
+        commit_rows = gc_config.import_commit_rows()
+
+        def fit_route(stat, fit_data_class, fit_file_processor_class):
+            fit_data_factory = functools.partial(fit_import.fit_data, fit_data_class, None)
+            fit_file_processor_factory = functools.partial(fit_import.fit_file_processor, fit_file_processor_class)
+            return ImportRoute(stat, fitfile.file.name_regex, functools.partial(_import_fit_files, fit_data_factory, fit_file_processor_factory))
+
+        def json_route(stat, file_regex, json_file_processor_factory):
+            return ImportRoute(stat, file_regex, functools.partial(_import_json_files, json_file_processor_factory, commit_files, commit_rows))
+
+        return [
+            fit_route('monitoring', GarminMonitoringFitData, MonitoringFitFileProcessor),
+            fit_route('monitoring', GarminSleepFitData, SleepFitFileProcessor),
+            json_route('daily_summary', r'daily_summary_\d{4}-\d{2}-\d{2}\.json', functools.partial(GarminSummaryData, db_params, None, False, measurement_system, debug)),
+            json_route('hydration', r'hydration_\d{4}-\d{2}-\d{2}\.json', functools.partial(GarminHydrationData, db_params, None, False, measurement_system, debug)),
+            json_route('sleep', r'sleep_\d{4}-\d{2}-\d{2}\.json', functools.partial(GarminSleepData, db_params, None, False, debug)),
+            json_route('weight', r'weight_\d{4}-\d{2}-\d{2}\.json', functools.partial(GarminWeightData, db_params, None, False, measurement_system, debug)),
+            json_route('rhr', r'rhr_\d{4}-\d{2}-\d{2}\.json', functools.partial(GarminRhrData, db_params, None, False, debug)),
+            # The activity FIT files are imported before the Garmin Connect JSON data for the activities, as in a full import.
+            fit_route('activities', GarminActivitiesFitData, ActivityFitFileProcessor),
+            json_route('activities', r'activity_\d*\.json', functools.partial(GarminJsonSummaryData, db_params, None, False, measurement_system, debug)),
+            json_route('activities', r'activity_details_\d*\.json', functools.partial(GarminJsonDetailsData, db_params, None, False, measurement_system, debug)),
+        ]
+
+    def files_saved(self, stat, day, file_names):
+        """Queue a group of downloaded files for import, blocking while the queue is full. Can be called from any thread."""
+        self.queue.put((stat, day, file_names))
+
+    def __import_batches(self):
+        for route, batch in zip(self.routes, self.batches):
+            if batch:
+                file_names = list(dict.fromkeys(batch))
+                batch.clear()
+                root_logger.info("Importing %d downloaded %s files", len(file_names), route.stat)
+                try:
+                    route.import_files(file_names)
+                    self.imported[route.stat] += len(file_names)
+                except Exception:
+                    root_logger.error("Failed to import %d downloaded %s files: %s", len(file_names), route.stat, traceback.format_exc())
+                    self.failed[route.stat] += len(file_names)
+
+    def __route(self, stat, day, file_names):
+        routed = False
+        for file_name in file_names:
+            for route, batch in zip(self.routes, self.batches):
+                if route.matches(stat, file_name):
+                    batch.append(file_name)
+                    routed = True
+        if routed and day is not None:
+            self.affected_days.add(day)
+        # Files downloaded together are queued together, so a batch never holds part of a group, i.e. an activity's FIT file without its JSON.
+        if any(len(batch) >= self.batch_size for batch in self.batches):
+            self.__import_batches()
+
+    def __run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.idle_seconds)
+            except queue.Empty:
+                self.__import_batches()
+                continue
+            if item is None:
+                break
+            self.__route(*item)
+        self.__import_batches()
+
+    @contextlib.contextmanager
+    def run(self, download=None):
+        """Import the files saved by download, or passed to files_saved, while the block runs and wait for all of them to be imported when it exits."""
+        thread = threading.Thread(target=self.__run, name='ImportPipeline')
+        if download:
+            download.add_file_listener(self.files_saved)
+        thread.start()
+        try:
+            yield self
+        finally:
+            if download:
+                download.remove_file_listener(self.files_saved)
+            self.queue.put(None)
+            thread.join()
+            root_logger.info("Imported downloaded files %r, failed %r, affecting %d days", dict(self.imported), dict(self.failed), len(self.affected_days))
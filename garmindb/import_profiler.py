@@ -0,0 +1,159 @@
+"""Class that profiles the stages of an import and writes a machine readable report."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import sys
+import os
+import csv
+import json
+import time
+import logging
+import contextlib
+import collections
+
+from sqlalchemy import event
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+class ImportProfile():
+    """Timings, SQL statement counts, and rows written for one imported file."""
+
+    def __init__(self, file_name):
+        """Return a new ImportProfile instance for file_name."""
+        self.file_name = file_name
+        self.seconds = 0.0
+        self.stages = collections.Counter()
+        self.message_types = collections.Counter()
+        self.statements = 0
+        self.rows = collections.Counter()
+
+    def to_dict(self):
+        """Return the profile as a dict."""
+        return {
+            'file'          : self.file_name,
+            'seconds'       : self.seconds,
+            'stages'        : dict(self.stages),
+            'message_types' : dict(self.message_types),
+            'statements'    : self.statements,
+            'rows'          : dict(self.rows),
+        }
+
+
+class ImportProfiler():
+    """Profiles the stages of an import per file and per message type and writes a JSON or CSV report."""
+
+    def __init__(self, slowest=10):
+        """
+        Return a new ImportProfiler instance.
+
+        Parameters:
+        slowest (int): the number of slowest files to list in the report
+        """
+        self.slowest = slowest
+        self.profiles = []
+        # Work done outside of a file, like committing a batch of files.
+        self.run_profile = ImportProfile(None)
+        self.current = self.run_profile
+        self.engines = []
+
+    def __before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._import_profiler_start = time.perf_counter()
+
+    def __after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.current.stages['sql'] += time.perf_counter() - getattr(context, '_import_profiler_start', time.perf_counter())
+        self.current.statements += 1
+        if (context.isinsert or context.isupdate or context.isdelete) and cursor.rowcount > 0:
+            table = getattr(getattr(context.compiled, 'statement', None), 'table', None)
+            self.current.rows[table.name if table is not None else 'unknown'] += cursor.rowcount
+
+    def attach(self, engine):
+        """Count and time the SQL statements executed on engine."""
+        if engine not in self.engines:
+            event.listen(engine, 'before_cursor_execute', self.__before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self.__after_cursor_execute)
+            self.engines.append(engine)
+
+    def detach(self):
+        """Stop counting SQL statements on all attached engines."""
+        for engine in self.engines:
+            event.remove(engine, 'before_cursor_execute', self.__before_cursor_execute)
+            event.remove(engine, 'after_cursor_execute', self.__after_cursor_execute)
+        self.engines = []
+
+    @contextlib.contextmanager
+    def file(self, file_name):
+        """Profile everything in the block as work done for file_name."""
+        profile = ImportProfile(file_name)
+        self.profiles.append(profile)
+        self.current = profile
+        start = time.perf_counter()
+        try:
+            yield profile
+        finally:
+            profile.seconds = time.perf_counter() - start
+            self.current = self.run_profile
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the block as the stage name of the current file."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.current.stages[name] += time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def message_type(self, name):
+        """Time the block as writing the messages of type name for the current file."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.current.message_types[name] += time.perf_counter() - start
+
+    def report(self):
+        """Return the profile of the import as a dict."""
+        totals = ImportProfile(None)
+        for profile in self.profiles + [self.run_profile]:
+            totals.seconds += profile.seconds
+            totals.stages.update(profile.stages)
+            totals.message_types.update(profile.message_types)
+            totals.statements += profile.statements
+            totals.rows.update(profile.rows)
+        slowest = sorted(self.profiles, key=lambda profile: profile.seconds, reverse=True)[:self.slowest]
+        return {
+            'files'         : len(self.profiles),
+            'totals'        : dict(totals.to_dict(), file=None),
+            'run'           : self.run_profile.to_dict(),
+            'slowest_files' : [profile.to_dict() for profile in slowest],
+            'per_file'      : [profile.to_dict() for profile in self.profiles],
+        }
+
+    def write_report(self, filename):
+        """Write the report to filename, as CSV with a row per file if the name ends in .csv and JSON otherwise."""
+        root_logger.info("Writing import profile report to %s", filename)
+        if os.path.splitext(filename)[1].lower() == '.csv':
+            stages = sorted({stage for profile in self.profiles for stage in profile.stages})
+            message_types = sorted({message_type for profile in self.profiles for message_type in profile.message_types})
+            with open(filename, 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(['file', 'seconds', 'statements', 'rows'] + stages + [f'message.{message_type}' for message_type in message_types])
+                for profile in self.profiles:
+                    row = [profile.file_name, profile.seconds, profile.statements, sum(profile.rows.values())]
+                    row += [profile.stages.get(stage, 0.0) for stage in stages]
+                    row += [profile.message_types.get(message_type, 0.0) for message_type in message_types]
+                    writer.writerow(row)
+        else:
+            with open(filename, 'w') as file:
+                json.dump(self.report(), file, indent=4)
+
+    def log_slowest(self):
+        """Log the slowest files of the import."""
+        for profile in sorted(self.profiles, key=lambda profile: profile.seconds, reverse=True)[:self.slowest]:
+            logger.info("%.3fs %d statements %d rows: %s", profile.seconds, profile.statements, sum(profile.rows.values()), profile.file_name)
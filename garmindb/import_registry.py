@@ -0,0 +1,101 @@
+"""Class that caches the devices and files in the Garmin database during an import."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import logging
+import sys
+
+from sqlalchemy import Enum, String, type_coerce
+
+from .garmindb import File, Device
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+class ImportRegistry():
+    """Caches the device and file rows of the Garmin database so that an import can look them up and skip unchanged writes without queries."""
+
+    __device_cols = ['serial_number', 'timestamp', 'device_type', 'manufacturer', 'product', 'hardware_version']
+    __file_cols = ['id', 'name', 'type', 'serial_number']
+
+    def __init__(self, session):
+        """Return a new ImportRegistry instance loaded with the devices and files visible to session."""
+        self.devices = {self.__device_key(device['serial_number']): device for device in self.__s_load(session, Device, self.__device_cols)}
+        self.files = {}
+        self.file_ids = {}
+        for file in self.__s_load(session, File, self.__file_cols):
+            self.files[file['id']] = file
+            self.file_ids[file['name']] = file['id']
+        self.undo_log = []
+        root_logger.debug("Loaded registry with %d devices and %d files", len(self.devices), len(self.files))
+
+    @classmethod
+    def __s_load(cls, session, table, col_names):
+        # Read enums as strings so that a row with an unknown value is cached as unknown instead of failing the import.
+        cols = [getattr(table, col_name) for col_name in col_names]
+        for row in session.query(*[type_coerce(col, String) if isinstance(col.type, Enum) else col for col in cols]):
+            values = {}
+            for col, value in zip(cols, row):
+                if isinstance(col.type, Enum) and value is not None:
+                    value = col.type.enum_class.__members__.get(value)
+                values[col.key] = value
+            yield values
+
+    @classmethod
+    def __device_key(cls, serial_number):
+        # Synthetic serial numbers for local sub devices are strings of digits, but stored as integers.
+        return int(serial_number) if isinstance(serial_number, str) and serial_number.isdigit() else serial_number
+
+    def __set(self, table, key, value):
+        self.undo_log.append((table, key, table.get(key)))
+        table[key] = value
+
+    def begin_file(self):
+        """Start tracking the changes made while writing a file."""
+        self.undo_log = []
+
+    def rollback_file(self):
+        """Undo the changes made while writing a file that was rolled back."""
+        for table, key, value in reversed(self.undo_log):
+            if value is None:
+                table.pop(key, None)
+            else:
+                table[key] = value
+        self.undo_log = []
+
+    def file_id(self, pathname):
+        """Return the id of a file given it's pathname."""
+        return self.file_ids.get(os.path.basename(pathname))
+
+    @classmethod
+    def __changes(cls, row, values_dict, ignore_none):
+        if ignore_none:
+            values_dict = {key: value for key, value in values_dict.items() if value is not None}
+        if row is not None and all(row.get(key) == value for key, value in values_dict.items()):
+            return None
+        return values_dict
+
+    def s_insert_or_update_device(self, session, values_dict, ignore_none=True):
+        """Insert or update a device row unless it already holds the values."""
+        key = self.__device_key(values_dict['serial_number'])
+        row = self.devices.get(key)
+        changes = self.__changes(row, values_dict, ignore_none)
+        if changes is not None:
+            Device.s_insert_or_update(session, values_dict, ignore_none=ignore_none)
+            self.__set(self.devices, key, dict(row or {}, **changes))
+
+    def s_insert_or_update_file(self, session, values_dict, ignore_none=True):
+        """Insert or update a file row unless it already holds the values."""
+        row = self.files.get(values_dict['id'])
+        changes = self.__changes(row, values_dict, ignore_none)
+        if changes is not None:
+            File.s_insert_or_update(session, values_dict, ignore_none=ignore_none)
+            row = dict(row or {}, **changes)
+            self.__set(self.files, values_dict['id'], row)
+            self.__set(self.file_ids, row['name'], row['id'])
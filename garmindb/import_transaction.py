@@ -0,0 +1,142 @@
+"""Class that shares database sessions across the files of an import and commits them in batches."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import sys
+import contextlib
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from .garmindb import GarminDb, DirtyDays
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+class ImportTransaction():
+    """
+    Shares database sessions across the files of an import, commits them in batches, and isolates failing files with savepoints.
+
+    The days of the rows written are marked in DirtyDays along with the data so that only those days need to be summarized again.
+    """
+
+    def __init__(self, commit_files=1, commit_rows=None, profiler=None):
+        """
+        Return a new ImportTransaction instance.
+
+        Parameters:
+        commit_files (int): commit after this many files have been written
+        commit_rows (int): commit after this many rows have been written, None to only commit by file count
+        profiler (ImportProfiler): if set, SQL statements and commits are profiled
+        """
+        self.commit_files = commit_files
+        self.commit_rows = commit_rows
+        self.profiler = profiler
+        self.sessions = {}
+        # the connections of the sessions' current transactions, only their statements are counted
+        self.connections = {}
+        self.on_commit = []
+        self.files = 0
+        self.rows = 0
+        self.commits = 0
+        self.days = set()
+        # days written by the current file, dropped if the file is rolled back
+        self.file_days = set()
+
+    def __count_rows(self, conn, cursor, statement, parameters, context, executemany):
+        if conn not in self.connections.values():
+            return
+        if (context.isinsert or context.isupdate or context.isdelete) and cursor.rowcount != 0:
+            if cursor.rowcount > 0:
+                self.rows += cursor.rowcount
+            if context.compiled is not None and context.compiled.statement.is_dml:
+                self.file_days |= DirtyDays.days_written(context.compiled.statement.table.name, context.compiled_parameters)
+
+    def __begin(self, session, transaction, connection):
+        self.connections[session] = connection
+        # pysqlite only starts a transaction right before it writes, and a savepoint that is released outside of a transaction commits. Start the
+        # transaction explicitly so that the files of a batch stay uncommitted until the batch is.
+        if connection.dialect.name == 'sqlite' and not connection.connection.dbapi_connection.in_transaction:
+            connection.exec_driver_sql('BEGIN')
+
+    def __end(self, session, transaction):
+        if transaction.parent is None:
+            self.connections.pop(session, None)
+
+    def session(self, db):
+        """Return the import's session for the database db, starting one if needed."""
+        session = self.sessions.get(db)
+        if session is None:
+            session = sessionmaker(db.engine, expire_on_commit=False)()
+            event.listen(session, 'after_begin', self.__begin)
+            event.listen(session, 'after_transaction_end', self.__end)
+            event.listen(db.engine, 'after_cursor_execute', self.__count_rows)
+            if self.profiler:
+                self.profiler.attach(db.engine)
+            self.sessions[db] = session
+        return session
+
+    @contextlib.contextmanager
+    def file(self, dbs):
+        """Write a file inside savepoints on the sessions for dbs so that a failure only rolls back that file."""
+        sessions = [self.session(db) for db in dbs]
+        savepoints = [session.begin_nested() for session in sessions]
+        try:
+            yield sessions
+            for savepoint in savepoints:
+                savepoint.commit()
+        except Exception:
+            for savepoint in reversed(savepoints):
+                if savepoint.is_active:
+                    savepoint.rollback()
+            self.file_days = set()
+            raise
+        self.days |= self.file_days
+        self.file_days = set()
+        self.files += 1
+        if self.files >= self.commit_files or (self.commit_rows and self.rows >= self.commit_rows):
+            self.commit()
+
+    def after_commit(self, function):
+        """Call function once the data written so far has been committed. A function that is already waiting for the commit is only called once."""
+        if function not in self.on_commit:
+            self.on_commit.append(function)
+
+    def __garmin_db(self):
+        for db in self.sessions:
+            if isinstance(db, GarminDb):
+                return db
+        return GarminDb(next(iter(self.sessions)).db_params)
+
+    def commit(self):
+        """Commit all data written so far."""
+        days = self.days | self.file_days
+        if days:
+            # mark the days in the same commit as their data
+            DirtyDays.s_add(self.session(self.__garmin_db()), days)
+        self.days = set()
+        self.file_days = set()
+        with self.profiler.stage('commit') if self.profiler else contextlib.nullcontext():
+            for session in self.sessions.values():
+                session.commit()
+        root_logger.debug("Committed %d files with %d rows", self.files, self.rows)
+        self.commits += 1
+        self.files = 0
+        self.rows = 0
+        on_commit = self.on_commit
+        self.on_commit = []
+        for function in on_commit:
+            function()
+
+    def close(self):
+        """Release the import's sessions, discarding anything that has not been committed."""
+        for db, session in self.sessions.items():
+            session.close()
+            event.remove(db.engine, 'after_cursor_execute', self.__count_rows)
+        self.sessions = {}
@@ -0,0 +1,208 @@
+"""Class that stores downloaded JSON files compressed in a SQLite archive."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import re
+import sys
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import datetime
+import threading
+import collections
+
+from idbutils import FileProcessor
+
+from .garmindb import ImportLedger
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+ArchivedFileStat = collections.namedtuple('ArchivedFileStat', ['st_size', 'st_mtime_ns'])
+
+
+class JsonArchive():
+    """
+    A compressed store for the JSON files downloaded into a directory, kept in a SQLite file in that directory.
+
+    Archived files keep the pathname they would have on disk, so importers and ledgers refer to them the same way whether or not they are archived.
+    A file on disk takes precedence over an archived file with the same name.
+    """
+
+    archive_name = 'json_archive.db'
+    # The downloaded JSON files that are saved to an archive when archiving is enabled.
+    archived_regex = r'((daily_summary|hydration|sleep|weight|rhr)_\d{4}-\d{2}-\d{2}|activity_(details_)?\d+)\.json$'
+    compression_level = 6
+    migrate_batch_size = 1000
+
+    __archives = {}
+    __archives_lock = threading.Lock()
+
+    def __init__(self, directory):
+        """Return a new JsonArchive instance for the archive in directory, creating it if needed."""
+        self.directory = directory
+        self.pathname = os.path.join(directory, self.archive_name)
+        self.lock = threading.Lock()
+        # The archive is shared by download threads, access is serialized by the lock.
+        self.connection = sqlite3.connect(self.pathname, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, data BLOB, size INTEGER, mtime INTEGER, hash TEXT)')
+
+    @classmethod
+    def get(cls, directory, create=False):
+        """Return the archive for a directory, or None if the directory has no archive and create is False."""
+        key = os.path.realpath(directory)
+        with cls.__archives_lock:
+            archive = cls.__archives.get(key)
+            if archive is not None and not os.path.isfile(archive.pathname):
+                # The archive was deleted since it was opened.
+                cls.__archives.pop(key).close()
+                archive = None
+            if archive is None and (create or os.path.isfile(os.path.join(directory, cls.archive_name))):
+                archive = cls.__archives[key] = cls(directory)
+            return archive
+
+    def close(self):
+        """Close the archive."""
+        with self.lock:
+            self.connection.close()
+
+    def names(self):
+        """Return a dict of the names of the archived files and their modification times in nanoseconds since the epoch."""
+        with self.lock:
+            return dict(self.connection.execute('SELECT name, mtime FROM files'))
+
+    def write(self, name, data, mtime_ns=None):
+        """Save the contents of a file to the archive, replacing any archived file with the same name."""
+        self.write_many([(name, data, mtime_ns)])
+
+    def write_many(self, files):
+        """Save a list of tuples of file name, contents, and modification time to the archive in one transaction."""
+        rows = []
+        for (name, data, mtime_ns) in files:
+            data = data.encode() if isinstance(data, str) else data
+            rows.append((name, zlib.compress(data, self.compression_level), len(data), mtime_ns or time.time_ns(), hashlib.sha256(data).hexdigest()))
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO files (name, data, size, mtime, hash) VALUES (?, ?, ?, ?, ?)', rows)
+
+    def __row(self, columns, name):
+        with self.lock:
+            return self.connection.execute(f'SELECT {columns} FROM files WHERE name = ?', (name,)).fetchone()
+
+    def read(self, name):
+        """Return the contents of an archived file as a string, or None if it is not archived."""
+        row = self.__row('data', name)
+        return zlib.decompress(row[0]).decode() if row is not None else None
+
+    def stat(self, name):
+        """Return the size and modification time of an archived file, or None if it is not archived."""
+        row = self.__row('size, mtime', name)
+        return ArchivedFileStat(*row) if row is not None else None
+
+    def hash(self, name):
+        """Return a hash of the contents of an archived file, or None if it is not archived."""
+        row = self.__row('hash', name)
+        return row[0] if row is not None else None
+
+    @classmethod
+    def is_archived(cls, pathname):
+        """Return True if pathname is one of the downloaded JSON files that are saved to an archive when archiving is enabled."""
+        return re.search(cls.archived_regex, os.path.basename(pathname)) is not None
+
+    @classmethod
+    def __archive_for(cls, pathname):
+        return cls.get(os.path.dirname(pathname))
+
+    @classmethod
+    def isfile(cls, pathname):
+        """Return True if pathname is a file on disk or an archived file."""
+        if os.path.isfile(pathname):
+            return True
+        archive = cls.__archive_for(pathname)
+        return archive is not None and archive.stat(os.path.basename(pathname)) is not None
+
+    @classmethod
+    def read_file(cls, pathname):
+        """Return the contents of a file on disk or an archived file as a string."""
+        if not os.path.isfile(pathname):
+            archive = cls.__archive_for(pathname)
+            data = archive.read(os.path.basename(pathname)) if archive is not None else None
+            if data is not None:
+                return data
+        with open(pathname) as file:
+            return file.read()
+
+    @classmethod
+    def save_file(cls, pathname, data):
+        """Save the contents of a file to the archive in the file's directory, replacing the file on disk if there is one."""
+        cls.get(os.path.dirname(pathname), create=True).write(os.path.basename(pathname), data)
+        if os.path.isfile(pathname):
+            os.remove(pathname)
+
+    @classmethod
+    def file_stat(cls, pathname):
+        """Return the size and modification time of a file on disk or an archived file."""
+        if not os.path.isfile(pathname):
+            archive = cls.__archive_for(pathname)
+            stat = archive.stat(os.path.basename(pathname)) if archive is not None else None
+            if stat is not None:
+                return stat
+        return os.stat(pathname)
+
+    @classmethod
+    def content_hash(cls, pathname):
+        """Return a hash of the contents of a file on disk or an archived file."""
+        if not os.path.isfile(pathname):
+            archive = cls.__archive_for(pathname)
+            payload_hash = archive.hash(os.path.basename(pathname)) if archive is not None else None
+            if payload_hash is not None:
+                return payload_hash
+        return ImportLedger.content_hash(pathname)
+
+    @classmethod
+    def dir_to_files(cls, input_dir, file_regex, latest=False, recursive=False):
+        """Return the files on disk and archived files in a directory, possibly recursively, that match a regex."""
+        file_names = FileProcessor.dir_to_files(input_dir, file_regex, latest, recursive)
+        latest_threshold = (datetime.datetime.now() - datetime.timedelta(days=1)).timestamp() * 1e9
+        directories = [directory for (directory, _, _) in os.walk(input_dir)] if recursive else [input_dir]
+        for directory in directories:
+            archive = cls.get(directory)
+            if archive is not None:
+                for name, mtime in archive.names().items():
+                    if re.search(file_regex, name) and (not latest or mtime > latest_threshold):
+                        file_names.append(directory + "/" + name)
+        # A file on disk and an archived file with the same name are the same file.
+        return list(dict.fromkeys(file_names))
+
+    @classmethod
+    def migrate(cls, input_dir, recursive=True):
+        """Move the downloaded JSON files on disk in a directory, possibly recursively, into archives and return how many were moved."""
+        directories = [directory for (directory, _, _) in os.walk(input_dir)] if recursive else [input_dir]
+        migrated = 0
+        for directory in directories:
+            pathnames = [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if cls.is_archived(name)]
+            if not pathnames:
+                continue
+            archive = cls.get(directory, create=True)
+            for index in range(0, len(pathnames), cls.migrate_batch_size):
+                batch = pathnames[index:index + cls.migrate_batch_size]
+                files = []
+                for pathname in batch:
+                    with open(pathname, 'rb') as file:
+                        # Keeping the modification time lets the import ledger recognize files that were already imported.
+                        files.append((os.path.basename(pathname), file.read(), os.stat(pathname).st_mtime_ns))
+                archive.write_many(files)
+                for pathname in batch:
+                    os.remove(pathname)
+            root_logger.info("Archived %d JSON files in %s", len(pathnames), directory)
+            migrated += len(pathnames)
+        return migrated
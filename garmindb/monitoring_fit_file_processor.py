@@ -12,7 +12,6 @@ import datetime
 import fitfile
 import idbutils
 
-from .garmindb import File
 from .garmindb import MonitoringDb, Monitoring, MonitoringInfo, MonitoringHeartRate, MonitoringIntensity, MonitoringClimb, MonitoringRespirationRate, MonitoringPulseOx
 from .fit_file_processor import FitFileProcessor
 
@@ -25,18 +24,38 @@ root_logger = logging.getLogger()
 class MonitoringFitFileProcessor(FitFileProcessor):
     """Class that takes a parsed monitoring FIT file object and imports it into a database."""
 
+    def __init__(self, db_params, plugin_manager=None, debug=0, commit_files=1, commit_rows=None):
+        """Return a new MonitoringFitFileProcessor instance."""
+        super().__init__(db_params, plugin_manager, debug, commit_files, commit_rows)
+        self.garmin_mon_db = None
+        self.garmin_mon_db_plugins = set()
+
+    def __open_monitoring_db(self, plugin_names):
+        if self.transaction is not None:
+            # The new db instance gets its own session, commit first so the sessions don't contend for the database.
+            self.transaction.commit()
+        self.garmin_mon_db = MonitoringDb(self.db_params, self.debug - 1)
+        self.garmin_mon_db_plugins.update(plugin_names)
+
     def write_file(self, fit_file):
         """Given a Fit File object, write all of its messages to the DB."""
-        self.monitoring_fit_file_plugins = [plugin for plugin in self.plugin_manager.get_file_processors('MonitoringFit', fit_file).values()]
+        plugins = self.plugin_manager.get_file_processors('MonitoringFit', fit_file)
+        self.monitoring_fit_file_plugins = list(plugins.values())
+        self._set_plugins(plugins)
         if len(self.monitoring_fit_file_plugins):
-            root_logger.info("Loaded %d activity plugins %r for file %s", len(self.activity_fit_file_plugins), self.activity_fit_file_plugins, fit_file)
-        # Create the db after setting up the plugins so that plugin tables are handled properly
-        self.garmin_mon_db = MonitoringDb(self.db_params, self.debug - 1)
-        with self.garmin_db.managed_session() as self.garmin_db_session, self.garmin_mon_db.managed_session() as self.garmin_mon_db_session:
-            self._write_message_types(fit_file, fit_file.message_types)
+            root_logger.info("Loaded %d monitoring plugins %r for file %s", len(self.monitoring_fit_file_plugins), self.monitoring_fit_file_plugins, fit_file)
+        # Create the db after setting up the plugins so that plugin tables are handled properly. Only plugins that are new to the db require a new one.
+        if self.garmin_mon_db is None or not self.garmin_mon_db_plugins.issuperset(plugins):
+            self.__open_monitoring_db(plugins)
+        super().write_file(fit_file)
+
+    def _session_dbs(self):
+        """Return the session attribute names and databases that data from FIT files is written to."""
+        return dict(super()._session_dbs(), garmin_mon_db_session=self.garmin_mon_db)
 
-    def _plugin_dispatch(self, handler_name, *args, **kwargs):
-        return super()._plugin_dispatch(self.monitoring_fit_file_plugins, handler_name, *args, **kwargs)
+    def ledger_db(self):
+        """Return the database that the processor writes the data from FIT files to."""
+        return MonitoringDb(self.db_params, self.debug - 1)
 
     @classmethod
     def __unpack_tuple(cls, entry, name, value, index):
@@ -48,7 +67,7 @@ class MonitoringFitFileProcessor(FitFileProcessor):
         if isinstance(activity_types, list):
             for index, activity_type in enumerate(activity_types):
                 entry = {
-                    'file_id'                   : File.s_get_id(self.garmin_db_session, fit_file.filename),
+                    'file_id'                   : self._file_id(fit_file.filename),
                     'timestamp'                 : message_fields.local_timestamp,
                     'activity_type'             : activity_type,
                     'resting_metabolic_rate'    : message_fields.get('resting_metabolic_rate')
@@ -69,16 +88,16 @@ class MonitoringFitFileProcessor(FitFileProcessor):
         try:
             intersection = MonitoringHeartRate.intersection(entry)
             if len(intersection) > 1 and intersection['heart_rate'] > 0:
-                MonitoringHeartRate.s_insert_or_update(self.garmin_mon_db_session, intersection)
+                self._upsert(self.garmin_mon_db_session, MonitoringHeartRate, intersection)
             intersection = MonitoringIntensity.intersection(entry)
             if len(intersection) > 1:
-                MonitoringIntensity.s_insert_or_update(self.garmin_mon_db_session, intersection)
+                self._upsert(self.garmin_mon_db_session, MonitoringIntensity, intersection)
             intersection = MonitoringClimb.intersection(entry)
             if len(intersection) > 1:
-                MonitoringClimb.s_insert_or_update(self.garmin_mon_db_session, intersection)
+                self._upsert(self.garmin_mon_db_session, MonitoringClimb, intersection)
             intersection = Monitoring.intersection(entry)
             if len(intersection) > 1:
-                Monitoring.s_insert_or_update(self.garmin_mon_db_session, intersection)
+                self._upsert(self.garmin_mon_db_session, Monitoring, intersection)
         except ValueError:
             logger.error("write_monitoring_entry: ValueError for %r: %s", entry, traceback.format_exc())
         except Exception:
@@ -93,7 +112,7 @@ class MonitoringFitFileProcessor(FitFileProcessor):
                 'rr'        : rr,
             }
             if fit_file.type is fitfile.FileType.monitoring_b:
-                MonitoringRespirationRate.s_insert_or_update(self.garmin_mon_db_session, respiration)
+                self._upsert(self.garmin_mon_db_session, MonitoringRespirationRate, respiration)
             else:
                 raise ValueError(f'Unexpected file type {repr(fit_file.type)} for respiration message')
 
@@ -106,6 +125,6 @@ class MonitoringFitFileProcessor(FitFileProcessor):
                     'timestamp': fit_file.utc_datetime_to_local(message_fields.timestamp),
                     'pulse_ox': pulse_ox,
                 }
-                MonitoringPulseOx.s_insert_or_update(self.garmin_mon_db_session, pulse_ox_entry)
+                self._upsert(self.garmin_mon_db_session, MonitoringPulseOx, pulse_ox_entry)
         else:
             raise ValueError(f'Unexpected file type {repr(fit_file.type)} for pulse ox')
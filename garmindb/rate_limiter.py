@@ -0,0 +1,57 @@
+"""Class that limits the rate of requests made to Garmin Connect."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import sys
+import time
+import threading
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+class RateLimiter():
+    """A thread safe token bucket that limits requests to an average rate while allowing short bursts."""
+
+    def __init__(self, rate=1.0, burst=1):
+        """
+        Return a new RateLimiter instance.
+
+        Parameters:
+        rate (float): the average number of requests allowed per second
+        burst (int): the number of requests that can be made back to back before being limited to rate
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+        self.waited = 0.0
+
+    def __refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self):
+        """Block until a request can be made without exceeding the rate."""
+        with self.lock:
+            now = time.monotonic()
+            self.__refill(now)
+            # Take the token now, even if it isn't there yet, so that waiting threads are queued in order.
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited += delay
+        if delay > 0:
+            time.sleep(delay)
+
+    def backoff(self, seconds):
+        """Stop all requests for seconds, for instance when the server asks for requests to slow down."""
+        with self.lock:
+            self.__refill(time.monotonic())
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+        root_logger.info("Backing off requests for %.1f seconds", seconds)
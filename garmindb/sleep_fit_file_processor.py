@@ -25,8 +25,7 @@ class SleepFitFileProcessor(FitFileProcessor):
         """Given a Fit File object, write all of its messages to the DB."""
         self.last_sleep_event = None
         self.last_sleep_level = None
-        with self.garmin_db.managed_session() as self.garmin_db_session:
-            self._write_message_types(fit_file, fit_file.message_types)
+        super().write_file(fit_file)
 
     def _write_sleep_level_entry(self, fit_file, message_fields):
         logger.debug("sleep level message: %r", message_fields)
@@ -0,0 +1,169 @@
+"""Class that stands in for the Supabase PostgREST API so that syncing can be tested offline."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import sys
+import json
+import time
+import logging
+import threading
+import collections
+import http.server
+import urllib.parse
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+class MockPostgrest():
+    """A local HTTP server that implements the parts of the PostgREST API that SupabaseSync uses, keeping the tables in memory."""
+
+    def __init__(self, tables, key=None, latency=0.0, fail_every=0, port=0):
+        """
+        Return a new MockPostgrest instance.
+
+        Parameters:
+        tables (dict): table names and a tuple of the table's columns and the columns of its primary key
+        key (string): if set, requests have to send this API key
+        latency (float): seconds to wait before answering each request
+        fail_every (int): if set, answer every Nth request with 503 Service Unavailable
+        port (int): the port to listen on, any free port if 0
+        """
+        self.tables = {table: (set(columns), tuple(primary_key)) for table, (columns, primary_key) in tables.items()}
+        self.key = key
+        self.latency = latency
+        self.fail_every = fail_every
+        self.port = port
+        self.lock = threading.Lock()
+        self.rows = {table: {} for table in tables}
+        self.requests = 0
+        self.failed = 0
+        self.uploads = collections.Counter()
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        """Return the base URL of the server."""
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def table_rows(self, table):
+        """Return a list of the rows in a table."""
+        with self.lock:
+            return list(self.rows[table].values())
+
+    @classmethod
+    def __error(cls, status, code, message):
+        return (status, {'code': code, 'message': message})
+
+    def __get_columns(self, body):
+        table = body.get('tablename')
+        if table not in self.tables:
+            return (200, [])
+        return (200, [{'column_name': column} for column in sorted(self.tables[table][0])])
+
+    def __upsert(self, table, rows, prefer):
+        (columns, primary_key) = self.tables[table]
+        if not isinstance(rows, list):
+            rows = [rows]
+        if rows and any(set(row) != set(rows[0]) for row in rows):
+            return self.__error(400, 'PGRST102', 'All object keys must match')
+        for row in rows:
+            unknown = set(row) - columns
+            if unknown:
+                return self.__error(400, 'PGRST204', f"Could not find the '{sorted(unknown)[0]}' column of '{table}' in the schema cache")
+            if any(row.get(column) is None for column in primary_key):
+                return self.__error(400, '23502', f'null value in a primary key column of {table}')
+        merge = 'resolution=merge-duplicates' in prefer
+        with self.lock:
+            for row in rows:
+                row_key = tuple(row[column] for column in primary_key)
+                if row_key in self.rows[table] and not merge:
+                    return self.__error(409, '23505', f'duplicate key value violates unique constraint of {table}')
+                self.rows[table][row_key] = dict(self.rows[table].get(row_key, {}), **row)
+            self.uploads[table] += len(rows)
+        return (201, None)
+
+    def respond(self, method, path, headers, body):
+        """Return the HTTP status and JSON response to answer a request with."""
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.requests += 1
+            if self.fail_every and self.requests % self.fail_every == 0:
+                self.failed += 1
+                return self.__error(503, 'PGRST000', 'Service Unavailable')
+        if self.key and headers.get('apikey') != self.key:
+            return self.__error(401, 'PGRST301', 'Invalid API key')
+        if not path.startswith('/rest/v1/'):
+            return self.__error(404, 'PGRST125', 'Invalid path')
+        resource = path[len('/rest/v1/'):]
+        if method == 'POST' and resource == 'rpc/get_columns':
+            return self.__get_columns(body)
+        if resource not in self.tables:
+            return self.__error(404, '42P01', f'relation {resource} does not exist')
+        if method == 'GET':
+            return (200, self.table_rows(resource))
+        if method == 'POST':
+            return self.__upsert(resource, body, headers.get('Prefer', ''))
+        return self.__error(405, 'PGRST117', f'Unsupported method {method}')
+
+    def __handler(self):
+        mock_postgrest = self
+
+        class MockPostgrestRequestHandler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def __respond(self, method):
+                url = urllib.parse.urlsplit(self.path)
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    body = json.loads(self.rfile.read(length)) if length else None
+                except ValueError:
+                    (status, response) = (400, {'code': 'PGRST102', 'message': 'Invalid JSON'})
+                else:
+                    (status, response) = mock_postgrest.respond(method, url.path, self.headers, body)
+                data = json.dumps(response).encode() if response is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.__respond('GET')
+
+            def do_POST(self):
+                self.__respond('POST')
+
+            def log_message(self, format, *args):
+                root_logger.debug("mock postgrest: " + format, *args)
+
+        return MockPostgrestRequestHandler
+
+    def start(self):
+        """Start serving requests on a background thread."""
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', self.port), self.__handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='MockPostgrest', daemon=True)
+        self.thread.start()
+        root_logger.info("Mock PostgREST serving on %s", self.url)
+        return self
+
+    def stop(self):
+        """Stop serving requests."""
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        """Start serving requests when entering a with block."""
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Stop serving requests when leaving a with block."""
+        self.stop()
@@ -0,0 +1,158 @@
+"""Class that uploads rows to Supabase tables in batches."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import sys
+import json
+import time
+import logging
+import datetime
+import threading
+import concurrent.futures
+
+import requests
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+class SupabaseSync():
+    """Upserts rows into Supabase tables through its PostgREST API, many rows per request and several tables at a time."""
+
+    retry_status_codes = [429, 500, 502, 503, 504]
+
+    def __init__(self, url, key, schema_cache_file=None, chunk_size=500, workers=4, retries=3, backoff_seconds=1.0, timeout=30):
+        """
+        Return a new SupabaseSync instance.
+
+        Parameters:
+        url (string): the Supabase project URL, or the URL of a MockPostgrest server
+        key (string): the Supabase API key
+        schema_cache_file (string): a JSON file the columns of the tables are cached in between runs, the columns are not cached on disk if None
+        chunk_size (int): the maximum number of rows to upload in one request
+        workers (int): the number of tables to upload at the same time
+        retries (int): the number of times to retry a request that failed because the server was busy or had an error
+        backoff_seconds (float): seconds to wait before the first retry of a failed request, doubled for every retry
+        timeout (float): seconds to wait for a response
+        """
+        self.url = url.rstrip('/')
+        self.schema_cache_file = schema_cache_file
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount(self.url, requests.adapters.HTTPAdapter(pool_maxsize=max(workers, 10)))
+        self.session.headers.update({'apikey': key, 'Authorization': f'Bearer {key}', 'Content-Type': 'application/json'})
+        self.lock = threading.Lock()
+        self.columns = self.__load_columns()
+        # Columns read from the cache file may be out of date, they are fetched again if an upload is rejected.
+        self.cached_tables = set(self.columns)
+
+    def __load_columns(self):
+        if self.schema_cache_file and os.path.isfile(self.schema_cache_file):
+            try:
+                with open(self.schema_cache_file) as file:
+                    return {table: set(columns) for table, columns in json.load(file).items()}
+            except (OSError, ValueError) as e:
+                root_logger.warning("Ignoring schema cache %s: %s", self.schema_cache_file, e)
+        return {}
+
+    def __save_columns(self):
+        if self.schema_cache_file:
+            os.makedirs(os.path.dirname(os.path.abspath(self.schema_cache_file)), exist_ok=True)
+            with open(self.schema_cache_file, 'w') as file:
+                json.dump({table: sorted(columns) for table, columns in self.columns.items()}, file, indent=2)
+
+    @classmethod
+    def __retry_after(cls, response):
+        try:
+            return float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+
+    def __request(self, method, path, **kwargs):
+        """Make a request to the PostgREST API, retrying with backoff if the server is busy, fails, or can't be reached."""
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.request(method, f'{self.url}/rest/v1/{path}', timeout=self.timeout, **kwargs)
+                if response.status_code not in self.retry_status_codes or attempt >= self.retries:
+                    response.raise_for_status()
+                    return response
+                delay = self.__retry_after(response) or self.backoff_seconds * (2 ** attempt)
+                root_logger.warning("%s %s failed with %s, retry %d of %d in %.1f seconds", method, path, response.status_code, attempt + 1, self.retries, delay)
+            except requests.ConnectionError as e:
+                if attempt >= self.retries:
+                    raise
+                delay = self.backoff_seconds * (2 ** attempt)
+                root_logger.warning("%s %s failed with %s, retry %d of %d in %.1f seconds", method, path, e, attempt + 1, self.retries, delay)
+            time.sleep(delay)
+
+    def table_columns(self, table, refresh=False):
+        """Return the set of columns of a table, fetching them from the server if they are not cached."""
+        with self.lock:
+            columns = self.columns.get(table)
+        if columns is None or refresh:
+            response = self.__request('POST', 'rpc/get_columns', json={'tablename': table})
+            columns = {row['column_name'] for row in response.json()}
+            with self.lock:
+                self.columns[table] = columns
+                self.cached_tables.discard(table)
+                self.__save_columns()
+        return columns
+
+    @classmethod
+    def __convert_to_json(cls, object):
+        if isinstance(object, (datetime.datetime, datetime.date, datetime.time)):
+            return object.isoformat()
+        return str(object)
+
+    def __chunks(self, records, columns):
+        """Yield lists of at most chunk_size rows, filtered to the table's columns, where all rows have the same keys as PostgREST requires."""
+        rows_by_keys = {}
+        for record in records:
+            row = {key: value for key, value in record.items() if key in columns}
+            rows_by_keys.setdefault(tuple(sorted(row)), []).append(row)
+        for rows in rows_by_keys.values():
+            for index in range(0, len(rows), self.chunk_size):
+                yield rows[index:index + self.chunk_size]
+
+    def __post_chunk(self, table, rows):
+        data = json.dumps(rows, default=self.__convert_to_json)
+        self.__request('POST', table, data=data, headers={'Prefer': 'resolution=merge-duplicates,return=minimal'})
+
+    def upsert(self, table, records):
+        """Insert or update records in a table, return the number of rows uploaded. Raises requests.HTTPError if an upload fails."""
+        uploaded = 0
+        for rows in self.__chunks(records, self.table_columns(table)):
+            try:
+                self.__post_chunk(table, rows)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 400 or table not in self.cached_tables:
+                    raise
+                root_logger.info("Upload to %s rejected with cached columns, fetching the columns again", table)
+                columns = self.table_columns(table, refresh=True)
+                rows = [{key: value for key, value in row.items() if key in columns} for row in rows]
+                self.__post_chunk(table, rows)
+            uploaded += len(rows)
+        root_logger.info("Uploaded %d rows to %s", uploaded, table)
+        return uploaded
+
+    def sync(self, tables):
+        """Upsert a dict of table names and lists of records, several tables at a time. Return a dict of the tables that were uploaded and their row counts."""
+        uploaded = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.upsert, table, records): table for table, records in tables.items() if records}
+            for future in concurrent.futures.as_completed(futures):
+                table = futures[future]
+                try:
+                    uploaded[table] = future.result()
+                except Exception as e:
+                    root_logger.error("Upload to %s failed: %s", table, e)
+        return uploaded
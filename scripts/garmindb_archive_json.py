@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+"""Move downloaded JSON files into compressed JSON archives."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import sys
+import logging
+import argparse
+
+from garmindb import GarminConnectConfigManager
+from garmindb import format_version
+from garmindb import JsonArchive
+
+
+logging.basicConfig(filename='archive_json.log', filemode='w', level=logging.INFO)
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+def main(argv):
+    """Move the JSON files that have already been downloaded into JSON archives."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--version", help="print the program's version", action='version', version=format_version(sys.argv[0]))
+    parser.add_argument("-f", "--config", help="Config file path", type=str, default=None)
+    args = parser.parse_args()
+
+    gc_config = GarminConnectConfigManager(args.config)
+    directories = [gc_config.get_monitoring_base_dir(), gc_config.get_sleep_dir(), gc_config.get_weight_dir(), gc_config.get_rhr_dir(), gc_config.get_activities_dir()]
+    migrated = sum(JsonArchive.migrate(directory) for directory in directories)
+    print(f"Archived {migrated} JSON files")
+    if not gc_config.download_json_archive():
+        print('Set "json_archive" to true in the "download" section of the config to archive newly downloaded JSON files too.')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,10 +1,11 @@
 import os
+import sys
 import json
 import datetime
-import requests
 import time
 from pathlib import Path
 from garminconnect import Garmin
+from garmindb import SupabaseSync, DbSync, GarminConnectConfigManager, Analyze, FitImport, PluginManager, Download, ImportPipeline
 
 # === ENV ===
 SUPABASE_URL = os.environ["SUPABASE_URL"]
@@ -65,45 +66,58 @@ def transform_stat_keys(stat):
     return {snake_case(k): v for k, v in stat.items() if not isinstance(v, dict)}
 
 # === Supabase Upload ===
-TABLE_COLUMNS_CACHE = {}
-
-def get_table_columns(table_name):
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
-
-    resp = requests.post(
-        f"{SUPABASE_URL}/rest/v1/rpc/get_columns",
-        headers=headers,
-        json={ "tablename": table_name }
-    )
-
-    if resp.status_code != 200:
-        raise Exception(f"Failed to fetch schema for {table_name}: {resp.status_code} {resp.text}")
-
-    return {row["column_name"] for row in resp.json()}
-
-def upload_to_supabase(table_name, records):
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json",
-        "Prefer": "resolution=merge-duplicates"
-    }
-
-    if table_name not in TABLE_COLUMNS_CACHE:
-        TABLE_COLUMNS_CACHE[table_name] = get_table_columns(table_name)
-    allowed_keys = TABLE_COLUMNS_CACHE[table_name]
-
-    for record in records:
-        filtered = {k: v for k, v in record.items() if k in allowed_keys}
-        res = requests.post(f"{SUPABASE_URL}/rest/v1/{table_name}", headers=headers, json=[filtered])
-        if res.status_code >= 300:
-            print(f"❌ Upload to {table_name} failed: {res.status_code} {res.text}")
+# SUPABASE_URL can point at a garmindb.MockPostgrest server for testing.
+SCHEMA_CACHE_FILE = os.environ.get("SUPABASE_SCHEMA_CACHE", "data/supabase_columns.json")
+
+def upload_to_supabase(tables):
+    supabase = SupabaseSync(SUPABASE_URL, SUPABASE_KEY, schema_cache_file=SCHEMA_CACHE_FILE)
+    uploaded = supabase.sync(tables)
+    for table_name, records in tables.items():
+        if table_name in uploaded:
+            print(f"✅ Uploaded {uploaded[table_name]} rows to {table_name}")
+        elif records:
+            print(f"❌ Upload to {table_name} failed")
+
+# === Sync From Local Databases ===
+# Pushes only the rows of the GarminDB databases that are new or changed since the last sync, without logging in to Garmin Connect.
+def sync_from_db(full=False):
+    supabase = SupabaseSync(SUPABASE_URL, SUPABASE_KEY, schema_cache_file=SCHEMA_CACHE_FILE)
+    db_sync = DbSync(GarminConnectConfigManager().get_db_params(), supabase)
+    uploaded = db_sync.sync(full=full)
+    for sync_table in db_sync.sync_tables:
+        if sync_table.remote_table in uploaded:
+            print(f"✅ Uploaded {uploaded[sync_table.remote_table]} new or changed rows to {sync_table.remote_table}")
         else:
-            print(f"✅ Uploaded to {table_name}")
+            print(f"➖ No rows uploaded to {sync_table.remote_table}")
+
+# === Import ===
+# Imports the FIT files in the GarminDB directories, decoding them with the number of workers of the import config.
+# With latest only the latest files are checked. If the import config has a profile_file, the import is profiled and the report is written to it.
+def import_fit_files(latest=False):
+    gc_config = GarminConnectConfigManager()
+    plugin_manager = PluginManager(gc_config.get_plugins_dir(), gc_config.get_db_params())
+    FitImport(gc_config, plugin_manager).import_all(latest=latest)
+
+# === Download ===
+# Downloads the last days of the enabled stats and the latest activities into the GarminDB directories,
+# importing the files while the download is still running.
+def download_and_import(days=7):
+    gc_config = GarminConnectConfigManager()
+    plugin_manager = PluginManager(gc_config.get_plugins_dir(), gc_config.get_db_params())
+    download = Download(gc_config)
+    download.login()
+    pipeline = ImportPipeline(ImportPipeline.default_routes(gc_config, plugin_manager))
+    with pipeline.run(download):
+        download.download_stats(datetime.date.today() - datetime.timedelta(days=days - 1), days, gc_config.latest_activity_count())
+    download.executor.shutdown()
+    print(f"✅ Imported downloaded files {dict(pipeline.imported)} for {len(pipeline.affected_days)} days")
+
+# === Summaries ===
+# Recalculates the summary tables for the days that were imported since the last run.
+# With rollup the weeks, months, and years are rolled up from the days summaries.
+def analyze(full=False, rollup=False):
+    gc_config = GarminConnectConfigManager()
+    Analyze(gc_config, 0, rollup=rollup, workers=gc_config.analyze_workers()).summary(full=full)
 
 # === Main ===
 def main():
@@ -118,11 +132,17 @@ def main():
         "sleep": [],
         "sleep_summary": []
     }
+    # Rows are collected for all days and uploaded in batches at the end.
+    uploads = {
+        "activities": [],
+        "daily_stats": [],
+        "sleep_summary": []
+    }
 
     # === 1. Latest Activities ===
     activities = client.get_activities(0, 10)
     full_data["activities"] = activities
-    upload_to_supabase("activities", [transform_activity(a) for a in activities])
+    uploads["activities"] = [transform_activity(a) for a in activities]
 
     # === 2. Past Week Daily Stats & Sleep ===
     today = datetime.date.today()
@@ -143,7 +163,7 @@ def main():
             stat["calendar_date"] = stat.get("calendar_date") or ds
 
             full_data["daily_stats"].append(stat)
-            upload_to_supabase("daily_stats", [stat])
+            uploads["daily_stats"].append(stat)
         except Exception as e:
             print(f"⚠️ Stats failed for {ds}: {e}")
 
@@ -163,13 +183,29 @@ def main():
                     "average_respiration": to_float(dto.get("averageRespirationValue"))
                 }
                 full_data["sleep_summary"].append(row)
-                upload_to_supabase("sleep_summary", [row])
+                uploads["sleep_summary"].append(row)
         except Exception as e:
             print(f"⚠️ Sleep failed for {ds}: {e}")
 
         time.sleep(1)
 
+    upload_to_supabase(uploads)
     save_json(full_data)
 
 if __name__ == "__main__":
-    main()
+    # --download downloads and imports the latest data, --import imports the FIT files, --analyze recalculates the summaries,
+    # and --from-db syncs from the local databases.
+    # --latest only imports the latest FIT files.
+    # --full recalculates all summaries and also checks rows older than the last sync.
+    # --rollup rolls up the weekly, monthly, and yearly summaries from the daily summaries.
+    full = "--full" in sys.argv[1:]
+    if "--download" in sys.argv[1:]:
+        download_and_import()
+    if "--import" in sys.argv[1:]:
+        import_fit_files(latest="--latest" in sys.argv[1:])
+    if "--analyze" in sys.argv[1:]:
+        analyze(full=full, rollup="--rollup" in sys.argv[1:])
+    if "--from-db" in sys.argv[1:]:
+        sync_from_db(full=full)
+    elif not any(flag in sys.argv[1:] for flag in ("--download", "--import", "--analyze")):
+        main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+"""Benchmark downloading against a local replay of Garmin Connect."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import sys
+import logging
+import argparse
+
+from garmindb import format_version
+from garmindb import DownloadBenchmark
+
+
+logging.basicConfig(filename='download_benchmark.log', filemode='w', level=logging.INFO)
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+def main(argv):
+    """Run a download benchmark with the user's choice of data and server behavior."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--version", help="print the program's version", action='version', version=format_version(sys.argv[0]))
+    parser.add_argument("-d", "--days", help="The number of days of data to download.", type=int, default=30)
+    parser.add_argument("-a", "--activities", help="The number of activities to download.", type=int, default=10)
+    parser.add_argument("-F", "--fixtures", help="A directory of downloaded files to replay instead of generated data.", type=str, default=None)
+    server_group = parser.add_argument_group('Server')
+    server_group.add_argument("-l", "--latency", help="Seconds the server waits before answering each request.", type=float, default=0.05)
+    server_group.add_argument("-t", "--throttle", help="Answer every Nth request with 429 Too Many Requests.", type=int, default=0)
+    server_group.add_argument("-r", "--retry-after", help="The Retry-After seconds sent with a 429 response.", type=int, default=1)
+    download_group = parser.add_argument_group('Download')
+    download_group.add_argument("-w", "--workers", help="The number of download workers.", type=int, default=4)
+    download_group.add_argument("-R", "--rate", help="The download rate limit in requests per second.", type=float, default=50.0)
+    download_group.add_argument("-b", "--burst", help="The download rate limit burst.", type=int, default=10)
+    download_group.add_argument("-j", "--json-archive", help="Save downloaded JSON files to JSON archives.", action="store_true", default=False)
+    args = parser.parse_args()
+
+    benchmark = DownloadBenchmark(args.days, args.activities, args.latency, args.throttle, args.retry_after, args.workers, args.rate, args.burst, args.fixtures, args.json_archive)
+    results = benchmark.run()
+    print(f"Downloaded {results['days']} days and {results['activities']} activities, {results['files']} files, in {results['seconds']} seconds")
+    print(f"{results['requests']} requests, {results['throttled']} throttled, {results['requests_per_second']} requests per second")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -39,7 +39,8 @@ print(f"Building {module_name} {module_version}")
 
 setup(name=module_name, version=module_version, author='Tom Goetz',
       packages=[module_name, f'{module_name}.garmindb', f'{module_name}.fitbitdb', f'{module_name}.mshealthdb', f'{module_name}.summarydb'],
-      scripts=['scripts/garmindb_cli.py', 'scripts/garmindb_checkup.py', 'scripts/garmindb_bug_report.py', 'scripts/fitbit.py', 'scripts/mshealth.py'],
+      scripts=['scripts/garmindb_cli.py', 'scripts/garmindb_checkup.py', 'scripts/garmindb_bug_report.py', 'scripts/garmindb_download_benchmark.py',
+               'scripts/garmindb_archive_json.py', 'scripts/fitbit.py', 'scripts/mshealth.py'],
       description='Download data from Garmin Connect and store it in a SQLite db for analysis.',
       long_description=module_long_description,
       long_description_content_type='text/markdown',
@@ -0,0 +1,97 @@
+"""Functions for writing small FIT files to test importing with when there are no FIT files in test_files."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import struct
+import datetime
+
+
+fit_epoch = datetime.datetime(1989, 12, 31, tzinfo=datetime.timezone.utc)
+
+# FIT base type ids, struct formats, and sizes
+base_types = {
+    'enum'      : (0x00, 'B', 1),
+    'uint8'     : (0x02, 'B', 1),
+    'sint16'    : (0x83, 'h', 2),
+    'uint16'    : (0x84, 'H', 2),
+    'sint32'    : (0x85, 'i', 4),
+    'uint32'    : (0x86, 'I', 4),
+    'uint32z'   : (0x8C, 'I', 4),
+}
+
+# global message numbers
+file_id = 0
+sport = 12
+session = 18
+lap = 19
+record = 20
+device_info = 23
+monitoring = 55
+monitoring_info = 103
+
+
+def fit_timestamp(timestamp):
+    """Return a timestamp as seconds since the FIT epoch."""
+    return int((timestamp - fit_epoch).total_seconds())
+
+
+def fit_file_bytes(messages):
+    """Return the contents of a FIT file holding messages, a list of global message numbers and lists of (field number, base type, value) tuples."""
+    body = b''
+    local_messages = {}
+    for global_message_number, fields in messages:
+        definition = (global_message_number, tuple((field_number, base_type) for field_number, base_type, _ in fields))
+        if definition not in local_messages:
+            # reuse the local message number of the oldest definition once all 16 are in use
+            local_message_number = len(local_messages) % 16
+            local_messages = {key: value for key, value in local_messages.items() if value != local_message_number}
+            local_messages[definition] = local_message_number
+            body += bytes([0x40 | local_message_number]) + struct.pack('<BBHB', 0, 0, global_message_number, len(fields))
+            for field_number, base_type, _ in fields:
+                body += struct.pack('<BBB', field_number, base_types[base_type][2], base_types[base_type][0])
+        body += bytes([local_messages[definition]])
+        for _, base_type, value in fields:
+            body += struct.pack('<' + base_types[base_type][1], value)
+    header = struct.pack('<BBHI4sH', 14, 0x10, 2093, len(body), b'.FIT', 0)
+    return header + body + b'\x00\x00'
+
+
+def _header_messages(file_type, start, serial_number):
+    start_ts = fit_timestamp(start)
+    return [
+        (file_id, [(0, 'enum', file_type), (1, 'uint16', 1), (2, 'uint16', 2697), (3, 'uint32z', serial_number), (4, 'uint32', start_ts)]),
+        (device_info, [(253, 'uint32', start_ts), (3, 'uint32z', serial_number), (2, 'uint16', 1), (4, 'uint16', 2697), (5, 'uint16', 1020), (0, 'uint8', 0)]),
+    ]
+
+
+def write_monitoring_file(file_name, start, entries=100, serial_number=3999999999, seed=0):
+    """Write a monitoring FIT file with a sample of activity and heart rate for each minute from start."""
+    start_ts = fit_timestamp(start)
+    messages = _header_messages(32, start, serial_number)
+    messages.append((monitoring_info, [(253, 'uint32', start_ts), (0, 'uint32', start_ts + 3600), (1, 'enum', 6), (5, 'uint16', 1700)]))
+    for index in range(entries):
+        timestamp = start_ts + index * 60
+        messages.append((monitoring, [(253, 'uint32', timestamp), (5, 'enum', 6), (3, 'uint32', index * 10 + seed), (19, 'uint16', 5 + seed),
+                                      (24, 'uint8', 6 << 5 | 1)]))
+        messages.append((monitoring, [(253, 'uint32', timestamp + 30), (27, 'uint8', 60 + (index + seed) % 30)]))
+    with open(file_name, 'wb') as file:
+        file.write(fit_file_bytes(messages))
+
+
+def write_activity_file(file_name, start, records=100, serial_number=3999999999):
+    """Write a running activity FIT file with a record for each second from start."""
+    start_ts = fit_timestamp(start)
+    messages = _header_messages(4, start, serial_number)
+    for index in range(records):
+        messages.append((record, [(253, 'uint32', start_ts + index), (0, 'sint32', 500000000 + index * 1000), (1, 'sint32', -900000000 + index * 1000),
+                                  (3, 'uint8', 120 + index % 40), (5, 'uint32', index * 300), (6, 'uint16', 3000), (2, 'uint16', 2600)]))
+    end_ts = start_ts + records
+    totals = [(2, 'uint32', start_ts), (7, 'uint32', records * 1000), (8, 'uint32', records * 1000), (9, 'uint32', records * 300), (11, 'uint16', 100)]
+    messages.append((lap, [(253, 'uint32', end_ts)] + totals + [(254, 'uint16', 0)]))
+    messages.append((session, [(253, 'uint32', end_ts), (5, 'enum', 1), (6, 'enum', 0)] + totals + [(254, 'uint16', 0)]))
+    # some devices write the sport at the end of the file
+    messages.append((sport, [(0, 'enum', 1), (1, 'enum', 0)]))
+    with open(file_name, 'wb') as file:
+        file.write(fit_file_bytes(messages))
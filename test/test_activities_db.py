@@ -28,6 +28,7 @@ do_tcx_import_tests = True
 do_summary_import_tests = True
 do_details_import_tests = True
 do_multiple_import_tests = True
+do_records_benchmark_tests = True
 
 
 class TestActivitiesDb(TestDBBase, unittest.TestCase):
@@ -152,6 +153,18 @@ class TestActivitiesDb(TestDBBase, unittest.TestCase):
         self.fit_file_import()
         self.check_activities_fields([Activities.start_time, Activities.stop_time, Activities.elapsed_time])
 
+    @unittest.skipIf(not do_records_benchmark_tests, "Skipping records benchmark test")
+    def test_fit_file_records_benchmark(self):
+        ActivitiesDb.delete_db(self.test_db_params)
+        record_counts = []
+        for import_pass in ['initial', 'repeat']:
+            self.profile_function(f'fit_activities_records_{import_pass}', self.__fit_file_import)
+            record_counts.append(ActivityRecords.row_count(ActivitiesDb(self.test_db_params)))
+        if self.gfd_file_count > 0:
+            self.assertGreater(record_counts[0], 0)
+        # importing the same files again should not add records
+        self.assertEqual(record_counts[0], record_counts[1])
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,119 @@
+"""Test downloading against a local replay of Garmin Connect."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import unittest
+import logging
+import os
+import json
+import datetime
+import tempfile
+import zipfile
+
+import requests
+
+from garmindb import ReplayServer, ReplayData, DownloadBenchmark, Download, GarminConnectConfigManager, ImportPipeline, PluginManager
+from garmindb.garmindb import GarminDb, Attributes, DownloadLedger, RestingHeartRate, MonitoringDb, Monitoring
+
+import fit_file_writer
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('download.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestDownload(unittest.TestCase):
+    """Class for testing downloading."""
+
+    def test_replay_server(self):
+        with ReplayServer(throttle_every=2, retry_after=3) as replay_server:
+            response = requests.get(f'{replay_server.url}/weight-service/weight/dateRange', params={'startDate': '2023-01-01', 'endDate': '2023-01-07'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['dateWeightList']), 7)
+            response = requests.get(f'{replay_server.url}/wellness-service/wellness/dailySleepData/replay', params={'date': '2023-01-01'})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers['Retry-After'], '3')
+            response = requests.get(f'{replay_server.url}/unknown-service')
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(replay_server.requests, 3)
+        self.assertEqual(replay_server.throttled, 1)
+
+    def test_download_benchmark(self):
+        days = 5
+        activities = 3
+        results = DownloadBenchmark(days, activities, latency=0.0, throttle_every=10, retry_after=0).run()
+        # A file per day for each of six stats and a FIT file and two JSON files per activity, despite the throttled requests being retried.
+        self.assertEqual(results['files'], days * 6 + activities * 3)
+        self.assertGreater(results['throttled'], 0)
+        self.assertGreater(results['requests_per_second'], 0)
+
+    def test_corrupt_monitoring_zip_is_downloaded_again(self):
+        good_day = datetime.datetime.now().date() - datetime.timedelta(days=10)
+        corrupt_day = good_day + datetime.timedelta(days=1)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fixtures_dir = os.path.join(temp_dir, 'fixtures')
+            os.makedirs(fixtures_dir)
+            # a zip that was cut off during the download
+            with open(os.path.join(fixtures_dir, f'wellness_{corrupt_day}.zip'), 'wb') as file:
+                file.write(ReplayData().wellness_zip(str(corrupt_day))[:100])
+            with ReplayServer(ReplayData(fixtures_dir)) as replay_server:
+                config = {
+                    'db': {'type': 'sqlite'},
+                    'garmin': {'replay_url': replay_server.url},
+                    'directories': {'relative_to_home': False, 'base_dir': os.path.join(temp_dir, 'HealthData')},
+                    'download': {'backoff_seconds': 0.1},
+                }
+                with open(os.path.join(temp_dir, 'GarminConnectConfig.json'), 'w') as file:
+                    json.dump(config, file)
+                gc_config = GarminConnectConfigManager(temp_dir)
+                download = Download(gc_config)
+                download.login()
+                download.get_monitoring(gc_config.get_monitoring_dir, good_day, 2)
+                download.executor.shutdown()
+            with GarminDb(gc_config.get_db_params()).managed_session() as session:
+                self.assertEqual(DownloadLedger.s_complete_days(session, 'monitoring', good_day, corrupt_day), {good_day})
+
+    def test_download_with_import_pipeline(self):
+        days = 3
+        first_day = datetime.datetime.now().date() - datetime.timedelta(days=days - 1)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fixtures_dir = os.path.join(temp_dir, 'fixtures')
+            os.makedirs(fixtures_dir)
+            # the monitoring of the first day is a FIT file the import can decode, the other generated FIT files fail to import
+            fit_file_name = os.path.join(temp_dir, 'monitoring.fit')
+            fit_file_writer.write_monitoring_file(fit_file_name, datetime.datetime.combine(first_day, datetime.time(), datetime.timezone.utc), entries=10)
+            with zipfile.ZipFile(os.path.join(fixtures_dir, f'wellness_{first_day}.zip'), 'w') as files_zip:
+                files_zip.write(fit_file_name, f'{first_day.strftime("%Y%m%d")}_WELLNESS.fit')
+            with ReplayServer(ReplayData(fixtures_dir, fit_file_size=1024)) as replay_server:
+                config = {
+                    'db': {'type': 'sqlite'},
+                    'garmin': {'replay_url': replay_server.url},
+                    'directories': {'relative_to_home': False, 'base_dir': os.path.join(temp_dir, 'HealthData')},
+                    'download': {'backoff_seconds': 0.1, 'requests_per_second': 50.0, 'burst': 10},
+                }
+                with open(os.path.join(temp_dir, 'GarminConnectConfig.json'), 'w') as file:
+                    json.dump(config, file)
+                gc_config = GarminConnectConfigManager(temp_dir)
+                db_params = gc_config.get_db_params()
+                Attributes.set(GarminDb(db_params), 'measurement_system', 'metric')
+                download = Download(gc_config)
+                download.login()
+                pipeline = ImportPipeline(ImportPipeline.default_routes(gc_config, PluginManager(gc_config.get_plugins_dir(), db_params)), batch_size=2)
+                with pipeline.run(download):
+                    download.download_stats(first_day, days, 2)
+                download.executor.shutdown()
+            # the activities add the days they were recorded on
+            self.assertLessEqual({first_day + datetime.timedelta(days=day) for day in range(days)}, pipeline.affected_days)
+            self.assertEqual(dict(pipeline.failed), {})
+            self.assertEqual(len(RestingHeartRate.get_days(GarminDb(db_params), first_day.year)), days)
+            self.assertEqual(Monitoring.row_count(MonitoringDb(db_params)), 10)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
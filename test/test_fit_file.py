@@ -8,10 +8,16 @@ import unittest
 import logging
 import datetime
 import re
+import os
+import tempfile
 
 import fitfile
 from idbutils import FileProcessor
 
+from garmindb.fit_data import StreamingFitFile, DecodedFitFile
+
+import fit_file_writer
+
 
 root_logger = logging.getLogger()
 handler = logging.FileHandler('fit_file.log', 'w')
@@ -260,6 +266,25 @@ class TestFitFile(unittest.TestCase):
         else:
             logger.error("Add test files to %s", activity_path)
 
+    def test_streaming_fit_file(self):
+        start = datetime.datetime(2023, 1, 1, 8, 0, 0, tzinfo=datetime.timezone.utc)
+        self.assertTrue(StreamingFitFile.supported())
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_names = [os.path.join(temp_dir, 'monitoring.fit'), os.path.join(temp_dir, 'activity.fit')]
+            fit_file_writer.write_monitoring_file(file_names[0], start, entries=50)
+            fit_file_writer.write_activity_file(file_names[1], start, records=50)
+            for file_name in file_names:
+                fit_file = fitfile.file.File(file_name, self.measurement_system)
+                # a file that fits in a chunk is decoded once, bigger files are decoded again in chunks
+                for chunk_size in (1000, 7):
+                    streaming_fit_file = StreamingFitFile(file_name, self.measurement_system, chunk_size)
+                    for attribute in DecodedFitFile.summary_attributes:
+                        self.assertEqual(getattr(streaming_fit_file, attribute), getattr(fit_file, attribute), f'{file_name} {chunk_size} {attribute}')
+                    chunks = list(streaming_fit_file.message_chunks())
+                    self.assertEqual(len(chunks), -(-len(fit_file.messages) // chunk_size))
+                    self.assertEqual([(message.type, message.fields) for chunk in chunks for message in chunk],
+                                     [(message.type, message.fields) for message in fit_file.messages])
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -6,12 +6,28 @@ __license__ = "GPL"
 
 import unittest
 import logging
+import datetime
+import os
+import json
+import tempfile
+import sqlite3
+import shutil
+import collections
 # from sqlalchemy.exc import LookupError
 
 import fitfile
+from idbutils import DbParams, FileProcessor
+import sqlalchemy
+from sqlalchemy import select
 
-from garmindb import GarminConnectConfigManager
-from garmindb.garmindb import GarminDb, File, Attributes
+from garmindb import GarminConnectConfigManager, Analyze, ImportTransaction, ImportProfiler, ImportRegistry, GarminWeightData, ImportPipeline, ImportRoute, \
+    JsonArchive, MonitoringFitFileProcessor, FileLedger, FitImport, PluginManager
+from garmindb.analyze import _read_only_session
+from garmindb.garmindb import GarminDb, File, Attributes, Device, Stress, Weight, BulkUpsert, s_insert_or_ignore, ImportLedger, \
+    DownloadLedger, DirtyDays, Sleep, RestingHeartRate, DailySummary, MonitoringDb, Monitoring, MonitoringHeartRate, MonitoringIntensity, \
+    MonitoringClimb, GarminSummaryDb, IntensityHR, ActivitiesDb, Activities, DaysSummary, WeeksSummary, MonthsSummary, YearsSummary
+
+import fit_file_writer
 
 
 root_logger = logging.getLogger()
@@ -22,6 +38,38 @@ root_logger.setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+class TempDbConfigManager(GarminConnectConfigManager):
+    """A configuration with the databases in a temporary directory."""
+
+    def __init__(self, db_params):
+        super().__init__()
+        self.db_params = db_params
+
+    def get_db_params(self, test_db=False):
+        return self.db_params
+
+
+class FilePluginManager():
+    """A plugin manager that matches the plugins listed for each file name."""
+
+    def __init__(self, file_plugins):
+        self.file_plugins = file_plugins
+
+    def get_file_processors(self, file_type, fit_file):
+        return {plugin_name: plugin for plugin_name, plugin in self.file_plugins[fit_file.filename].items()}
+
+
+class EmptyFitFile(collections.defaultdict):
+    """A FIT file without messages."""
+
+    def __init__(self, filename):
+        super().__init__(list)
+        self.filename = filename
+        self.time_created_local = None
+        self.type = None
+        self.message_types = []
+
+
 class TestGarminDbObjects(unittest.TestCase):
     """Class for testing Garmin database data."""
 
@@ -122,6 +170,594 @@ class TestGarminDbObjects(unittest.TestCase):
             result = Attributes.measurements_type(self.garmin_db)
             self.assertEqual(result, value)
 
+    def test_bulk_upsert_merges_like_insert_or_update(self):
+        serial_number = 123456789
+        with self.garmin_db.managed_session() as session:
+            upsert = BulkUpsert(session, Device)
+            upsert.add({'serial_number': serial_number, 'device_type': 'fitness_tracker', 'product': 'vivoactive'})
+            upsert.add({'serial_number': serial_number, 'product': None, 'hardware_version': '1'})
+            self.assertEqual(len(upsert), 1)
+            self.assertEqual(upsert.flush(), 1)
+        device = Device.get(self.garmin_db, serial_number)
+        self.assertEqual((device.device_type, device.product, device.hardware_version), ('fitness_tracker', 'vivoactive', '1'))
+        with self.garmin_db.managed_session() as session:
+            upsert = BulkUpsert(session, Device)
+            upsert.add({'serial_number': serial_number, 'product': 'fenix', 'hardware_version': None})
+            upsert.flush()
+        device = Device.get(self.garmin_db, serial_number)
+        self.assertEqual((device.device_type, device.product, device.hardware_version), ('fitness_tracker', 'fenix', '1'))
+
+    def test_insert_or_ignore(self):
+        timestamp = datetime.datetime(1990, 1, 1, 12, 0, 0)
+        rows = [{'timestamp': timestamp + datetime.timedelta(minutes=minute), 'stress': minute} for minute in range(3)]
+        with self.garmin_db.managed_session() as session:
+            s_insert_or_ignore(session, Stress, rows)
+        with self.garmin_db.managed_session() as session:
+            s_insert_or_ignore(session, Stress, [{'timestamp': timestamp, 'stress': 99}])
+        self.assertEqual(Stress.get(self.garmin_db, timestamp).stress, 0)
+        self.assertEqual(Stress.get(self.garmin_db, rows[2]['timestamp']).stress, 2)
+
+    def test_import_ledger(self):
+        importer = 'TestImporter'
+        db_generation = ImportLedger.get_db_generation(self.garmin_db)
+        self.assertEqual(db_generation, ImportLedger.get_db_generation(self.garmin_db))
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as file:
+            file.write('{"steps": 1000}')
+        try:
+            with self.garmin_db.managed_session() as session:
+                self.assertFalse(ImportLedger.s_unchanged(session, importer, file.name, db_generation))
+                ImportLedger.s_record(session, importer, file.name, ImportLedger.Outcome.imported, db_generation)
+            with self.garmin_db.managed_session() as session:
+                self.assertTrue(ImportLedger.s_unchanged(session, importer, file.name, db_generation))
+                self.assertFalse(ImportLedger.s_unchanged(session, 'OtherImporter', file.name, db_generation))
+                self.assertFalse(ImportLedger.s_unchanged(session, importer, file.name, 'recreated_db'))
+            # touched but the contents are the same
+            stat = os.stat(file.name)
+            os.utime(file.name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+            with self.garmin_db.managed_session() as session:
+                self.assertTrue(ImportLedger.s_unchanged(session, importer, file.name, db_generation))
+            with open(file.name, 'w') as changed_file:
+                changed_file.write('{"steps": 2000}')
+            with self.garmin_db.managed_session() as session:
+                self.assertFalse(ImportLedger.s_unchanged(session, importer, file.name, db_generation))
+                ImportLedger.s_record(session, importer, file.name, ImportLedger.Outcome.failed, db_generation)
+            with self.garmin_db.managed_session() as session:
+                self.assertFalse(ImportLedger.s_unchanged(session, importer, file.name, db_generation))
+        finally:
+            os.remove(file.name)
+
+    def test_file_ledger(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_params = DbParams(db_type='sqlite', db_path=temp_dir)
+            file_names = []
+            for index in range(3):
+                file_names.append(os.path.join(temp_dir, f'{index}.json'))
+                with open(file_names[-1], 'w') as file:
+                    file.write(f'{{"steps": {index}}}')
+            hashed = []
+
+            def content_hash(file_name):
+                hashed.append(file_name)
+                return ImportLedger.content_hash(file_name)
+            ledger = FileLedger(db_params, 'TestImporter', GarminDb(db_params), hash_func=content_hash)
+            self.assertEqual(ledger.changed_files(file_names), file_names)
+            for file_name in file_names:
+                ledger.record(file_name, ImportLedger.Outcome.imported)
+            # nothing is written until the outcomes are flushed
+            self.assertEqual(FileLedger(db_params, 'TestImporter', GarminDb(db_params)).changed_files(file_names), file_names)
+            ledger.flush()
+            # each file is hashed once, when it is checked
+            self.assertEqual(hashed, file_names)
+            self.assertEqual(FileLedger(db_params, 'TestImporter', GarminDb(db_params)).changed_files(file_names), [])
+
+    def test_download_ledger(self):
+        stat = 'test_stat'
+        day = datetime.date(1995, 1, 1)
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as file:
+            file.write('{"steps": 1000}')
+        try:
+            with self.garmin_db.managed_session() as session:
+                DownloadLedger.s_record(session, stat, day, file.name, DownloadLedger.payload_hash(b'{"steps": 1000}'), True)
+                DownloadLedger.s_record(session, stat, day + datetime.timedelta(days=1), file.name, None, False)
+                DownloadLedger.s_record(session, stat, day + datetime.timedelta(days=2), None, None, True)
+            with self.garmin_db.managed_session() as session:
+                self.assertEqual(DownloadLedger.s_complete_days(session, stat, day, day + datetime.timedelta(days=2)), {day, day + datetime.timedelta(days=2)})
+                self.assertEqual(DownloadLedger.s_complete_days(session, 'other_stat', day, day + datetime.timedelta(days=2)), set())
+        finally:
+            os.remove(file.name)
+        # days whose file is gone need to be downloaded again
+        with self.garmin_db.managed_session() as session:
+            self.assertEqual(DownloadLedger.s_complete_days(session, stat, day, day + datetime.timedelta(days=2)), {day + datetime.timedelta(days=2)})
+
+    def test_import_transaction_isolates_failing_file(self):
+        timestamp = datetime.datetime(1991, 1, 1, 12, 0, 0)
+        committed = []
+        transaction = ImportTransaction(commit_files=3)
+        try:
+            for minute in range(3):
+                try:
+                    with transaction.file([self.garmin_db]) as (session,):
+                        s_insert_or_ignore(session, Stress, [{'timestamp': timestamp + datetime.timedelta(minutes=minute), 'stress': minute}])
+                        if minute == 1:
+                            raise ValueError('bad file')
+                    transaction.after_commit(lambda minute=minute: committed.append(minute))
+                except ValueError:
+                    pass
+                self.assertEqual(committed, [])
+            transaction.commit()
+        finally:
+            transaction.close()
+        self.assertEqual(committed, [0, 2])
+        self.assertEqual(Stress.get(self.garmin_db, timestamp).stress, 0)
+        self.assertIsNone(Stress.get(self.garmin_db, timestamp + datetime.timedelta(minutes=1)))
+        self.assertEqual(Stress.get(self.garmin_db, timestamp + datetime.timedelta(minutes=2)).stress, 2)
+
+    def test_import_transaction_commits_in_batches(self):
+        timestamp = datetime.datetime(1991, 2, 1, 12, 0, 0)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            garmin_db = GarminDb(DbParams(db_type='sqlite', db_path=temp_dir))
+            # a separate connection only sees what has been committed
+            connection = sqlite3.connect(os.path.join(temp_dir, 'garmin.db'))
+            try:
+                def committed_rows():
+                    return connection.execute('SELECT COUNT(*) FROM stress').fetchone()[0]
+                for commit in (False, True):
+                    transaction = ImportTransaction(commit_files=100)
+                    try:
+                        for minute in range(2):
+                            with transaction.file([garmin_db]) as (session,):
+                                s_insert_or_ignore(session, Stress, [{'timestamp': timestamp + datetime.timedelta(minutes=minute), 'stress': minute}])
+                            self.assertEqual(committed_rows(), 0)
+                        if commit:
+                            transaction.commit()
+                    finally:
+                        transaction.close()
+                    # closing the transaction discards the uncommitted batch
+                    self.assertEqual(committed_rows(), 2 if commit else 0)
+            finally:
+                connection.close()
+
+    def test_monitoring_processor_reopens_db_for_new_plugins(self):
+        plugin = object()
+        file_plugins = {'1.fit': {}, '2.fit': {'plugin': plugin}, '3.fit': {'plugin': plugin}, '4.fit': {}}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_params = DbParams(db_type='sqlite', db_path=temp_dir)
+            processor = MonitoringFitFileProcessor(db_params, FilePluginManager(file_plugins), commit_files=100)
+            garmin_mon_dbs = []
+            commits = []
+            with processor.import_run() as transaction:
+                for file_name in file_plugins:
+                    processor.write_file(EmptyFitFile(file_name))
+                    garmin_mon_dbs.append(processor.garmin_mon_db)
+                    commits.append(transaction.commits)
+        # only the first file with the plugin needs a db that creates the plugin's tables, and the batch is committed before it is created
+        self.assertIsNot(garmin_mon_dbs[1], garmin_mon_dbs[0])
+        self.assertEqual(garmin_mon_dbs[1:], [garmin_mon_dbs[1]] * 3)
+        self.assertEqual(commits, [1, 2, 2, 2])
+
+    def test_import_transaction_marks_dirty_days(self):
+        timestamp = datetime.datetime(1998, 1, 1, 12, 0, 0)
+        with self.garmin_db.managed_session() as session:
+            DirtyDays.s_clear(session)
+        transaction = ImportTransaction(commit_files=10)
+        try:
+            for day in range(3):
+                try:
+                    with transaction.file([self.garmin_db]) as (session,):
+                        Stress.s_insert_or_update(session, {'timestamp': timestamp + datetime.timedelta(days=day), 'stress': day})
+                        Weight.s_insert_or_update(session, {'day': timestamp.date() + datetime.timedelta(days=day), 'weight': 100.0})
+                        if day == 1:
+                            raise ValueError('bad file')
+                except ValueError:
+                    pass
+            # days are only marked when their data is committed
+            self.assertEqual(DirtyDays.get_days(self.garmin_db), [])
+            transaction.commit()
+        finally:
+            transaction.close()
+        self.assertEqual(DirtyDays.get_days(self.garmin_db), [timestamp.date(), timestamp.date() + datetime.timedelta(days=2)])
+        # rewriting a row marks its day again, rows written by other sessions are not the import's
+        with self.garmin_db.managed_session() as session:
+            DirtyDays.s_clear(session)
+        transaction = ImportTransaction(commit_files=10)
+        try:
+            with transaction.file([self.garmin_db]) as (session,):
+                with self.garmin_db.managed_session() as other_session:
+                    Stress.s_insert_or_update(other_session, {'timestamp': timestamp + datetime.timedelta(days=5), 'stress': 5})
+                Stress.s_insert_or_update(session, {'timestamp': timestamp + datetime.timedelta(days=2), 'stress': 50})
+            self.assertEqual(transaction.rows, 1)
+            transaction.commit()
+        finally:
+            transaction.close()
+        self.assertEqual(DirtyDays.get_days(self.garmin_db), [timestamp.date() + datetime.timedelta(days=2)])
+        with self.garmin_db.managed_session() as session:
+            DirtyDays.s_clear(session)
+
+    def test_import_profiler(self):
+        timestamp = datetime.datetime(1992, 1, 1, 12, 0, 0)
+        profiler = ImportProfiler(slowest=1)
+        profiler.attach(self.garmin_db.engine)
+        try:
+            with profiler.file('stress.fit'):
+                with profiler.stage('write'), self.garmin_db.managed_session() as session:
+                    s_insert_or_ignore(session, Stress, [{'timestamp': timestamp + datetime.timedelta(minutes=minute), 'stress': minute} for minute in range(3)])
+        finally:
+            profiler.detach()
+        report = profiler.report()
+        self.assertEqual(report['files'], 1)
+        self.assertEqual(report['slowest_files'][0]['file'], 'stress.fit')
+        self.assertGreaterEqual(report['totals']['statements'], 1)
+        self.assertIn('write', report['totals']['stages'])
+
+    def test_import_registry_rollback(self):
+        serial_number = 1993010112
+        device = {'serial_number': serial_number, 'timestamp': datetime.datetime(1993, 1, 1, 12, 0, 0), 'product': 'test_product'}
+        with self.garmin_db.managed_session() as session:
+            registry = ImportRegistry(session)
+            registry.begin_file()
+            savepoint = session.begin_nested()
+            registry.s_insert_or_update_device(session, device)
+            self.assertEqual(registry.devices[serial_number]['product'], 'test_product')
+            savepoint.rollback()
+            registry.rollback_file()
+            self.assertNotIn(serial_number, registry.devices)
+            registry.begin_file()
+            registry.s_insert_or_update_device(session, device)
+        self.assertEqual(Device.get(self.garmin_db, serial_number).product, 'test_product')
+        with self.garmin_db.managed_session() as session:
+            registry = ImportRegistry(session)
+            self.assertEqual(registry.devices[serial_number]['product'], 'test_product')
+            registry.begin_file()
+            registry.s_insert_or_update_device(session, device)
+            self.assertEqual(registry.undo_log, [])
+
+    def test_json_import_shares_session(self):
+        day = datetime.date(1994, 1, 1)
+        with tempfile.TemporaryDirectory() as input_dir:
+            for offset, weight in enumerate([70000, None, 71000]):
+                date = day + datetime.timedelta(days=offset)
+                with open(os.path.join(input_dir, f'weight_{date}.json'), 'w') as file:
+                    json.dump({'startDate': f'{date}T00:00:00.0', 'dateWeightList': [{'weight': weight}] if weight else [{}]}, file)
+            weight_data = GarminWeightData(GarminConnectConfigManager().get_db_params(test_db=True), input_dir, False, fitfile.field_enums.DisplayMeasure.metric, 0)
+            weight_data.process(commit_files=2)
+        self.assertEqual(weight_data.total_updates, 2)
+        self.assertEqual(Weight.get(self.garmin_db, day).weight, 70.0)
+        self.assertIsNone(Weight.get(self.garmin_db, day + datetime.timedelta(days=1)))
+        self.assertEqual(Weight.get(self.garmin_db, day + datetime.timedelta(days=2)).weight, 71.0)
+
+    def test_import_pipeline(self):
+        db_params = GarminConnectConfigManager().get_db_params(test_db=True)
+        day = datetime.date(1996, 1, 1)
+        imported = []
+
+        def import_weight_files(file_names):
+            imported.append(len(file_names))
+            weight_data = GarminWeightData(db_params, None, False, fitfile.field_enums.DisplayMeasure.metric, 0)
+            weight_data.file_names = file_names
+            weight_data.process()
+
+        pipeline = ImportPipeline([ImportRoute('weight', r'weight_\d{4}-\d{2}-\d{2}\.json', import_weight_files)], queue_size=2, batch_size=2)
+        with tempfile.TemporaryDirectory() as input_dir:
+            with pipeline.run():
+                for offset in range(3):
+                    date = day + datetime.timedelta(days=offset)
+                    file_name = os.path.join(input_dir, f'weight_{date}.json')
+                    with open(file_name, 'w') as file:
+                        json.dump({'startDate': f'{date}T00:00:00.0', 'dateWeightList': [{'weight': 70000 + offset * 1000}]}, file)
+                    pipeline.files_saved('weight', date, [file_name])
+                pipeline.files_saved('sleep', day, [os.path.join(input_dir, f'sleep_{day}.json')])
+        self.assertEqual(sum(imported), 3)
+        self.assertEqual(pipeline.imported['weight'], 3)
+        self.assertEqual(pipeline.affected_days, {day + datetime.timedelta(days=offset) for offset in range(3)})
+        self.assertEqual(Weight.get(self.garmin_db, day + datetime.timedelta(days=2)).weight, 72.0)
+
+    def test_json_archive(self):
+        db_params = GarminConnectConfigManager().get_db_params(test_db=True)
+        day = datetime.date(1997, 1, 1)
+        with tempfile.TemporaryDirectory() as input_dir:
+            for offset in range(3):
+                date = day + datetime.timedelta(days=offset)
+                with open(os.path.join(input_dir, f'weight_{date}.json'), 'w') as file:
+                    json.dump({'startDate': f'{date}T00:00:00.0', 'dateWeightList': [{'weight': 70000 + offset * 1000}]}, file)
+            GarminWeightData(db_params, input_dir, False, fitfile.field_enums.DisplayMeasure.metric, 0).process()
+            self.assertEqual(JsonArchive.migrate(input_dir), 3)
+            self.assertEqual(os.listdir(input_dir).count(JsonArchive.archive_name), 1)
+            self.assertFalse(any(file_name.endswith('.json') for file_name in os.listdir(input_dir)))
+            # The migrated files are found in the archive and the import ledger still knows they were imported.
+            weight_data = GarminWeightData(db_params, input_dir, False, fitfile.field_enums.DisplayMeasure.metric, 0)
+            self.assertEqual(weight_data.file_count(), 3)
+            weight_data.process()
+            self.assertEqual(weight_data.total_updates, 0)
+            # A file saved to the archive is read transparently and imported because it changed.
+            file_name = os.path.join(input_dir, f'weight_{day}.json')
+            JsonArchive.save_file(file_name, json.dumps({'startDate': f'{day}T00:00:00.0', 'dateWeightList': [{'weight': 69000}]}))
+            self.assertTrue(JsonArchive.isfile(file_name))
+            self.assertEqual(json.loads(JsonArchive.read_file(file_name))['dateWeightList'][0]['weight'], 69000)
+            weight_data = GarminWeightData(db_params, input_dir, False, fitfile.field_enums.DisplayMeasure.metric, 0)
+            weight_data.process()
+            self.assertEqual(weight_data.total_updates, 1)
+        self.assertEqual(Weight.get(self.garmin_db, day).weight, 69.0)
+        self.assertEqual(Weight.get(self.garmin_db, day + datetime.timedelta(days=2)).weight, 72.0)
+
+
+class TestSummaryCalculation(unittest.TestCase):
+    """Class for testing calculating summaries on databases in a temporary directory."""
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        db_params = DbParams(db_type='sqlite', db_path=temp_dir.name)
+        self.gc_config = TempDbConfigManager(db_params)
+        self.garmin_db = GarminDb(db_params)
+        Attributes.set(self.garmin_db, 'measurement_system', 'metric')
+        self.monitoring_db = MonitoringDb(db_params)
+        self.summary_db = GarminSummaryDb(db_params)
+        self.activities_db = ActivitiesDb(db_params)
+
+    def test_read_only_session_leaves_pool_writable(self):
+        # with more than one idle connection in the pool, a session can check out a different connection each time it runs a statement
+        connections = [self.summary_db.engine.connect() for _ in range(2)]
+        for connection in connections:
+            connection.close()
+        with _read_only_session(self.summary_db) as session:
+            self.assertEqual(session.query(DaysSummary).count(), 0)
+            with self.assertRaises(sqlalchemy.exc.OperationalError):
+                session.execute(DaysSummary.__table__.insert().values(day=datetime.date(2021, 1, 1)))
+        for offset in range(4):
+            DaysSummary.insert_or_update(self.summary_db, {'day': datetime.date(2021, 1, 1) + datetime.timedelta(days=offset), 'steps': offset})
+        self.assertEqual(DaysSummary.row_count(self.summary_db), 4)
+
+    def test_stats_by_day_match_daily_stats(self):
+        day = datetime.date(2020, 2, 28)
+        days = [day + datetime.timedelta(days=offset) for offset in range(4)]
+        timestamps = [datetime.datetime.combine(day, datetime.time(hour)) for day in days[:3] for hour in (1, 12, 23)]
+        DailySummary.insert_or_update(self.garmin_db, {'day': days[0], 'rhr': 50, 'steps': 1000, 'floors_up': 3.0, 'moderate_activity_time': datetime.time(0, 20),
+                                                       'vigorous_activity_time': datetime.time(0, 10), 'intensity_time_goal': datetime.time(2, 30), 'calories_total': 2000})
+        DailySummary.insert_or_update(self.garmin_db, {'day': days[2], 'stress_avg': 30, 'intensity_time_goal': datetime.time(2, 31)})
+        for index, day in enumerate(days[:3]):
+            RestingHeartRate.insert_or_update(self.garmin_db, {'day': day, 'resting_heart_rate': 55.0 - 55 * (index % 2)})
+            Weight.insert_or_update(self.garmin_db, {'day': day, 'weight': 80.5 * (index % 2)})
+            Sleep.insert_or_update(self.garmin_db, {'day': day, 'total_sleep': datetime.time(7 * index, 25 * index), 'rem_sleep': datetime.time(index)})
+        for index, timestamp in enumerate(timestamps):
+            Stress.insert_or_update(self.garmin_db, {'timestamp': timestamp, 'stress': index % 4 - 1})
+            MonitoringHeartRate.insert_or_update(self.monitoring_db, {'timestamp': timestamp, 'heart_rate': (index % 3) * 40})
+            MonitoringIntensity.insert_or_update(self.monitoring_db, {'timestamp': timestamp, 'moderate_activity_time': datetime.time(0, index % 3),
+                                                                      'vigorous_activity_time': datetime.time(0, index % 2)})
+            MonitoringClimb.insert_or_update(self.monitoring_db, {'timestamp': timestamp, 'cum_ascent': 10.0 * index})
+            for activity_type in (fitfile.field_enums.ActivityType.walking, fitfile.field_enums.ActivityType.running):
+                Monitoring.insert_or_update(self.monitoring_db, {'timestamp': timestamp, 'activity_type': activity_type, 'steps': 100 * index + activity_type.value,
+                                                                 'active_calories': 10 * index + activity_type.value})
+            IntensityHR.insert_or_update(self.summary_db, {'timestamp': timestamp, 'intensity': index % 2, 'heart_rate': (index % 3) * 50})
+            Activities.insert_or_update(self.activities_db, {'activity_id': str(index), 'start_time': timestamp, 'calories': index, 'distance': 1.5 * index})
+        end_ts = days[-1] + datetime.timedelta(1)
+        with self.garmin_db.managed_session() as garmin_session, self.monitoring_db.managed_session() as monitoring_session, \
+                self.summary_db.managed_session() as summary_session, self.activities_db.managed_session() as activities_session:
+            measurement_system = fitfile.field_enums.DisplayMeasure.metric
+            tables = [
+                (garmin_session, Weight, (), ()), (garmin_session, Stress, (), ()), (garmin_session, Sleep, (), ()), (garmin_session, RestingHeartRate, (), ()),
+                (garmin_session, DailySummary, (), ()), (monitoring_session, MonitoringHeartRate, (), ()), (monitoring_session, MonitoringIntensity, (), ()),
+                (monitoring_session, MonitoringClimb, (measurement_system,), (measurement_system,)), (monitoring_session, Monitoring, (), ()),
+                (summary_session, IntensityHR, (), ()), (activities_session, Activities, (), ())
+            ]
+            for session, table, daily_args, by_day_args in tables:
+                stats_by_day = table.s_get_stats_by_day(session, days[0], end_ts, *by_day_args)
+                for day in days:
+                    if table is DailySummary:
+                        # get_daily_stats divides the weekly intensity time goal in SQL that subtracts before it divides
+                        stats = table.get_stats(session, day, day + datetime.timedelta(1))
+                        stats['intensity_time_goal'] = fitfile.conversions.secs_to_dt_time(int(fitfile.conversions.time_to_secs(stats['intensity_time_goal']) / 7))
+                    else:
+                        stats = table.get_daily_stats(session, day, *daily_args)
+                        del stats['day']
+                    self.assertEqual(stats_by_day[day], stats, f'{table.__name__} {day}')
+            self.assertEqual(DailySummary.s_get_stats_by_day(garmin_session, days[0], end_ts)[days[0]]['intensity_time_goal'], datetime.time(0, 21, 25))
+
+    def __summaries(self, tables=[]):
+        with self.summary_db.managed_session() as session:
+            summaries = {}
+            for table in tables + [WeeksSummary, MonthsSummary, YearsSummary]:
+                (key_col,) = table.__table__.primary_key.columns
+                summaries[table] = {getattr(row, key_col.name): {col.name: getattr(row, col.name) for col in table.__table__.columns} for row in session.query(table)}
+                session.query(table).delete()
+            return summaries
+
+    def test_rollup_matches_summary(self):
+        # January has no daily summary values that take precedence over the raw data, February has them for some days. The yearly summaries compare
+        # day columns to midnight, which misses January 1st and moves the weeks of the intensity time goal by a day. The monthly summaries miss the
+        # last day of the month.
+        january_days = [datetime.date(2021, 1, 2) + datetime.timedelta(days=offset) for offset in range(20)]
+        february_days = [datetime.date(2021, 2, 1) + datetime.timedelta(days=offset) for offset in range(10)]
+        with self.garmin_db.managed_session() as garmin_session, self.monitoring_db.managed_session() as monitoring_session, \
+                self.activities_db.managed_session() as activities_session:
+            for index, day in enumerate(january_days + february_days):
+                daily_summary = {'day': day, 'step_goal': 5000 + index, 'calories_total': 2000 + index, 'calories_bmr': 1500,
+                                 'moderate_activity_time': datetime.time(0, index % 5),
+                                 'vigorous_activity_time': datetime.time(0, index % 3), 'intensity_time_goal': datetime.time(2, 20 + 7 * (index % 3)),
+                                 'spo2_avg': 95.0 + index % 4, 'rr_waking_avg': 14.0 + index % 3}
+                if day in february_days[1:3] + february_days[8:]:
+                    daily_summary.update({'rhr': 50 + index % 4, 'stress_avg': 20 + index, 'steps': 6000 + 3 * index, 'floors_up': 1.0 + index % 2,
+                                          'calories_active': 30 * index})
+                if index % 4:
+                    DailySummary.s_insert_or_update(garmin_session, daily_summary)
+                RestingHeartRate.s_insert_or_update(garmin_session, {'day': day, 'resting_heart_rate': 55.0 + index % 6})
+                if index % 3 == 0:
+                    Weight.s_insert_or_update(garmin_session, {'day': day, 'weight': 80.0 + index % 5})
+                Sleep.s_insert_or_update(garmin_session, {'day': day, 'total_sleep': datetime.time(6 + index % 3, 2 * index), 'rem_sleep': datetime.time(1, index)})
+                # days have different numbers of samples so that the averages of days with more samples weigh more
+                samples = 2 + index % 5
+                timestamps = [datetime.datetime.combine(day, datetime.time(hour)) for hour in range(6, 6 + samples)]
+                s_insert_or_ignore(garmin_session, Stress, [{'timestamp': timestamp, 'stress': 10 * index + 7 * hour} for hour, timestamp in enumerate(timestamps)])
+                s_insert_or_ignore(monitoring_session, MonitoringHeartRate, [
+                    {'timestamp': timestamp + datetime.timedelta(seconds=30), 'heart_rate': 60 + index + 11 * hour} for hour, timestamp in enumerate(timestamps)
+                ])
+                s_insert_or_ignore(monitoring_session, Monitoring, [
+                    {'timestamp': timestamp, 'activity_type': fitfile.field_enums.ActivityType.walking, 'intensity': hour % 2, 'steps': 1000 * hour + index,
+                     'active_calories': 20 * hour + index}
+                    for hour, timestamp in enumerate(timestamps + [timestamps[-1] + datetime.timedelta(hours=1)])
+                ])
+                s_insert_or_ignore(monitoring_session, MonitoringClimb, [
+                    {'timestamp': timestamp, 'cum_ascent': 3.0 * hour + index} for hour, timestamp in enumerate(timestamps)
+                ])
+                if index % 4 == 1:
+                    Activities.s_insert_or_update(activities_session, {'activity_id': str(index), 'start_time': timestamps[0], 'calories': 100 + index,
+                                                                       'distance': 2.5 * index})
+        Analyze(self.gc_config, 0).summary(full=True)
+        summaries = self.__summaries()
+        Analyze(self.gc_config, 0, rollup=True).summary(full=True)
+        rollups = self.__summaries()
+        # The monthly and yearly summaries take intensity times from the monitoring data and always take the raw values over the daily summary.
+        intensity_cols = ['intensity_time', 'moderate_activity_time', 'vigorous_activity_time']
+        daily_summary_cols = ['rhr_avg', 'rhr_min', 'rhr_max', 'stress_avg', 'steps', 'floors', 'calories_active_avg']
+        skipped_cols = {
+            WeeksSummary: {},
+            MonthsSummary: {datetime.date(2021, 1, 1): intensity_cols, datetime.date(2021, 2, 1): intensity_cols + daily_summary_cols},
+            YearsSummary: {datetime.date(2021, 1, 1): intensity_cols + daily_summary_cols + ['intensity_time_goal']},
+        }
+        for table, table_summaries in summaries.items():
+            self.assertEqual(sorted(rollups[table]), sorted(table_summaries), table.__name__)
+            for first_day, summary in table_summaries.items():
+                for col_name, value in summary.items():
+                    if col_name in skipped_cols[table].get(first_day, []):
+                        continue
+                    message = f'{table.__name__} {first_day} {col_name}'
+                    if isinstance(value, float):
+                        self.assertAlmostEqual(rollups[table][first_day][col_name], value, msg=message)
+                    else:
+                        self.assertEqual(rollups[table][first_day][col_name], value, message)
+        # The skipped columns, rolled up from the days. January has 2 + index % 5 samples a day in the raw data. The daily summary has the intensity
+        # times of the days with index % 4 and the other skipped values for the February days with index 21, 22, and 29, which the year prefers too.
+        january = datetime.date(2021, 1, 1)
+        february = datetime.date(2021, 2, 1)
+        january_indexes = range(len(january_days))
+        stress = [10 * index + 7 * hour for index in january_indexes for hour in range(2 + index % 5)]
+        january_expected = {
+            'rhr_avg': 55.0 + sum(index % 6 for index in january_indexes) / len(january_days), 'rhr_min': 55.0, 'rhr_max': 60.0,
+            # stress values of 0 are not counted
+            'stress_avg': sum(stress) / len([value for value in stress if value > 0]),
+            'steps': sum(1000 * (2 + index % 5) + index for index in january_indexes),
+            # with metric units MonitoringClimb divides the ascent by feet_to_floors
+            'floors': sum(3.0 * (1 + index % 5) + index for index in january_indexes) / MonitoringClimb.feet_to_floors,
+            'calories_active_avg': sum(3 * (20 * (2 + index % 5) + index) for index in january_indexes) / len(january_days),
+        }
+        february_expected = {
+            'rhr_avg': (51 + 52 + 51) / 3, 'rhr_min': 51.0, 'rhr_max': 52.0, 'stress_avg': (41 + 42 + 49) / 3,
+            # the steps of February are from the days the daily summary has steps for
+            'steps': 3 * 6000 + 3 * (21 + 22 + 29), 'floors': 2.0 + 1.0 + 2.0, 'calories_active_avg': 30 * (21 + 22 + 29) / 3,
+        }
+        for (table, first_day, indexes, expected) in [
+            (MonthsSummary, january, january_indexes, january_expected),
+            (MonthsSummary, february, range(len(january_days), len(january_days) + len(february_days)), february_expected),
+            (YearsSummary, january, range(len(january_days) + len(february_days)), february_expected),
+        ]:
+            rollup = rollups[table][first_day]
+            for col_name, value in expected.items():
+                self.assertAlmostEqual(rollup[col_name], value, msg=f'{table.__name__} {first_day} {col_name}')
+            daily_summary_indexes = [index for index in indexes if index % 4]
+            moderate_mins = [index % 5 for index in daily_summary_indexes if index % 5]
+            intensity_mins = [index % 5 + 2 * (index % 3) for index in daily_summary_indexes if index % 5 + 2 * (index % 3)]
+            self.assertEqual(rollup['moderate_activity_time'], fitfile.conversions.secs_to_dt_time(int(60 * sum(moderate_mins) / len(moderate_mins))))
+            self.assertEqual(rollup['vigorous_activity_time'], datetime.time(0, sum(index % 3 for index in daily_summary_indexes)))
+            self.assertEqual(rollup['intensity_time'], fitfile.conversions.secs_to_dt_time(int(60 * sum(intensity_mins) / len(intensity_mins))))
+        # the first four weeks of the year are the first four weeks of January
+        self.assertEqual(rollups[YearsSummary][january]['intensity_time_goal'], summaries[MonthsSummary][january]['intensity_time_goal'])
+
+    def test_parallel_summary_matches_serial(self):
+        days = [datetime.date(2021, 12, 20) + datetime.timedelta(days=offset) for offset in range(20)]
+        with self.garmin_db.managed_session() as garmin_session, self.monitoring_db.managed_session() as monitoring_session:
+            for index, day in enumerate(days):
+                RestingHeartRate.s_insert_or_update(garmin_session, {'day': day, 'resting_heart_rate': 55.0 + index % 6})
+                timestamps = [datetime.datetime.combine(day, datetime.time(hour)) for hour in range(6, 8 + index % 5)]
+                s_insert_or_ignore(garmin_session, Stress, [{'timestamp': timestamp, 'stress': 10 * index + 7 * hour} for hour, timestamp in enumerate(timestamps)])
+                s_insert_or_ignore(monitoring_session, MonitoringHeartRate, [
+                    {'timestamp': timestamp + datetime.timedelta(seconds=30), 'heart_rate': 60 + index + 11 * hour} for hour, timestamp in enumerate(timestamps)
+                ])
+                s_insert_or_ignore(monitoring_session, Monitoring, [
+                    {'timestamp': timestamp, 'activity_type': fitfile.field_enums.ActivityType.walking, 'intensity': hour % 2, 'steps': 1000 * hour + index}
+                    for hour, timestamp in enumerate(timestamps)
+                ])
+        Analyze(self.gc_config, 0).summary(full=True)
+        serial = self.__summaries([DaysSummary])
+        Analyze(self.gc_config, 0, workers=2).summary(full=True)
+        parallel = self.__summaries([DaysSummary])
+        self.assertEqual(sorted(serial[DaysSummary]), days)
+        self.assertEqual({first_day.year for first_day in serial[YearsSummary]}, {2021, 2022})
+        self.assertEqual(parallel, serial)
+
+    def test_populate_hr_intensity(self):
+        start_ts = datetime.datetime(2021, 3, 1, 10, 0, 0)
+        monitoring = [(0, 0), (30, 0), (300, 1), (360, 0), (600, 2), (86400 + 100, 3), (86400 + 200, 1)]
+        heart_rates = [10, 45, 80, 90, 360, 419, 420, 86400 + 100, 86400 + 159]
+        with self.monitoring_db.managed_session() as session:
+            s_insert_or_ignore(session, Monitoring, [
+                {'timestamp': start_ts + datetime.timedelta(seconds=secs), 'activity_type': fitfile.field_enums.ActivityType.walking, 'intensity': intensity}
+                for secs, intensity in monitoring
+            ])
+            s_insert_or_ignore(session, MonitoringHeartRate, [
+                {'timestamp': start_ts + datetime.timedelta(seconds=secs), 'heart_rate': 60 + index} for index, secs in enumerate(heart_rates)
+            ])
+        Analyze(self.gc_config, 0).summary(full=True)
+        with self.summary_db.managed_session() as session:
+            intensity_hr = [((row.timestamp - start_ts).total_seconds(), row.intensity, row.heart_rate) for row in session.query(IntensityHR).order_by(IntensityHR.timestamp)]
+        # heart rates in the minute after a monitoring sample that is followed by a gap of more than a minute get the intensity at the end of the gap
+        self.assertEqual(intensity_hr, [(45, 1, 61), (80, 1, 62), (360, 2, 64), (419, 2, 65), (86400 + 100, 1, 67), (86400 + 159, 1, 68)])
+
+
+class TestFitImport(unittest.TestCase):
+    """Class for testing importing FIT files with the import configuration."""
+
+    # the ledger holds the paths of the imported files and the attributes hold the times the databases were created
+    ignored_tables = ['import_ledger', '_attributes']
+
+    def __import(self, base_dir, import_config):
+        config_dir = os.path.join(base_dir, 'config')
+        os.makedirs(config_dir)
+        with open(os.path.join(config_dir, 'GarminConnectConfig.json'), 'w') as file:
+            json.dump({'directories': {'relative_to_home': False, 'base_dir': os.path.join(base_dir, 'HealthData')}, 'import': dict(import_config, commit_files=2)}, file)
+        gc_config = GarminConnectConfigManager(config_dir)
+        self.assertEqual(gc_config.import_workers(), import_config.get('workers', 1))
+        db_params = gc_config.get_db_params()
+        Attributes.set(GarminDb(db_params), 'measurement_system', 'metric')
+        # the generated files are imported together with any FIT files added to test_files
+        test_dirs = {'monitoring': gc_config.get_monitoring_dir(2023), 'sleep': gc_config.get_monitoring_dir(2023), 'activity': gc_config.get_activities_dir()}
+        for test_dir, input_dir in test_dirs.items():
+            if os.path.isdir(f'test_files/fit/{test_dir}'):
+                for file_name in FileProcessor.dir_to_files(f'test_files/fit/{test_dir}', fitfile.file.name_regex, False):
+                    shutil.copy(file_name, input_dir)
+        for day in range(4):
+            start = datetime.datetime(2023, 1, 1 + day, tzinfo=datetime.timezone.utc)
+            fit_file_writer.write_monitoring_file(os.path.join(gc_config.get_monitoring_dir(2023), f'{3000000000 + day}.fit'), start, seed=day)
+            fit_file_writer.write_activity_file(os.path.join(gc_config.get_activities_dir(), f'{4000000000 + day}_ACTIVITY.fit'), start + datetime.timedelta(hours=8))
+        FitImport(gc_config, PluginManager(gc_config.get_plugins_dir(), db_params)).import_all()
+        rows = {}
+        for db_class in [GarminDb, MonitoringDb, ActivitiesDb]:
+            db = db_class(db_params)
+            with db.managed_session() as session:
+                for table in db_class.Base.metadata.sorted_tables:
+                    if table.name not in self.ignored_tables:
+                        rows[table.name] = sorted(session.execute(select(table)).all(), key=repr)
+        return rows
+
+    def test_parallel_import_matches_serial(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            serial = self.__import(os.path.join(temp_dir, 'serial'), {'workers': 1})
+            parallel = self.__import(os.path.join(temp_dir, 'parallel'), {'workers': 3})
+        self.assertGreater(len(serial['monitoring']), 0)
+        self.assertGreater(len(serial['activity_records']), 0)
+        self.assertEqual(len(serial['files']), len(parallel['files']))
+        for table_name, table_rows in serial.items():
+            self.assertEqual(parallel[table_name], table_rows, table_name)
+
+    def test_profiled_import(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            profile_file = os.path.join(temp_dir, 'import_profile.json')
+            rows = self.__import(temp_dir, {'profile_file': profile_file})
+            with open(profile_file) as file:
+                report = json.load(file)
+        # the sleep import checks the monitoring files too
+        self.assertGreaterEqual(report['files'], len(rows['files']))
+        self.assertIn('write', report['totals']['stages'])
+        self.assertEqual(report['totals']['rows']['monitoring'], len(rows['monitoring']))
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,123 @@
+"""Test syncing data to Supabase."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import json
+import datetime
+import tempfile
+import unittest
+import logging
+
+import fitfile
+
+from idbutils import DbParams
+
+from garmindb import SupabaseSync, MockPostgrest, DbSync
+from garmindb.garmindb import GarminDb, DailySummary, Sleep, SyncLedger, ActivitiesDb, Activities
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('sync.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestSync(unittest.TestCase):
+    """Class for testing syncing data to Supabase."""
+
+    tables = {
+        'daily_stats'   : (['calendar_date', 'total_steps', 'resting_heart_rate'], ['calendar_date']),
+        'sleep_summary' : (['calendar_date', 'sleep_seconds'], ['calendar_date']),
+    }
+
+    def test_sync_batches_tables(self):
+        day = datetime.date(2023, 1, 1)
+        daily_stats = [{'calendar_date': day + datetime.timedelta(days=offset), 'total_steps': 1000 * offset, 'unknown_column': offset} for offset in range(25)]
+        daily_stats[3]['resting_heart_rate'] = 50
+        sleep_summary = [{'calendar_date': str(day), 'sleep_seconds': 28800}]
+        with tempfile.TemporaryDirectory() as temp_dir, MockPostgrest(self.tables, key='key', fail_every=4) as mock_postgrest:
+            schema_cache_file = os.path.join(temp_dir, 'columns.json')
+            supabase = SupabaseSync(mock_postgrest.url, 'key', schema_cache_file, chunk_size=10, backoff_seconds=0.01)
+            uploaded = supabase.sync({'daily_stats': daily_stats, 'sleep_summary': sleep_summary, 'activities': []})
+            self.assertEqual(uploaded, {'daily_stats': 25, 'sleep_summary': 1})
+            # Rows with different columns are uploaded separately, so 3 chunks of 24 rows, 1 of 1 row, 1 sleep row, and 2 schema requests plus retries.
+            self.assertEqual(mock_postgrest.requests - mock_postgrest.failed, 7)
+            self.assertGreater(mock_postgrest.failed, 0)
+            rows = {row['calendar_date']: row for row in mock_postgrest.table_rows('daily_stats')}
+            self.assertEqual(len(rows), 25)
+            self.assertEqual(rows['2023-01-04'], {'calendar_date': '2023-01-04', 'total_steps': 3000, 'resting_heart_rate': 50})
+            with open(schema_cache_file) as file:
+                self.assertEqual(json.load(file)['sleep_summary'], ['calendar_date', 'sleep_seconds'])
+            # A new instance uses the cached columns, and fetches them again if the cache is out of date.
+            with open(schema_cache_file, 'w') as file:
+                json.dump({'daily_stats': ['calendar_date', 'total_steps', 'removed_column']}, file)
+            mock_postgrest.fail_every = 0
+            request_count = mock_postgrest.requests
+            supabase = SupabaseSync(mock_postgrest.url, 'key', schema_cache_file)
+            self.assertEqual(supabase.upsert('daily_stats', [{'calendar_date': str(day), 'total_steps': 5, 'removed_column': 1}]), 1)
+            self.assertEqual(mock_postgrest.requests - request_count, 3)
+            self.assertEqual(supabase.table_columns('daily_stats'), set(self.tables['daily_stats'][0]))
+            self.assertEqual(mock_postgrest.table_rows('daily_stats')[0]['total_steps'], 5)
+
+    def test_db_sync_uploads_changes(self):
+        day = datetime.date(2023, 1, 1)
+        tables = {
+            'daily_stats'   : (['calendar_date', 'total_steps', 'resting_heart_rate', 'wellness_description'], ['calendar_date']),
+            'sleep_summary' : (['calendar_date', 'sleep_seconds', 'deep_sleep_seconds'], ['calendar_date']),
+        }
+        with tempfile.TemporaryDirectory() as temp_dir, MockPostgrest(tables, key='key') as mock_postgrest:
+            db_params = DbParams(db_type='sqlite', db_path=temp_dir)
+            garmin_db = GarminDb(db_params)
+            for offset in range(10):
+                DailySummary.insert_or_update(garmin_db, {'day': day + datetime.timedelta(days=offset), 'steps': 1000 * offset, 'rhr': 50})
+                Sleep.insert_or_update(garmin_db, {'day': day + datetime.timedelta(days=offset), 'total_sleep': datetime.time(8), 'deep_sleep': datetime.time(1, 30)})
+            supabase = SupabaseSync(mock_postgrest.url, 'key', os.path.join(temp_dir, 'columns.json'))
+            db_sync = DbSync(db_params, supabase, DbSync.default_tables(fitfile.field_enums.DisplayMeasure.metric))
+            self.assertEqual(db_sync.sync(), {'daily_stats': 10, 'sleep_summary': 10})
+            self.assertEqual(SyncLedger.high_water(garmin_db, 'daily_stats'), '2023-01-10')
+            rows = {row['calendar_date']: row for row in mock_postgrest.table_rows('sleep_summary')}
+            self.assertEqual(rows['2023-01-02'], {'calendar_date': '2023-01-02', 'sleep_seconds': 28800, 'deep_sleep_seconds': 5400})
+            # Nothing changed, so nothing is uploaded and no requests are made.
+            request_count = mock_postgrest.requests
+            self.assertEqual(db_sync.sync(), {})
+            self.assertEqual(mock_postgrest.requests, request_count)
+            # Only new and changed rows are uploaded.
+            DailySummary.insert_or_update(garmin_db, {'day': day + datetime.timedelta(days=9), 'steps': 12345})
+            DailySummary.insert_or_update(garmin_db, {'day': day + datetime.timedelta(days=10), 'steps': 500})
+            self.assertEqual(db_sync.sync(), {'daily_stats': 2})
+            self.assertEqual(SyncLedger.high_water(garmin_db, 'daily_stats'), '2023-01-11')
+            rows = {row['calendar_date']: row for row in mock_postgrest.table_rows('daily_stats')}
+            self.assertEqual(len(rows), 11)
+            self.assertEqual(rows['2023-01-10']['total_steps'], 12345)
+            # Changes to rows older than the high-water mark overlap are only found by a full sync.
+            DailySummary.insert_or_update(garmin_db, {'day': day, 'steps': 42})
+            self.assertEqual(db_sync.sync(), {})
+            self.assertEqual(db_sync.sync(full=True), {'daily_stats': 1})
+            self.assertEqual(mock_postgrest.table_rows('daily_stats')[0]['total_steps'], 42)
+            self.assertEqual(mock_postgrest.uploads, {'daily_stats': 13, 'sleep_summary': 10})
+
+    def test_db_sync_rows_without_time(self):
+        tables = {'activities': (['activity_id', 'activity_name', 'start_time_local'], ['activity_id'])}
+        with tempfile.TemporaryDirectory() as temp_dir, MockPostgrest(tables, key='key') as mock_postgrest:
+            db_params = DbParams(db_type='sqlite', db_path=temp_dir)
+            garmin_db = GarminDb(db_params)
+            activities_db = ActivitiesDb(db_params)
+            Activities.insert_or_update(activities_db, {'activity_id': '1', 'name': 'no start time'})
+            supabase = SupabaseSync(mock_postgrest.url, 'key', os.path.join(temp_dir, 'columns.json'))
+            sync_tables = [sync_table for sync_table in DbSync.default_tables(fitfile.field_enums.DisplayMeasure.metric) if sync_table.remote_table == 'activities']
+            db_sync = DbSync(db_params, supabase, sync_tables)
+            self.assertEqual(db_sync.sync(), {'activities': 1})
+            self.assertIsNone(SyncLedger.high_water(garmin_db, 'activities'))
+            self.assertEqual(db_sync.sync(), {})
+            Activities.insert_or_update(activities_db, {'activity_id': '2', 'name': 'run', 'start_time': datetime.datetime(2023, 1, 1, 8, 0, 0)})
+            self.assertEqual(db_sync.sync(), {'activities': 1})
+            self.assertEqual(SyncLedger.high_water(garmin_db, 'activities'), '2023-01-01T08:00:00')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)